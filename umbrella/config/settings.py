@@ -87,12 +87,39 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'database/db.sqlite3',
+# SQLite is used unless POSTGRES_DB is set. PostgreSQL needs the psycopg driver (poetry install -E postgres).
+if os.getenv('POSTGRES_DB'):
+    # With POSTGRES_POOL, connections are taken from a psycopg pool (Django >= 5.1), which replaces persistent connections.
+    POSTGRES_POOL = os.getenv('POSTGRES_POOL', 'false').lower() == 'true'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB'),
+            'USER': os.getenv('POSTGRES_USER', 'umbrella'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': 0 if POSTGRES_POOL else int(os.getenv('DB_CONN_MAX_AGE', 600)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.getenv('POSTGRES_POOL_MIN_SIZE', 2)),
+                    'max_size': int(os.getenv('POSTGRES_POOL_MAX_SIZE', 10)),
+                },
+            } if POSTGRES_POOL else {},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'database/db.sqlite3',
+            'OPTIONS': {
+                # Wait for the lock of a concurrent writer (e.g. the cron ingestion) instead of failing at once
+                'timeout': int(os.getenv('SQLITE_TIMEOUT', 20)),
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -159,3 +186,38 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Alpha Vantage API Key
 ALPHA_VANTAGE_API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
+
+# Provider rate limits (requests per minute)
+ALPHA_VANTAGE_REQUESTS_PER_MINUTE = int(os.getenv('ALPHA_VANTAGE_REQUESTS_PER_MINUTE', 5))
+YAHOO_FINANCE_REQUESTS_PER_MINUTE = int(os.getenv('YAHOO_FINANCE_REQUESTS_PER_MINUTE', 60))
+
+# Alpha Vantage HTTP timeouts (seconds) and retry policy
+ALPHA_VANTAGE_CONNECT_TIMEOUT = float(os.getenv('ALPHA_VANTAGE_CONNECT_TIMEOUT', 5))
+ALPHA_VANTAGE_READ_TIMEOUT = float(os.getenv('ALPHA_VANTAGE_READ_TIMEOUT', 30))
+ALPHA_VANTAGE_MAX_RETRIES = int(os.getenv('ALPHA_VANTAGE_MAX_RETRIES', 3))
+ALPHA_VANTAGE_BACKOFF_SECONDS = float(os.getenv('ALPHA_VANTAGE_BACKOFF_SECONDS', 2))
+
+# On-disk cache of the raw provider responses, disabled by default: an entry is only keyed by its as-of date, so a
+# same-day re-run would serve the payloads fetched before the close instead of the final close prices
+PROVIDER_CACHE_ENABLED = os.getenv('PROVIDER_CACHE_ENABLED', 'false').lower() == 'true'
+PROVIDER_CACHE_OFFLINE = os.getenv('PROVIDER_CACHE_OFFLINE', 'false').lower() == 'true'
+PROVIDER_CACHE_DIR = os.getenv('PROVIDER_CACHE_DIR', BASE_DIR / 'cache/providers')
+PROVIDER_CACHE_TTL_SECONDS = int(os.getenv('PROVIDER_CACHE_TTL_SECONDS', 24 * 60 * 60))
+PROVIDER_CACHE_MAX_BYTES = int(os.getenv('PROVIDER_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Ordered fallback chain of the data providers, and the circuit breaker applied to each of them
+DATA_PROVIDERS = os.getenv('DATA_PROVIDERS', 'alpha_vantage,yahoo_finance').split(',')
+PROVIDER_BREAKER_FAILURE_THRESHOLD = int(os.getenv('PROVIDER_BREAKER_FAILURE_THRESHOLD', 3))
+PROVIDER_BREAKER_COOLDOWN_SECONDS = float(os.getenv('PROVIDER_BREAKER_COOLDOWN_SECONDS', 300))
+
+# Optional columnar copy of the prices for the analytics (needs pyarrow: poetry install -E parquet), disabled when empty
+PRICE_PARQUET_STORE_DIR = os.getenv('PRICE_PARQUET_STORE_DIR', '')
+
+# In-process matrix of the prices used by the valuation and the VaR, base prices and exchange rates, reloaded
+# after this many seconds to pick up the writes of other processes (writes of the same process reload them at once)
+PRICE_STORE_TTL_SECONDS = int(os.getenv('PRICE_STORE_TTL_SECONDS', 300))
+
+# Freshness of the ingested data: company information is refreshed after this many days, and prices once the
+# session of the ticker's exchange closed, plus a delay for the providers to publish the end-of-day prices
+TICKER_INFO_TTL_DAYS = int(os.getenv('TICKER_INFO_TTL_DAYS', 30))
+PRICE_CLOSE_DELAY_MINUTES = int(os.getenv('PRICE_CLOSE_DELAY_MINUTES', 60))
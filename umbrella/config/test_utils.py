@@ -0,0 +1,22 @@
+import re
+from django.db import connection
+
+
+class QueryPlanAssertionsMixin:
+    """
+    TestCase mixin checking the SQLite query plans of the hot lookup paths.
+    A plan step that scans a table without an index means the query reads the whole table,
+    which gets slower as the price and transaction tables grow.
+    """
+    FULL_SCAN = re.compile(r"\bSCAN (\w+)\b(?! USING (COVERING )?INDEX)")
+
+    def get_query_plan(self, queryset) -> str:
+        return queryset.explain()
+
+    def assertNoFullTableScan(self, queryset):
+        if connection.vendor != "sqlite":
+            self.skipTest("Query plans are only checked on SQLite")
+        plan = self.get_query_plan(queryset)
+        scans = [match.group(1) for match in self.FULL_SCAN.finditer(plan)]
+        if scans:
+            self.fail(f"Full table scan of {', '.join(scans)} in query plan:\n{plan}\nfor query:\n{queryset.query}")
@@ -16,9 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from data_ingestion.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path("metrics", metrics, name="metrics"),
     path('stock_information/', include('data_ingestion.urls')),
     path("transactions/", include("transactions.urls")),
     path("portfolio_valuation/", include("portfolio_valuation.urls")),
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import BaseHistoricalExchangeRate, HistoricalPrice, TickerInfo
+from .models import BaseHistoricalExchangeRate, HistoricalPrice, IngestionRun, TickerFreshness, TickerInfo, WatchlistTicker
 from django.contrib import admin
 from django.contrib import admin
 
@@ -25,4 +25,21 @@ class TickerInfoAdmin(admin.ModelAdmin):
     list_filter = ('sector', 'industry')  
     ordering = ('ticker',) 
 
+@admin.register(IngestionRun)
+class IngestionRunAdmin(admin.ModelAdmin):
+    list_display = ('started_at', 'command', 'status', 'duration_seconds')
+    list_filter = ('command', 'status')
+    ordering = ('-started_at',)
+    date_hierarchy = 'started_at'
 
+@admin.register(WatchlistTicker)
+class WatchlistTickerAdmin(admin.ModelAdmin):
+    list_display = ('ticker', 'note', 'added_at')
+    search_fields = ('ticker', 'note')
+    ordering = ('ticker',)
+
+@admin.register(TickerFreshness)
+class TickerFreshnessAdmin(admin.ModelAdmin):
+    list_display = ('ticker', 'info_refreshed_at', 'prices_refreshed_at')
+    search_fields = ('ticker',)
+    ordering = ('ticker',)
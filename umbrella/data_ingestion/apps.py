@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class HistoricalPricesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'data_ingestion'
+
+    def ready(self):
+        # Connect the signal receivers
+        from data_ingestion import signals  # noqa: F401
@@ -1,10 +1,10 @@
-import os
 import logging
 from dotenv import load_dotenv
 from django.core.management.base import BaseCommand
-from data_ingestion.src.alpha_vantage_client import AlphaVantageClient
-from data_ingestion.src.yahoo_finance_client import YahooFinanceClient
 from data_ingestion.src.database_handler import DatabaseHandler
+from data_ingestion.src.ingestion_runs import record_ingestion_run
+from data_ingestion.src.providers import build_provider_chain
+from data_ingestion.src.universe import mark_refreshed
 from data_ingestion.models import TickerInfo
 
 logger = logging.getLogger(__name__)
@@ -17,19 +17,18 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("--ticker", type=str, required=True, help="Ticker symbol (e.g., AAPL)")
+        parser.add_argument("--offline", action="store_true", help="Only serve the provider responses from the local cache")
 
     def handle(self, *args, **options):
+        with record_ingestion_run("fetch_company_info") as run:
+            self.fetch(options)
+            run.succeeded.append(options["ticker"])
+
+    def fetch(self, options):
         ticker = options["ticker"]
-        try:
-            client = AlphaVantageClient(api_key=os.getenv("ALPHA_VANTAGE_API_KEY"))
-            repository = DatabaseHandler(model=TickerInfo)
-            stock_info = client.get_overview(ticker)
-            repository.save_company_information(ticker, stock_info)
-        except Exception as e:
-            logger.warning(f"AlphaVantage failed: {e}, falling back to YahooFinance.")
-            client = YahooFinanceClient()
-            repository = DatabaseHandler(model=TickerInfo)
-            stock_info = client.get_overview(ticker)
-            repository.save_company_information(ticker, stock_info)
+        providers = build_provider_chain(offline=options["offline"])
+        stock_info, provider = providers.call(ticker, lambda client: client.get_overview(ticker))
+        inserted, updated = DatabaseHandler(model=TickerInfo).save_company_information(ticker, stock_info)
+        mark_refreshed(ticker, info=True)
 
-        self.stdout.write(self.style.SUCCESS(f"Successfully fetched company info for {ticker}"))
+        self.stdout.write(self.style.SUCCESS(f"Successfully fetched company info for {ticker} from {provider} ({inserted} inserted, {updated} updated)"))
@@ -4,6 +4,9 @@ from dotenv import load_dotenv
 from django.core.management.base import BaseCommand, CommandError
 from data_ingestion.src.alpha_vantage_client import AlphaVantageClient
 from data_ingestion.src.database_handler import DatabaseHandler
+from data_ingestion.src.ingestion_runner import ExchangeRateRunner
+from data_ingestion.src.ingestion_runs import record_ingestion_run
+from data_ingestion.src.response_cache import with_cache
 from data_ingestion.src.stock_price_service import StockPriceService
 from data_ingestion.models import BaseHistoricalExchangeRate
 
@@ -13,20 +16,62 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 class Command(BaseCommand):
-    help = "Fetch and save exchange rates for a given currency"
+    help = "Fetch and save the exchange rates to EUR of a given currency, or of every currency in use"
 
     def add_arguments(self, parser):
-        parser.add_argument("--from_currency", type=str, required=True, help="Base currency (e.g., USD)")
+        parser.add_argument("--from_currency", type=str, help="Base currency (e.g., USD). Defaults to every currency of the company information and transactions")
+        parser.add_argument("--workers", type=int, default=4, help="Number of currencies fetched in parallel")
+        parser.add_argument("--stream", action="store_true", help="Parse and write the rates in chunks while they are downloaded, with a bounded memory use")
+        parser.add_argument("--offline", action="store_true", help="Only serve the provider responses from the local cache")
 
     def handle(self, *args, **options):
+        with record_ingestion_run("fetch_exchange_rates") as run:
+            if options["from_currency"] is None:
+                self.fetch_all(run, options)
+            else:
+                self.fetch(options)
+                run.succeeded.append(options["from_currency"])
+
+    def fetch(self, options):
         from_currency = options["from_currency"]
 
-        client = AlphaVantageClient(api_key=os.getenv("ALPHA_VANTAGE_API_KEY"))
+        client = with_cache(AlphaVantageClient(api_key=os.getenv("ALPHA_VANTAGE_API_KEY")), "alpha_vantage", offline=options["offline"])
         repository = DatabaseHandler(model=BaseHistoricalExchangeRate)
         service = StockPriceService(client=client, repository=repository)
 
         try:
-            service.save_daily_exchange_rates(from_currency)
-            self.stdout.write(self.style.SUCCESS(f"Successfully fetched exchange rates for {from_currency}"))
+            if options["stream"]:
+                inserted, updated = service.save_daily_exchange_rates_streaming(from_currency)
+            else:
+                inserted, updated = service.save_daily_exchange_rates(from_currency)
+            self.stdout.write(self.style.SUCCESS(
+                f"Successfully fetched exchange rates for {from_currency} ({inserted} inserted, {updated} updated)"
+            ))
         except Exception as e:
             raise CommandError(f"Failed to fetch exchange rates: {e}")
+
+    def fetch_all(self, run, options):
+        """
+        Fetch the rates to EUR of every currency in use concurrently; the other pairs are derived from them.
+        """
+        failed = run.failed
+
+        def report(result):
+            currency = result["currency"]
+            if result["errors"]:
+                self.stdout.write(self.style.ERROR(f"Failed to fetch exchange rates for {currency}: {'; '.join(result['errors'])}"))
+                failed.append(currency)
+            else:
+                inserted, updated = result["rows"]
+                self.stdout.write(self.style.SUCCESS(
+                    f"Successfully fetched exchange rates for {currency} from {result['rates'][1]} "
+                    f"({inserted} inserted, {updated} updated)"
+                ))
+                run.succeeded.append(currency)
+
+        runner = ExchangeRateRunner(workers=options["workers"], offline=options["offline"])
+        results = runner.run(on_result=report)
+        if not results:
+            self.stdout.write("No currency other than EUR in use")
+        if failed:
+            raise CommandError(f"Failed to fetch exchange rates for {', '.join(failed)}")
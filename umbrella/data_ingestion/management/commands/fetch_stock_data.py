@@ -1,11 +1,11 @@
-import os
 import logging
 from dotenv import load_dotenv
 from django.core.management.base import BaseCommand
-from data_ingestion.src.alpha_vantage_client import AlphaVantageClient
-from data_ingestion.src.yahoo_finance_client import YahooFinanceClient
 from data_ingestion.src.database_handler import DatabaseHandler
+from data_ingestion.src.ingestion_runs import record_ingestion_run
+from data_ingestion.src.providers import build_provider_chain
 from data_ingestion.src.stock_price_service import StockPriceService
+from data_ingestion.src.universe import mark_refreshed
 from data_ingestion.models import HistoricalPrice
 
 logger = logging.getLogger(__name__)
@@ -18,20 +18,37 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("--ticker", type=str, required=True, help="Ticker symbol (e.g., AAPL)")
+        parser.add_argument("--incremental", action="store_true", help="Only fetch and upsert the prices after the last ingested date")
+        parser.add_argument("--stream", action="store_true", help="Parse and write the prices in chunks while they are downloaded, with a bounded memory use")
+        parser.add_argument("--offline", action="store_true", help="Only serve the provider responses from the local cache")
 
     def handle(self, *args, **options):
+        with record_ingestion_run("fetch_stock_data") as run:
+            self.fetch(options)
+            run.succeeded.append(options["ticker"])
+
+    def fetch(self, options):
         ticker = options["ticker"]
+        incremental = options["incremental"]
+
+        repository = DatabaseHandler(model=HistoricalPrice)
+        providers = build_provider_chain(offline=options["offline"])
+        if options["stream"]:
+            (inserted, updated), provider = providers.call(
+                ticker,
+                lambda client: StockPriceService(client=client, repository=repository).save_daily_prices_streaming(
+                    ticker, incremental=incremental
+                ),
+                names=providers.supporting("stream_daily_time_series"),
+            )
+        else:
+            (currency, prices, replace), provider = providers.call(
+                ticker,
+                lambda client: StockPriceService(client=client, repository=repository).fetch_daily_prices(
+                    ticker, incremental=incremental
+                ),
+            )
+            inserted, updated = repository.save_prices(ticker, currency, prices, replace=replace)
+        mark_refreshed(ticker, prices=True)
 
-        try:
-            client = AlphaVantageClient(api_key=os.getenv("ALPHA_VANTAGE_API_KEY"))
-            repository = DatabaseHandler(model=HistoricalPrice)
-            service = StockPriceService(client=client, repository=repository)
-            service.save_daily_prices(ticker)
-        except Exception as e:
-            logger.warning(f"AlphaVantage failed: {e}, falling back to YahooFinance.")
-            client = YahooFinanceClient()
-            repository = DatabaseHandler(model=HistoricalPrice)
-            service = StockPriceService(client=client, repository=repository)
-            service.save_daily_prices(ticker)
-
-        self.stdout.write(self.style.SUCCESS(f"Successfully fetched and saved data for {ticker}"))
+        self.stdout.write(self.style.SUCCESS(f"Successfully fetched and saved data for {ticker} from {provider} ({inserted} inserted, {updated} updated)"))
@@ -1,43 +1,80 @@
 from django.core.management.base import BaseCommand
-from django.core.management import call_command
+from data_ingestion.src.ingestion_runner import ExchangeRateRunner, IngestionRunner, get_required_currencies
+from data_ingestion.src.ingestion_runs import record_ingestion_run
+from data_ingestion.src.providers import build_provider_chain
+from data_ingestion.src.universe import get_universe, plan_ingestion
 
 
 class Command(BaseCommand):
     help = "Run all daily data fetching tasks"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Number of tickers fetched in parallel")
+        parser.add_argument("--offline", action="store_true", help="Only serve the provider responses from the local cache")
+        parser.add_argument("--all", action="store_true", help="Refresh every ticker of the universe, even when its data is fresh")
+
     def handle(self, *args, **options):
-        success, failed = [], []
-
-        # 1. Fetch exchange rates first
-        self.stdout.write("Fetching exchange rates (USD)...")
-        try:
-            call_command("fetch_exchange_rates", "--from_currency=USD")
-            self.stdout.write(self.style.SUCCESS("Successfully fetched exchange rates"))
-            success.append("exchange_rates")
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Failed to fetch exchange rates: {e}"))
-            failed.append("exchange_rates")
-
-        # 2. Fetch stock data for all tickers
-        tickers = ["AMD", "CRM", "NVDA", "MSFT", "PHYS", "RITM", "SGLD.MI", "SPYD.DE", "SXLP.MI", "WIX", "SPY"]
-
-        for ticker in tickers:
-            self.stdout.write(f"Fetching data for {ticker}...")
-            try:
-                call_command("fetch_company_info", f"--ticker={ticker}")
-                self.stdout.write(self.style.SUCCESS(f"Successfully fetched company info for {ticker}"))
-                success.append(ticker)
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f"Failed to fetch company info for {ticker}: {e}"))
+        # The run and the metrics it recorded are saved as an IngestionRun, exposed by the /metrics endpoint
+        with record_ingestion_run("run_daily_tasks") as run:
+            self.run_tasks(run, options)
+
+    def run_tasks(self, run, options):
+        success, failed = run.succeeded, run.failed
+
+        providers = build_provider_chain(offline=options["offline"])
+
+        def report_rates(result):
+            name = f"exchange_rates_{result['currency']}"
+            if result["errors"]:
+                self.stdout.write(self.style.ERROR(f"Failed to fetch exchange rates for {result['currency']}: {'; '.join(result['errors'])}"))
+                failed.append(name)
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Successfully fetched exchange rates for {result['currency']}"))
+                success.append(name)
+
+        # 1. Fetch the exchange rates to EUR of every currency in use first
+        self.stdout.write("Fetching exchange rates...")
+        # The currency of a ticker is only known once its company information is stored, so USD is always fetched
+        # for the US listed tickers ingested on a fresh database. The rates of any other currency first seen
+        # in step 2 are fetched by the IngestionRunner before the prices of its tickers
+        currencies = sorted(set(get_required_currencies()) | {"USD"})
+        ExchangeRateRunner(workers=options["workers"], providers=providers).run(currencies, on_result=report_rates)
+
+        # 2. Fetch company info and stock data of the tickers held, held in the past or on the watchlist,
+        # skipping what is still fresh
+        plan = plan_ingestion(force=options["all"])
+        tickers = list(plan)
+        skipped = len(get_universe()) - len(tickers)
+
+        def report(result):
+            ticker = result["ticker"]
+            timings = f"fetched in {result['fetch_seconds']:.2f}s, written in {result['write_seconds']:.2f}s"
+            if result["errors"]:
+                self.stdout.write(self.style.ERROR(f"Failed to fetch data for {ticker} ({timings}): {'; '.join(result['errors'])}"))
                 failed.append(ticker)
-            try:
-                call_command("fetch_stock_data", f"--ticker={ticker}")
-                self.stdout.write(self.style.SUCCESS(f"Successfully fetched data for {ticker}"))
+            else:
+                parts = [timings]
+                if result["rows"]:
+                    inserted, updated = result["rows"]
+                    parts.append(f"{inserted} inserted, {updated} updated")
+                if not result["info"]:
+                    parts.append("company info fresh")
+                self.stdout.write(self.style.SUCCESS(f"Successfully fetched data for {ticker} ({', '.join(parts)})"))
                 success.append(ticker)
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f"Failed to fetch data for {ticker}: {e}"))
-                failed.append(ticker)
+
+        self.stdout.write(
+            f"Fetching data for {len(tickers)} tickers with {options['workers']} workers "
+            f"({skipped} skipped as fresh)..."
+        )
+        runner = IngestionRunner(workers=options["workers"], providers=providers)
+        runner.run(tickers, incremental=True, on_result=report, plan=plan, on_rates=report_rates)
 
         # Summary
         self.stdout.write("\n✅ Success: " + ", ".join(success) if success else "✅ None succeeded")
         self.stdout.write("❌ Failed: " + ", ".join(failed) if failed else "❌ None failed")
+        for health in runner.providers.health():
+            latency = f"avg {health['avg_seconds']:.2f}s, max {health['max_seconds']:.2f}s" if health["calls"] else "no call"
+            self.stdout.write(
+                f"Provider {health['name']}: {health['state']}, {health['calls']} calls, {health['failures']} failed, "
+                f"{health['skipped']} skipped ({latency})"
+            )
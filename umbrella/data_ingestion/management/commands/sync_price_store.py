@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from data_ingestion.src.parquet_store import get_parquet_store
+
+
+class Command(BaseCommand):
+    help = "Rebuild the Parquet price store from the HistoricalPrice table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ticker", type=str, action="append", help="Ticker to sync (repeatable). Defaults to all the tickers.")
+
+    def handle(self, *args, **options):
+        store = get_parquet_store()
+        if store is None:
+            raise CommandError("The Parquet price store is disabled, set PRICE_PARQUET_STORE_DIR to enable it.")
+
+        written = store.sync_all(options["ticker"])
+        self.stdout.write(self.style.SUCCESS(f"Synced {written} prices to {store.directory}"))
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:41
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicates(apps, schema_editor):
+    """
+    Keep only the most recently inserted row for each key, so that the unique constraints can be created.
+    """
+    for model_name, key in [
+        ("HistoricalPrice", ("ticker", "date")),
+        ("BaseHistoricalExchangeRate", ("from_currency", "to_currency", "date")),
+        ("TickerInfo", ("ticker",)),
+    ]:
+        model = apps.get_model("data_ingestion", model_name)
+        keep_ids = model.objects.values(*key).annotate(keep_id=Max("id")).values("keep_id")
+        model.objects.exclude(id__in=keep_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_ingestion', '0002_historicalprice_nav'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tickerinfo',
+            name='ticker',
+            field=models.CharField(max_length=10, unique=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='basehistoricalexchangerate',
+            unique_together={('from_currency', 'to_currency', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='historicalprice',
+            unique_together={('ticker', 'date')},
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_ingestion', '0003_unique_price_rate_ticker'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='basehistoricalexchangerate',
+            name='close',
+            field=models.DecimalField(decimal_places=8, max_digits=18, null=True),
+        ),
+        migrations.AlterField(
+            model_name='basehistoricalexchangerate',
+            name='high',
+            field=models.DecimalField(decimal_places=8, max_digits=18, null=True),
+        ),
+        migrations.AlterField(
+            model_name='basehistoricalexchangerate',
+            name='low',
+            field=models.DecimalField(decimal_places=8, max_digits=18, null=True),
+        ),
+        migrations.AlterField(
+            model_name='basehistoricalexchangerate',
+            name='open',
+            field=models.DecimalField(decimal_places=8, max_digits=18, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_ingestion', '0004_exchange_rate_precision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(max_length=50)),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('duration_seconds', models.FloatField(null=True)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('success', 'Success'), ('partial', 'Partial'), ('failed', 'Failed')], default='running', max_length=10)),
+                ('succeeded', models.JSONField(default=list)),
+                ('failed', models.JSONField(default=list)),
+                ('metrics', models.JSONField(default=list)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['command', 'started_at'], name='ingestion_run_command_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_ingestion', '0005_ingestionrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TickerFreshness',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(max_length=10, unique=True)),
+                ('info_refreshed_at', models.DateTimeField(null=True)),
+                ('prices_refreshed_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WatchlistTicker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(max_length=10, unique=True)),
+                ('note', models.TextField(blank=True, default='')),
+                ('added_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:11
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_ingestion', '0006_watchlist_ticker_freshness'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='historicalprice',
+            name='nav',
+        ),
+    ]
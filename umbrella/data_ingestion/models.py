@@ -16,9 +16,11 @@ class HistoricalPrice(models.Model):
     high_euro = models.DecimalField(max_digits=10, decimal_places=2, null=True)
     low_euro = models.DecimalField(max_digits=10, decimal_places=2, null=True)
     close_euro = models.DecimalField(max_digits=10, decimal_places=2, null=True)
-    nav = models.DecimalField(max_digits=10, decimal_places=4, null=True)
     date = models.DateField()
 
+    class Meta:
+        unique_together = ("ticker", "date")
+
 class BaseHistoricalExchangeRate(models.Model):
     """
     Model for storing historical exchange rate data between two currencies.
@@ -26,18 +28,22 @@ class BaseHistoricalExchangeRate(models.Model):
     """
     from_currency = models.CharField(max_length=3)
     to_currency = models.CharField(max_length=3)
-    open = models.DecimalField(max_digits=10, decimal_places=2, null=True)
-    high = models.DecimalField(max_digits=10, decimal_places=2, null=True)
-    low = models.DecimalField(max_digits=10, decimal_places=2, null=True)
-    close = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    # 8 decimal places, as the rates of some currencies to EUR are far below 1 (e.g. JPY) and are used to derive cross rates
+    open = models.DecimalField(max_digits=18, decimal_places=8, null=True)
+    high = models.DecimalField(max_digits=18, decimal_places=8, null=True)
+    low = models.DecimalField(max_digits=18, decimal_places=8, null=True)
+    close = models.DecimalField(max_digits=18, decimal_places=8, null=True)
     date = models.DateField()
 
+    class Meta:
+        unique_together = ("from_currency", "to_currency", "date")
+
 class TickerInfo(models.Model):
     """
     Model for storing additional information about a financial instrument.
     Tracks details such as name, description, sector, industry, market cap, etc.
     """
-    ticker = models.CharField(max_length=10)
+    ticker = models.CharField(max_length=10, unique=True)
     name = models.TextField(null=True)
     description = models.TextField(null=True)
     sector = models.TextField(null=True)
@@ -87,3 +93,49 @@ class TickerInfo(models.Model):
     shares_outstanding = models.BigIntegerField(null=True)
     dividend_date = models.DateField(null=True)
     ex_dividend_date = models.DateField(null=True)
+
+class WatchlistTicker(models.Model):
+    """
+    Model for storing the tickers ingested on top of the ones the fund traded, e.g. candidates for a purchase.
+    """
+    ticker = models.CharField(max_length=10, unique=True)
+    note = models.TextField(blank=True, default="")
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.ticker
+
+class TickerFreshness(models.Model):
+    """
+    Model for storing when the company information and the prices of a ticker were last refreshed,
+    so that the daily ingestion only calls the providers for the data that may have changed.
+    """
+    ticker = models.CharField(max_length=10, unique=True)
+    info_refreshed_at = models.DateTimeField(null=True)
+    prices_refreshed_at = models.DateTimeField(null=True)
+
+class IngestionRun(models.Model):
+    """
+    Model for storing the runs of the ingestion commands.
+    Tracks the duration, the outcome and the metrics recorded during each run (API latency, bytes downloaded,
+    rows written, stage durations and failures), so that the ingestion throughput can be followed over time.
+    """
+    class Status(models.TextChoices):
+        RUNNING = "running"
+        SUCCESS = "success"
+        PARTIAL = "partial"
+        FAILED = "failed"
+
+    command = models.CharField(max_length=50)
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True)
+    duration_seconds = models.FloatField(null=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.RUNNING)
+    succeeded = models.JSONField(default=list)  # tickers and currencies ingested
+    failed = models.JSONField(default=list)
+    metrics = models.JSONField(default=list)  # {"name", "labels", "value"} increase of each metric series during the run
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["command", "started_at"], name="ingestion_run_command_idx"),
+        ]
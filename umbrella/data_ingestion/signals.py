@@ -0,0 +1,57 @@
+import logging
+from django.dispatch import Signal, receiver
+from data_ingestion.src.parquet_store import get_parquet_store
+from data_ingestion.src import price_store
+from data_ingestion.src.exchange_rate_cache import get_exchange_rate_cache
+from data_ingestion.src.base_prices import get_base_price_index
+
+logger = logging.getLogger(__name__)
+
+# Sent once the prices of a ticker were written to the database and committed.
+# Arguments: ticker, first_date and last_date of the range of dates whose prices changed
+# (both None when any date may have changed).
+prices_saved = Signal()
+
+# Sent once the exchange rates of a currency pair were written to the database and committed.
+# Arguments: from_currency and to_currency.
+exchange_rates_saved = Signal()
+
+
+@receiver(prices_saved)
+def sync_parquet_store(sender, ticker, first_date=None, last_date=None, **kwargs):
+    """
+    Keep the Parquet price store, when it is enabled, in sync with the written prices.
+    """
+    store = get_parquet_store()
+    if store is None:
+        return
+    try:
+        store.sync_ticker(ticker, first_date, last_date)
+    except Exception as e:
+        # The store can always be rebuilt from the database with the sync_price_store command
+        logger.error(f"Failed to sync the Parquet store for {ticker}: {e}")
+
+
+@receiver(prices_saved)
+def invalidate_base_prices(sender, ticker, first_date=None, last_date=None, **kwargs):
+    """
+    Drop the base prices of the ticker that the written range may have changed.
+    """
+    get_base_price_index().invalidate(ticker, first_date)
+
+
+@receiver(prices_saved)
+@receiver(exchange_rates_saved)
+def invalidate_price_store(sender, **kwargs):
+    """
+    Reload the in-process PriceStore on its next use.
+    """
+    price_store.invalidate()
+
+
+@receiver(exchange_rates_saved)
+def invalidate_exchange_rate_cache(sender, from_currency, to_currency, **kwargs):
+    """
+    Drop the cross rates of the readers derived from the saved currency.
+    """
+    get_exchange_rate_cache().invalidate(from_currency)
@@ -1,34 +1,213 @@
+import random
+import threading
+import time
 import requests
-from data_ingestion.src.api_fetcher import APIFetcher
+from requests.adapters import HTTPAdapter
+from datetime import date, timedelta
+from django.conf import settings
+from data_ingestion.src.api_fetcher import (
+    APIFetcher,
+    ProviderError,
+    ProviderUnavailableError,
+    ProviderRateLimitError,
+    ProviderDataError,
+)
+from data_ingestion.src.json_stream import JSONObjectStream
+from data_ingestion.src.metrics import PROVIDER_BYTES, PROVIDER_REQUEST_SECONDS, PROVIDER_RETRIES, timed
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Name of the provider in the metrics
+PROVIDER_NAME = "alpha_vantage"
+# The compact output only holds the latest 100 data points, i.e. roughly 140 calendar days.
+COMPACT_WINDOW_DAYS = 140
+# Upper bound of a single backoff sleep, in seconds
+MAX_BACKOFF_SECONDS = 60
+# Size of the chunks read from a streamed response, in bytes
+STREAM_CHUNK_BYTES = 64 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Return the HTTP session shared by every AlphaVantageClient of the process.
+    Keeping the connections alive avoids a new TCP/TLS handshake for each call.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
 class AlphaVantageClient(APIFetcher):
     """
     This class is used to get data from the Alpha Vantage API.
+    Requests go through a pooled keep-alive session with connect/read timeouts, and are retried with a jittered
+    exponential backoff on network errors, 429/5xx responses and Alpha Vantage throttling messages.
+    Failures are raised as ProviderError subclasses.
     """
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, rate_limiter=None, timeout=None, max_retries=None, backoff=None, session=None):
+        """
+        Args:
+            api_key (str): The Alpha Vantage API key
+            rate_limiter (TokenBucket, optional): Limiter shared by every caller of the API
+            timeout (tuple, optional): (connect, read) timeouts in seconds. Defaults to the settings.
+            max_retries (int, optional): Number of retries after the first attempt. Defaults to the settings.
+            backoff (float, optional): Base of the exponential backoff in seconds. Defaults to the settings.
+            session (requests.Session, optional): Session to use instead of the shared one
+        """
         self.api_key = api_key
         self.api_url = "https://www.alphavantage.co/query"
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout or (settings.ALPHA_VANTAGE_CONNECT_TIMEOUT, settings.ALPHA_VANTAGE_READ_TIMEOUT)
+        self.max_retries = settings.ALPHA_VANTAGE_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.ALPHA_VANTAGE_BACKOFF_SECONDS if backoff is None else backoff
+        self.session = session or get_session()
+
+    def _sleep_before_retry(self, attempt: int, retry_after=None):
+        delay = min(self.backoff * 2 ** attempt, MAX_BACKOFF_SECONDS) * random.uniform(0.5, 1.5)
+        if retry_after:
+            delay = max(delay, retry_after)
+        time.sleep(delay)
 
-            
-    def get_daily_time_series(self, ticker: str) -> dict:
+    def _get(self, params: dict, stream_key: str = None):
         """
-        Get the daily stock price series for a given ticker.
+        Call the API with the given parameters and return the decoded JSON payload.
+        With a stream_key, the response is streamed instead: a JSONObjectStream positioned on that member of the
+        payload is returned, or the decoded payload when it does not contain the member (e.g. an error message).
         """
-        params = {
+        what = params.get("symbol") or params.get("from_symbol")
+        endpoint = params.get("function")
+        # Backoff before the next attempt, slept outside of the timed request: (attempt, retry_after)
+        pending_backoff = None
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            if pending_backoff:
+                self._sleep_before_retry(*pending_backoff)
+                pending_backoff = None
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+
+            with timed(PROVIDER_REQUEST_SECONDS, provider=PROVIDER_NAME, endpoint=endpoint) as labels:
+                try:
+                    response = self.session.get(self.api_url, params=params, timeout=self.timeout, stream=bool(stream_key))
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                    logger.warning(f"Alpha Vantage request for {what} failed (attempt {attempt + 1}): {err}")
+                    if last_attempt:
+                        raise ProviderUnavailableError(f"Alpha Vantage unreachable for {what}: {err}") from err
+                    labels["outcome"] = "retry"
+                    PROVIDER_RETRIES.inc(provider=PROVIDER_NAME, reason="network")
+                    pending_backoff = (attempt, None)
+                    continue
+                except requests.exceptions.RequestException as err:
+                    raise ProviderError(f"Alpha Vantage request for {what} failed: {err}") from err
+
+                if response.status_code == 429 or response.status_code >= 500:
+                    response.close()
+                    logger.warning(f"Alpha Vantage returned {response.status_code} for {what} (attempt {attempt + 1})")
+                    if last_attempt:
+                        error = ProviderRateLimitError if response.status_code == 429 else ProviderUnavailableError
+                        raise error(f"Alpha Vantage returned {response.status_code} for {what}")
+                    labels["outcome"] = "retry"
+                    PROVIDER_RETRIES.inc(provider=PROVIDER_NAME, reason=str(response.status_code))
+                    retry_after = response.headers.get("Retry-After")
+                    pending_backoff = (attempt, float(retry_after) if retry_after and retry_after.isdigit() else None)
+                    continue
+                if response.status_code >= 400:
+                    raise ProviderError(f"Alpha Vantage returned {response.status_code} for {what}")
+
+                try:
+                    if stream_key:
+                        stream = JSONObjectStream(
+                            self._count_bytes(response.iter_content(chunk_size=STREAM_CHUNK_BYTES), endpoint),
+                            stream_key,
+                            on_close=response.close,
+                        )
+                        data = stream.open()
+                        if data is None:
+                            return stream
+                    else:
+                        PROVIDER_BYTES.inc(len(response.content), provider=PROVIDER_NAME, endpoint=endpoint)
+                        data = response.json()
+                except ValueError as err:
+                    response.close()
+                    raise ProviderDataError(f"Invalid JSON returned by Alpha Vantage for {what}") from err
+
+                if "Error Message" in data:
+                    raise ProviderDataError(f"Alpha Vantage error for {what}: {data['Error Message']}")
+                # Throttled calls are answered with a 200 and a "Note" or "Information" message instead of the data
+                message = data.get("Note") or data.get("Information")
+                if message:
+                    logger.warning(f"Alpha Vantage throttled the request for {what} (attempt {attempt + 1}): {message}")
+                    if last_attempt or "per day" in message:
+                        raise ProviderRateLimitError(f"Alpha Vantage throttled the request for {what}: {message}")
+                    labels["outcome"] = "retry"
+                    PROVIDER_RETRIES.inc(provider=PROVIDER_NAME, reason="throttled")
+                    pending_backoff = (attempt, None)
+                    continue
+                return data
+
+    @staticmethod
+    def _count_bytes(chunks, endpoint: str):
+        """
+        Pass the chunks of a streamed response through, counting the downloaded bytes.
+        """
+        for chunk in chunks:
+            PROVIDER_BYTES.inc(len(chunk), provider=PROVIDER_NAME, endpoint=endpoint)
+            yield chunk
+
+    @staticmethod
+    def _iter_stream(stream: JSONObjectStream, what: str):
+        """
+        Iterate over a streamed response, raising the errors met while downloading it as ProviderError subclasses.
+        """
+        try:
+            yield from stream
+        except requests.exceptions.RequestException as err:
+            raise ProviderUnavailableError(f"Alpha Vantage stream interrupted for {what}: {err}") from err
+        except ValueError as err:
+            raise ProviderDataError(f"Invalid JSON returned by Alpha Vantage for {what}: {err}") from err
+
+    def _daily_time_series_params(self, ticker: str, start_date: date = None) -> dict:
+        outputsize = "full"
+        if start_date and start_date >= date.today() - timedelta(days=COMPACT_WINDOW_DAYS):
+            outputsize = "compact"
+        return {
             "function": "TIME_SERIES_DAILY",
             "symbol": ticker,
             "apikey": self.api_key,
-            "outputsize": "full"
+            "outputsize": outputsize
         }
-        try:
-            response = requests.get(self.api_url, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as err:
-            logger.error(f"Request error occurred: {err}")
+
+    def get_daily_time_series(self, ticker: str, start_date: date = None) -> dict:
+        """
+        Get the daily stock price series for a given ticker.
+        When a start date within the compact window is given, only the latest 100 data points are requested.
+        """
+        data = self._get(self._daily_time_series_params(ticker, start_date))
+        if "Time Series (Daily)" not in data:
+            logger.warning(f"No time series found for ticker: {ticker}")
+            raise ProviderDataError(f"No time series found for ticker: {ticker}")
+        return data
+
+    def stream_daily_time_series(self, ticker: str, start_date: date = None):
+        """
+        Same as get_daily_time_series, but returns an iterator over the (date, values) pairs of the time series,
+        latest first, which are parsed while the response is being downloaded.
+        Closing the iterator early (e.g. once the needed history is read) stops the download.
+        """
+        stream = self._get(self._daily_time_series_params(ticker, start_date), stream_key="Time Series (Daily)")
+        if not isinstance(stream, JSONObjectStream):
+            logger.warning(f"No time series found for ticker: {ticker}")
+            raise ProviderDataError(f"No time series found for ticker: {ticker}")
+        return self._iter_stream(stream, ticker)
 
     def get_overview(self, ticker: str) -> dict:
         """
@@ -39,29 +218,38 @@ class AlphaVantageClient(APIFetcher):
             "symbol": ticker,
             "apikey": self.api_key
         }
-        response = requests.get(self.api_url, params=params)
-        response.raise_for_status()
-        data = response.json()
+        data = self._get(params)
         if not data:
             logger.warning(f"No data found for ticker: {ticker}")
-            raise ValueError(f"No data found for ticker: {ticker}")
+            raise ProviderDataError(f"No data found for ticker: {ticker}")
         return data
 
-    def get_exchange_rates(self, from_symbol: str, to_symbol="EUR") -> dict:
-        """
-        Get the exchange rates for a given currency pair.
-        """
-        params = {
+    def _exchange_rates_params(self, from_symbol: str, to_symbol: str) -> dict:
+        return {
             "function": "FX_DAILY",
             "from_symbol": from_symbol,
             "to_symbol": to_symbol,
             "outputsize": "full",
             "apikey": self.api_key
         }
-        response = requests.get(self.api_url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        if not data:
+
+    def get_exchange_rates(self, from_symbol: str, to_symbol="EUR") -> dict:
+        """
+        Get the exchange rates for a given currency pair.
+        """
+        data = self._get(self._exchange_rates_params(from_symbol, to_symbol))
+        if "Time Series FX (Daily)" not in data:
             logger.warning(f"No data found for rates: {from_symbol} to {to_symbol}")
-            raise ValueError(f"No data found for rates: {from_symbol} to {to_symbol}")
+            raise ProviderDataError(f"No data found for rates: {from_symbol} to {to_symbol}")
         return data
+
+    def stream_exchange_rates(self, from_symbol: str, to_symbol="EUR"):
+        """
+        Same as get_exchange_rates, but returns an iterator over the (date, values) pairs of the rates,
+        which are parsed while the response is being downloaded.
+        """
+        stream = self._get(self._exchange_rates_params(from_symbol, to_symbol), stream_key="Time Series FX (Daily)")
+        if not isinstance(stream, JSONObjectStream):
+            logger.warning(f"No data found for rates: {from_symbol} to {to_symbol}")
+            raise ProviderDataError(f"No data found for rates: {from_symbol} to {to_symbol}")
+        return self._iter_stream(stream, f"{from_symbol}/{to_symbol}")
@@ -1,12 +1,14 @@
 
 
 class APIFetcher:
-    def get_daily_time_series(self, ticker: str) -> dict:
+    def get_daily_time_series(self, ticker: str, start_date=None) -> dict:
         """
         Fetch daily stock price series for a given ticker.
         
         Args:
             ticker (str): The stock ticker symbol
+            start_date (date, optional): Only the data from this date onwards is needed.
+                Providers may return more, but should request as little as they can.
             
         Returns:
             dict: A dictionary containing the daily time series data
@@ -32,4 +34,28 @@ class APIFetcher:
         Returns:
             dict: A dictionary containing the stock overview data
         """
-        raise NotImplementedError("This method should be implemented by subclasses.")
\ No newline at end of file
+        raise NotImplementedError("This method should be implemented by subclasses.")
+
+
+class ProviderError(Exception):
+    """
+    Base class of the errors raised by the API clients.
+    """
+
+
+class ProviderUnavailableError(ProviderError):
+    """
+    The provider could not be reached or kept failing (timeouts, connection errors, 5xx) after all retries.
+    """
+
+
+class ProviderRateLimitError(ProviderUnavailableError):
+    """
+    The provider kept throttling the requests after all retries, or the daily quota is exhausted.
+    """
+
+
+class ProviderDataError(ProviderError, ValueError):
+    """
+    The provider answered, but with an error message or without the requested data.
+    """
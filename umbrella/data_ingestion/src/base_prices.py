@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from data_ingestion.models import HistoricalPrice
+from transactions.models import Transaction
+
+logger = logging.getLogger(__name__)
+
+# Number of (ticker, base date) pairs kept in memory, the oldest being evicted first
+MAX_BASE_PRICES = 4096
+
+
+def get_default_base_date():
+    """
+    Return the date of the first transaction, on which the prices are rebased by default, or None without transactions.
+    """
+    return Transaction.objects.order_by("date").values_list("date", flat=True).first()
+
+
+def rebase(close, base_price):
+    """
+    Return a close price rebased on a base price (1.0 on the base date) with 4 decimal places, or None without base price.
+    """
+    if close is None or not base_price:
+        return None
+    return (Decimal(close) / Decimal(base_price)).quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
+
+
+class BasePriceIndex:
+    """
+    In-memory index of the base prices used to rebase the price series, keyed by (ticker, base date).
+    The base price is the close of the ticker as of the base date: its last close on or before it,
+    so that a base date falling on a holiday of the ticker's exchange still has a base price.
+    The rebased series are computed at read time, so a backdated first transaction needs no re-ingestion.
+    The base prices are dropped when prices are saved by this process, and expire after PRICE_STORE_TTL_SECONDS
+    for the writes of other processes (e.g. the ingestion commands). Missing base prices are not cached, so a
+    ticker is rebased as soon as its first prices are ingested.
+    """
+    def __init__(self, max_size: int = MAX_BASE_PRICES, ttl_seconds: float = None):
+        self.max_size = max_size
+        self.ttl_seconds = settings.PRICE_STORE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        # (ticker, base date) -> (base price, monotonic time it was read)
+        self.prices = {}
+        self.lock = threading.Lock()
+
+    def get(self, ticker: str, base_date) -> Decimal:
+        """
+        Return the close of a ticker as of a date, or None when no price is stored on or before it.
+        """
+        key = (ticker, base_date)
+        with self.lock:
+            if key in self.prices:
+                price, loaded_at = self.prices[key]
+                if time.monotonic() - loaded_at < self.ttl_seconds:
+                    return price
+                del self.prices[key]
+        price = (
+            HistoricalPrice.objects.filter(ticker=ticker, date__lte=base_date)
+            .order_by("-date")
+            .values_list("close", flat=True)
+            .first()
+        )
+        if price is None:
+            logger.warning(f"No price of {ticker} on or before {base_date}, it cannot be rebased")
+            return None
+        with self.lock:
+            if len(self.prices) >= self.max_size:
+                del self.prices[next(iter(self.prices))]
+            self.prices[key] = (price, time.monotonic())
+        return price
+
+    def invalidate(self, ticker: str = None, first_date=None):
+        """
+        Drop the base prices of a ticker (or of every ticker) whose base date is on or after first_date (or any date),
+        e.g. after new prices were saved.
+        """
+        with self.lock:
+            for key in list(self.prices):
+                if (ticker is None or key[0] == ticker) and (first_date is None or key[1] >= first_date):
+                    del self.prices[key]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_base_price_index() -> BasePriceIndex:
+    """
+    Return the BasePriceIndex shared by the readers of the process. It is updated whenever prices are saved
+    by the process, and its base prices expire after PRICE_STORE_TTL_SECONDS.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = BasePriceIndex()
+        return _index
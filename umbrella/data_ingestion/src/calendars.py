@@ -0,0 +1,115 @@
+import logging
+import threading
+from functools import lru_cache
+import pandas as pd
+import pandas_market_calendars as mcal
+from transactions.models import Transaction
+
+logger = logging.getLogger(__name__)
+
+# Exchange calendar of the tickers, by ticker suffix (Yahoo Finance convention). Tickers without suffix are US listed.
+EXCHANGE_CALENDARS = {
+    ".MI": "XMIL",
+    ".DE": "XETR",
+    ".PA": "XPAR",
+    ".AS": "XAMS",
+    ".L": "LSE",
+    ".SW": "XSWX",
+    ".TO": "TSX",
+}
+DEFAULT_CALENDAR = "NYSE"
+
+_lock = threading.Lock()
+
+
+def get_calendar_name(ticker: str) -> str:
+    """
+    Return the name of the exchange calendar of a ticker, from its suffix.
+    """
+    if "." in ticker:
+        suffix = ticker[ticker.rindex("."):].upper()
+        if suffix in EXCHANGE_CALENDARS:
+            return EXCHANGE_CALENDARS[suffix]
+        logger.warning(f"No exchange calendar known for {ticker}, using {DEFAULT_CALENDAR}")
+    return DEFAULT_CALENDAR
+
+
+@lru_cache(maxsize=None)
+def _year_sessions(calendar_name: str, year: int) -> pd.DatetimeIndex:
+    """
+    Trading sessions of a calendar for a whole year. Building them is slow, so they are computed once per process.
+    """
+    with _lock:
+        days = mcal.get_calendar(calendar_name).valid_days(f"{year}-01-01", f"{year}-12-31")
+    return days.tz_localize(None).normalize()
+
+
+@lru_cache(maxsize=None)
+def _year_closes(calendar_name: str, year: int) -> pd.DatetimeIndex:
+    """
+    Closing times (UTC) of the trading sessions of a calendar for a whole year, computed once per process.
+    """
+    with _lock:
+        schedule = mcal.get_calendar(calendar_name).schedule(f"{year}-01-01", f"{year}-12-31")
+    return pd.DatetimeIndex(schedule["market_close"])
+
+
+def get_last_close(ticker: str, now=None) -> pd.Timestamp:
+    """
+    Return the closing time (UTC) of the last session of the exchange of a ticker that closed at or before `now`
+    (defaults to the current time), or None when there is none in the current and previous years.
+    """
+    now = pd.Timestamp.now(tz="UTC") if now is None else pd.Timestamp(now)
+    now = now.tz_localize("UTC") if now.tzinfo is None else now.tz_convert("UTC")
+    calendar_name = get_calendar_name(ticker)
+    for year in (now.year, now.year - 1):
+        closes = _year_closes(calendar_name, year)
+        closes = closes[closes <= now]
+        if len(closes):
+            return closes[-1]
+    return None
+
+
+def get_calendar_sessions(calendar_name: str, start, end) -> pd.DatetimeIndex:
+    """
+    Return the trading sessions of an exchange calendar between two dates (inclusive), as a tz-naive DatetimeIndex.
+    """
+    start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+    if end < start:
+        return pd.DatetimeIndex([])
+    sessions = pd.DatetimeIndex([]).append([_year_sessions(calendar_name, year) for year in range(start.year, end.year + 1)])
+    return sessions[(sessions >= start) & (sessions <= end)]
+
+
+def get_sessions(ticker: str, start, end) -> pd.DatetimeIndex:
+    """
+    Return the trading sessions of the exchange of a ticker between two dates (inclusive).
+    """
+    return get_calendar_sessions(get_calendar_name(ticker), start, end)
+
+
+def get_fund_calendars(tickers=None) -> set:
+    """
+    Return the names of the calendars of the given tickers, or of every ticker the fund ever traded.
+    """
+    if tickers is None:
+        tickers = Transaction.objects.filter(type__in=["buy", "sell"]).values_list("ticker", flat=True).distinct()
+    return {get_calendar_name(ticker) for ticker in tickers if ticker} or {DEFAULT_CALENDAR}
+
+
+def get_fund_sessions(start, end, tickers=None) -> pd.DatetimeIndex:
+    """
+    Return the union of the trading sessions of the fund's exchanges between two dates (inclusive):
+    the days on which at least one of its assets can be priced.
+    """
+    sessions = pd.DatetimeIndex([])
+    for calendar_name in sorted(get_fund_calendars(tickers)):
+        sessions = sessions.union(get_calendar_sessions(calendar_name, start, end))
+    return sessions
+
+
+def is_fund_session(date, tickers=None) -> bool:
+    """
+    Tell whether at least one of the fund's exchanges trades on the given date.
+    """
+    return len(get_fund_sessions(date, date, tickers)) > 0
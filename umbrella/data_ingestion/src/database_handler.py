@@ -1,49 +1,134 @@
-from django.utils import timezone
-from django.db import connection
-from datetime import datetime
+from django.db import models, transaction
+from django.db.models import Max, Min
+from datetime import date as Date
+from decimal import Decimal
+from data_ingestion.src.storage import get_storage_backend
+from data_ingestion.src.metrics import DB_WRITE_SECONDS, ROWS_WRITTEN, timed
+from data_ingestion.signals import prices_saved, exchange_rates_saved
+import logging
+
+logger = logging.getLogger(__name__)
+
 
 class DatabaseHandler:
-    def __init__(self, model, table_name="daily_stock_prices"):
+    """
+    Reads and writes the ingested data of a model.
+    The tables are created by the migrations; writes go through the storage backend of the database in use.
+    """
+    def __init__(self, model, storage=None):
         self.model = model
-        self.table_name = table_name
+        self.storage = storage or get_storage_backend()
+
+    def get_last_date(self, ticker):
+        """
+        Return the most recent date stored for a given ticker, or None if nothing was ingested yet.
+        This is the watermark used by the incremental price ingestion.
+        """
+        return self.model.objects.filter(ticker=ticker).aggregate(last_date=Max("date"))["last_date"]
+
+    def _timed_write(self, operation: str):
+        """
+        Observe the duration of a write of the model in the metrics.
+        """
+        return timed(DB_WRITE_SECONDS, table=self.model._meta.db_table, operation=operation)
+
+    def _count_rows(self, inserted: int = 0, updated: int = 0, deleted: int = 0):
+        """
+        Add the rows written to the model to the metrics.
+        """
+        table = self.model._meta.db_table
+        for operation, rows in (("inserted", inserted), ("updated", updated), ("deleted", deleted)):
+            if rows:
+                ROWS_WRITTEN.inc(rows, table=table, operation=operation)
+
+    def _notify_prices_saved(self, ticker, first_date=None, last_date=None):
+        """
+        Send the prices_saved signal once the current transaction is committed (or at once outside of a transaction).
+        """
+        transaction.on_commit(lambda: prices_saved.send(
+            sender=self.model, ticker=ticker, first_date=first_date, last_date=last_date
+        ))
 
-    def ensure_table_exists(self):
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=%s;", [self.table_name])
-            if not cursor.fetchone():
-                with connection.schema_editor() as schema_editor:
-                    self.model._meta.db_table = self.table_name
-                    schema_editor.create_model(self.model)
+    def _stored_value(self, field, value):
+        """
+        Return a value as the database stores it in a field, e.g. a float rounded to the decimal places of the field.
+        """
+        value = field.to_python(value)
+        if value is not None and isinstance(field, models.DecimalField):
+            value = value.quantize(Decimal(1).scaleb(-field.decimal_places))
+        return value
+
+    def _changed_dates(self, rows, instances) -> list:
+        """
+        Return the dates of the stored rows that writing the instances changes: the dates not stored yet,
+        the dates stored with other values and the stored dates without instance, which are deleted.
+        """
+        fields = [
+            field for field in self.model._meta.concrete_fields
+            if not field.primary_key and field.name not in ("ticker", "date")
+        ]
+        stored = {row[0]: row[1:] for row in rows.values_list("date", *[field.attname for field in fields])}
+        changed = [
+            instance.date for instance in instances
+            if stored.pop(instance.date, None) != tuple(self._stored_value(field, getattr(instance, field.attname)) for field in fields)
+        ]
+        return changed + list(stored)
 
-    def save_prices(self, ticker, currency, merged_data):
+    def save_prices(self, ticker, currency, prices, replace=True):
         """
         Save the daily stock prices for a given ticker and currency.
+        `prices` is a DataFrame indexed by date whose columns are HistoricalPrice fields
+        (open, high, low, close, volume and the *_euro columns).
+        Rows are upserted on (ticker, date). With replace=True the other rows of the ticker are deleted
+        (full refresh). Otherwise only the other rows within the given date range are deleted, such as rows
+        stored on days that are not trading sessions, and older rows are left untouched (incremental refresh).
+        The prices_saved signal covers the dates whose prices changed, so that re-writing the same prices
+        (e.g. a full refresh of the history) only invalidates the dates that were actually updated.
+        Returns the number of inserted and updated rows.
         """
-        self.model.objects.filter(ticker=ticker).delete()
-        for date, value in merged_data.items():
-            naive_date = datetime.strptime(date, "%Y-%m-%d")
-            aware_date = timezone.make_aware(naive_date).date()
-            rate = value.get("exchange_rate")
-            self.model.objects.update_or_create(
-                ticker=ticker,
-                currency=currency,
-                date=aware_date,
-                open=value.get("1. open"),
-                high=value.get("2. high"),
-                low=value.get("3. low"),
-                close=value.get("4. close"),
-                volume=value.get("5. volume"),
-                open_euro=float(value.get("1. open")) * float(rate) if rate else None,
-                high_euro=float(value.get("2. high")) * float(rate) if rate else None,
-                low_euro=float(value.get("3. low")) * float(rate) if rate else None,
-                close_euro=float(value.get("4. close")) * float(rate) if rate else None,
-                nav=value.get("nav")
-            )
+        if prices.empty:
+            return 0, 0
+
+        records = prices.astype(object).where(prices.notna(), None)
+        records.index = prices.index.date
+        instances = [
+            self.model(ticker=ticker, currency=currency, date=date, **values)
+            for date, values in zip(records.index, records.to_dict("records"))
+        ]
+
+        first_date, last_date = min(records.index), max(records.index)
+        with self._timed_write("save_prices"), transaction.atomic():
+            rows = self.model.objects.filter(ticker=ticker)
+            if not replace:
+                rows = rows.filter(date__range=(first_date, last_date))
+            changed = self._changed_dates(rows, instances)
+            deleted, _ = rows.exclude(date__in=set(records.index)).delete()
+            inserted, updated = self.storage.upsert(self.model, instances, ["ticker", "date"])
+            if changed:
+                self._notify_prices_saved(ticker, min(changed), max(changed))
+        self._count_rows(inserted, updated, deleted)
+        logger.info(f"Saved prices for {ticker}: {inserted} inserted, {updated} updated")
+        return inserted, updated
+
+    def trim_prices(self, ticker, first_date, last_date):
+        """
+        Delete the stored prices of a ticker outside of the given date range.
+        """
+        with self._timed_write("trim_prices"), transaction.atomic():
+            rows = self.model.objects.filter(ticker=ticker).exclude(date__range=(first_date, last_date))
+            trimmed = rows.aggregate(first=Min("date"), last=Max("date"))
+            deleted = rows.delete()
+            if deleted[0]:
+                self._notify_prices_saved(ticker, trimmed["first"], trimmed["last"])
+        self._count_rows(deleted=deleted[0])
+        return deleted
 
     def save_company_information(self, ticker, data: dict):
-        # Overwrite data by deleting all existing rows
-        self.model.objects.filter(ticker=ticker).delete()
-        self.model.objects.create(
+        """
+        Save the company information of a given ticker, overwriting the existing row.
+        Returns the number of inserted and updated rows.
+        """
+        instance = self.model(
             ticker=ticker,
             name=data.get("Name"),
             description=data.get("Description"),
@@ -76,19 +161,37 @@ class DatabaseHandler:
             dividend_date=data.get("DividendDate"),
             ex_dividend_date=data.get("ExDividendDate")
         )
-    
+        with self._timed_write("save_company_information"), transaction.atomic():
+            inserted, updated = self.storage.upsert(self.model, [instance], ["ticker"])
+        self._count_rows(inserted, updated)
+        return inserted, updated
+
     def save_daily_exchange_rates(self, from_currency, to_currency, data):
-        print(f"Saving exchange rates from {from_currency} to {to_currency}")
-        self.model.objects.filter(from_currency=from_currency).delete()
-        for date, value in data.items():
-            naive_datetime = datetime.strptime(date, "%Y-%m-%d")
-            aware_datetime = timezone.make_aware(naive_datetime, timezone.get_current_timezone())
-            self.model.objects.update_or_create(
+        """
+        Save the daily exchange rates of a currency pair, upserting rows on (from_currency, to_currency, date).
+        Returns the number of inserted and updated rows.
+        """
+        logger.info(f"Saving exchange rates from {from_currency} to {to_currency}")
+        instances = [
+            self.model(
                 from_currency=from_currency,
                 to_currency=to_currency,
                 open=value.get("1. open"),
                 high=value.get("2. high"),
                 low=value.get("3. low"),
                 close=value.get("4. close"),
-                date=aware_datetime
-            ) 
\ No newline at end of file
+                date=Date.fromisoformat(date),
+            )
+            for date, value in data.items()
+        ]
+        if not instances:
+            return 0, 0
+
+        with self._timed_write("save_daily_exchange_rates"), transaction.atomic():
+            inserted, updated = self.storage.upsert(self.model, instances, ["from_currency", "to_currency", "date"])
+            transaction.on_commit(lambda: exchange_rates_saved.send(
+                sender=self.model, from_currency=from_currency, to_currency=to_currency
+            ))
+        self._count_rows(inserted, updated)
+        logger.info(f"Saved exchange rates {from_currency}/{to_currency}: {inserted} inserted, {updated} updated")
+        return inserted, updated
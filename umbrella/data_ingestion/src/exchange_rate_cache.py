@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+import pandas as pd
+from django.conf import settings
+from data_ingestion.models import BaseHistoricalExchangeRate
+
+logger = logging.getLogger(__name__)
+
+# Every currency is ingested against this one; the rates between two other currencies are derived from it
+BASE_CURRENCY = "EUR"
+
+# Currencies some exchanges quote prices in, which are a fraction of an ingested currency (e.g. pence on the LSE)
+MINOR_UNITS = {
+    "GBp": ("GBP", 0.01),
+    "GBX": ("GBP", 0.01),
+    "ZAc": ("ZAR", 0.01),
+    "ILA": ("ILS", 0.01),
+}
+
+
+def normalize_currency(currency: str):
+    """
+    Return the ingested currency of a currency code and the factor converting an amount to it,
+    e.g. ("GBP", 0.01) for GBp.
+    """
+    return MINOR_UNITS.get(currency, (currency, 1.0))
+
+
+class ExchangeRateCache:
+    """
+    In-memory cache of the stored daily close exchange rates.
+    Only the rates of each currency to EUR are ingested: the rates of any other pair are derived by
+    triangulation, rate(A/B) = rate(A/EUR) / rate(B/EUR), both series being aligned on the union of their dates
+    with the last known rate carried over. A pair stored as is in the database is used directly.
+    Each rate series is loaded from the database once, as a float Series indexed by date, and shared by
+    every ticker quoted in that currency. One instance is meant to live for a whole ingestion run.
+    With ttl_seconds, the cached rates are dropped that many seconds after they were first loaded, so that a
+    long-lived cache picks up the rates written by other processes.
+    """
+    def __init__(self, ttl_seconds: float = None):
+        self.ttl_seconds = ttl_seconds
+        self.rates = {}
+        self.loaded_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _expire(self):
+        now = time.monotonic()
+        if not self.rates:
+            self.loaded_at = now
+        elif self.ttl_seconds is not None and now - self.loaded_at >= self.ttl_seconds:
+            logger.info(f"Dropping {len(self.rates)} cached exchange rate series after {self.ttl_seconds}s")
+            self.rates.clear()
+            self.loaded_at = now
+
+    @staticmethod
+    def _load(from_currency: str, to_currency: str) -> pd.Series:
+        """
+        Return the stored close rates of a pair as a float Series sorted by date, or None when none is stored.
+        """
+        rates = BaseHistoricalExchangeRate.objects.filter(
+            from_currency=from_currency, to_currency=to_currency
+        ).values_list("date", "close")
+        if not rates:
+            return None
+        dates, closes = zip(*rates)
+        logger.info(f"Loaded {len(dates)} exchange rates for {from_currency}/{to_currency}")
+        return pd.Series(closes, index=pd.DatetimeIndex(dates), dtype=float).sort_index()
+
+    def _to_base(self, currency: str):
+        """
+        Return the rates of a currency to EUR: 1.0 for EUR itself, the stored rates, or the inverse of the stored
+        EUR rates of the currency. Raises ValueError when neither is stored.
+        """
+        if currency == BASE_CURRENCY:
+            return 1.0
+        key = (currency, BASE_CURRENCY)
+        if key not in self.rates:
+            rates = self._load(currency, BASE_CURRENCY)
+            if rates is None:
+                inverse = self._load(BASE_CURRENCY, currency)
+                if inverse is None:
+                    raise ValueError(f"No exchange rates found for {currency} in the database or API response.")
+                rates = 1.0 / inverse
+            self.rates[key] = rates
+        return self.rates[key]
+
+    def _cross(self, from_currency: str, to_currency: str) -> pd.Series:
+        from_unit, from_factor = normalize_currency(from_currency)
+        to_unit, to_factor = normalize_currency(to_currency)
+        if BASE_CURRENCY not in (from_unit, to_unit):
+            # Pairs ingested as is, e.g. a legacy USD/JPY, are used rather than derived
+            stored = self._load(from_unit, to_unit)
+            if stored is not None:
+                return stored * (from_factor / to_factor)
+
+        numerator = self._to_base(from_unit)
+        denominator = self._to_base(to_unit)
+        if not isinstance(numerator, pd.Series) and not isinstance(denominator, pd.Series):
+            raise ValueError(f"No exchange rates needed from {from_currency} to {to_currency}")
+        if isinstance(numerator, pd.Series) and isinstance(denominator, pd.Series):
+            dates = numerator.index.union(denominator.index)
+            numerator = numerator.reindex(dates).ffill()
+            denominator = denominator.reindex(dates).ffill()
+        return (numerator / denominator * (from_factor / to_factor)).dropna()
+
+    def get_rates(self, from_currency: str, to_currency: str = BASE_CURRENCY) -> pd.Series:
+        """
+        Return the close rates of a currency pair, sorted by date, triangulated through EUR when needed.
+        Raises ValueError when the rates of one of the currencies are not stored.
+        """
+        key = (from_currency, to_currency)
+        with self.lock:
+            self._expire()
+            if key not in self.rates:
+                self.rates[key] = self._cross(from_currency, to_currency)
+            return self.rates[key]
+
+    def invalidate(self, from_currency: str = None):
+        """
+        Drop the cached rates involving a currency (or every rate), e.g. after new rates were saved.
+        """
+        with self.lock:
+            if from_currency is None:
+                self.rates.clear()
+                return
+            for key in list(self.rates):
+                if from_currency in (normalize_currency(key[0])[0], normalize_currency(key[1])[0]):
+                    del self.rates[key]
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_exchange_rate_cache() -> ExchangeRateCache:
+    """
+    Return the ExchangeRateCache shared by the readers of the process. It is emptied whenever exchange rates are saved
+    by the process, and after PRICE_STORE_TTL_SECONDS for the rates saved by other processes.
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ExchangeRateCache(ttl_seconds=settings.PRICE_STORE_TTL_SECONDS)
+        return _shared_cache
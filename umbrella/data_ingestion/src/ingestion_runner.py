@@ -0,0 +1,313 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.db import connection
+from data_ingestion.src.database_handler import DatabaseHandler
+from data_ingestion.src.api_fetcher import ProviderUnavailableError
+from data_ingestion.src.exchange_rate_cache import BASE_CURRENCY, ExchangeRateCache, normalize_currency
+from data_ingestion.src.metrics import FAILURES
+from data_ingestion.src.providers import ProviderChain, build_provider_chain
+from data_ingestion.src.stock_price_service import StockPriceService
+from data_ingestion.src.universe import mark_refreshed
+from data_ingestion.models import BaseHistoricalExchangeRate, HistoricalPrice, TickerInfo
+from transactions.models import Transaction
+
+logger = logging.getLogger(__name__)
+
+
+def get_required_currencies() -> list:
+    """
+    Return the currencies whose rates to EUR are needed: the currencies of the stored company information
+    and of the transactions, minor units (e.g. GBp) being replaced by their currency.
+    """
+    currencies = set(TickerInfo.objects.exclude(currency=None).values_list("currency", flat=True).distinct())
+    currencies |= set(Transaction.objects.values_list("currency", flat=True).distinct())
+    currencies = {normalize_currency(currency.strip())[0] for currency in currencies if currency and currency.strip()}
+    return sorted(currencies - {BASE_CURRENCY})
+
+
+class IngestionRunner:
+    """
+    This class ingests the company information and the daily prices of many tickers concurrently.
+    The provider calls run in a thread pool, throttled by one token bucket per provider, and go through the
+    provider fallback chain like the fetch commands do, so a provider whose circuit breaker opened is skipped
+    by the following tickers. The prices of all the tickers that no other provider could serve are downloaded
+    in a single batch, by the last provider of the chain supporting it, once the pool is done.
+    The prices of a ticker quoted in a currency without stored exchange rates (e.g. a ticker just added to the
+    watchlist) are only fetched once the rates of that currency were fetched and written.
+    All the database writes are done by the calling thread, one ticker at a time, so that the database only
+    ever sees a single writer.
+    Each part of a ticker successfully written is recorded in TickerFreshness (see plan_ingestion).
+    """
+    def __init__(self, workers: int = 4, offline: bool = False, providers: ProviderChain = None):
+        self.workers = workers
+        self.info_repo = DatabaseHandler(model=TickerInfo)
+        self.price_repo = DatabaseHandler(model=HistoricalPrice)
+        # Exchange rates are loaded once per run and shared by all the tickers
+        self.exchange_rates = ExchangeRateCache()
+        self.providers = providers or build_provider_chain(offline=offline)
+        # Last provider of the chain able to download the prices of many tickers at once, if any.
+        # The prices of each ticker are first fetched from the other providers
+        batch_providers = self.providers.supporting("get_daily_time_series_batch")
+        self.batch_provider = batch_providers[-1] if batch_providers else None
+        self.ticker_providers = [name for name in self.providers.names if name != self.batch_provider]
+
+    @staticmethod
+    def _missing_rates(currency: str, rated: set):
+        """
+        Return the currency of a ticker when it is not among the currencies with stored rates to EUR,
+        or None when it is, when the ticker is quoted in EUR or when its currency is not known yet.
+        """
+        if not currency:
+            return None
+        unit = normalize_currency(currency)[0]
+        return unit if unit != BASE_CURRENCY and unit not in rated else None
+
+    def _fetch(self, ticker: str, incremental: bool, refresh_info: bool = True, refresh_prices: bool = True,
+               currency: str = None, rated: set = None, deferred: dict = None) -> dict:
+        """
+        Fetch what must be refreshed for a ticker, without writing to the database. Runs in a worker thread.
+        currency is the stored currency of the ticker, and rated the currencies whose rates to EUR are stored:
+        the prices are not fetched when the rates of the ticker currency are missing.
+        With the result of such a ticker, only its prices are fetched, into that result.
+        """
+        result = deferred or {
+            "ticker": ticker, "info": None, "prices": None, "rows": None, "errors": [], "needs_batch": False
+        }
+        result["needs_rates"] = None
+        started = time.monotonic()
+        try:
+            if refresh_info and not deferred:
+                try:
+                    result["info"] = self.providers.call(
+                        ticker, lambda client: client.get_overview(ticker), stage="company_info"
+                    )
+                except Exception as e:
+                    result["errors"].append(f"company info: {e}")
+            # The overview just fetched gives the currency, which saves another overview call.
+            # Without it, the stored currency is used
+            if result["info"]:
+                currency = result["info"][0].get("Currency") or currency
+            if refresh_prices and rated is not None:
+                result["needs_rates"] = self._missing_rates(currency, rated)
+            if refresh_prices and not result["needs_rates"]:
+                try:
+                    result["prices"] = self.providers.call(
+                        ticker,
+                        lambda client: StockPriceService(client, self.price_repo, self.exchange_rates).fetch_daily_prices(
+                            ticker, incremental=incremental, currency=currency
+                        ),
+                        names=self.ticker_providers,
+                        stage="prices",
+                    )
+                except Exception as e:
+                    if self.batch_provider is None:
+                        result["errors"].append(f"prices: {e}")
+                    else:
+                        result["needs_batch"] = True
+        finally:
+            # Worker threads get their own database connection, which must not outlive the task
+            connection.close()
+        result["fetch_seconds"] = result.get("fetch_seconds", 0) + time.monotonic() - started
+        return result
+
+    def _fetch_missing_rates(self, deferred: list, on_rates=None):
+        """
+        Fetch and write the exchange rates needed by the deferred tickers, in the calling thread.
+        """
+        currencies = sorted({result["needs_rates"] for result in deferred})
+        logger.info(f"Fetching the exchange rates of {', '.join(currencies)} for {len(deferred)} tickers")
+        for result in ExchangeRateRunner(workers=self.workers, providers=self.providers).run(currencies, on_result=on_rates):
+            self.exchange_rates.invalidate(result["currency"])
+            if result["errors"]:
+                continue
+            try:
+                # Loaded by the thread which wrote them, once for all the tickers of that currency
+                self.exchange_rates.get_rates(result["currency"])
+            except ValueError as e:
+                logger.warning(f"Exchange rates of {result['currency']} still missing: {e}")
+
+    def _fetch_batch(self, results: list, incremental: bool):
+        """
+        Fetch the prices of the given tickers with one download from the batch provider.
+        """
+        tickers = [result["ticker"] for result in results]
+        currencies = {result["ticker"]: result["info"][0].get("Currency") for result in results if result["info"]}
+        started = time.monotonic()
+        try:
+            prepared, name = self.providers.call(
+                f"{len(tickers)} tickers",
+                lambda client: StockPriceService(client, self.price_repo, self.exchange_rates).fetch_daily_prices_batch(
+                    tickers, incremental=incremental, currencies=currencies
+                ),
+                names=[self.batch_provider],
+                stage="prices_batch",
+            )
+        except Exception as e:
+            prepared = {ticker: e for ticker in tickers}
+        elapsed = time.monotonic() - started
+        for result in results:
+            outcome = prepared[result["ticker"]]
+            if isinstance(outcome, Exception):
+                result["errors"].append(f"prices: {outcome}")
+                if not isinstance(outcome, ProviderUnavailableError):
+                    # Download failures are already counted by the provider chain
+                    FAILURES.inc(ticker=result["ticker"], provider=self.batch_provider, stage="prices_batch")
+            else:
+                result["prices"] = (outcome, name)
+            # The batch duration is shared by all its tickers
+            result["fetch_seconds"] += elapsed
+
+    def _write(self, result: dict):
+        """
+        Write the fetched data of a ticker to the database. Runs in the calling thread only.
+        """
+        ticker = result["ticker"]
+        started = time.monotonic()
+        if result["info"]:
+            overview, name = result["info"]
+            try:
+                self.info_repo.save_company_information(ticker, overview)
+                mark_refreshed(ticker, info=True)
+            except Exception as e:
+                result["errors"].append(f"company info: {e}")
+                FAILURES.inc(ticker=ticker, provider=name, stage="write")
+        if result["prices"]:
+            (currency, prices, replace), name = result["prices"]
+            try:
+                result["rows"] = self.price_repo.save_prices(ticker, currency, prices, replace=replace)
+                mark_refreshed(ticker, prices=True)
+            except Exception as e:
+                result["errors"].append(f"prices: {e}")
+                FAILURES.inc(ticker=ticker, provider=name, stage="write")
+        result["write_seconds"] = time.monotonic() - started
+
+    def run(self, tickers: list, incremental: bool = True, on_result=None, plan: dict = None, on_rates=None) -> list:
+        """
+        Ingest the given tickers and return one result dict per ticker, in completion order.
+        on_result(result) is called as soon as the data of a ticker has been written, and on_rates(result)
+        once the missing exchange rates of a currency have been written (see ExchangeRateRunner.run).
+        plan optionally maps tickers to the {"info": bool, "prices": bool} parts to refresh, as returned by
+        plan_ingestion; the tickers it does not contain are refreshed entirely.
+        """
+        plan = plan or {}
+        results, pending, deferred = [], [], []
+        # Read once by the calling thread, so that the workers do not query the database to defer a ticker
+        currencies = dict(TickerInfo.objects.filter(ticker__in=tickers).values_list("ticker", "currency"))
+        rated = set(
+            BaseHistoricalExchangeRate.objects.filter(to_currency=BASE_CURRENCY)
+            .values_list("from_currency", flat=True).distinct()
+        )
+
+        def write(result):
+            self._write(result)
+            results.append(result)
+            if on_result:
+                on_result(result)
+
+        def collect(futures):
+            for future in as_completed(futures):
+                result = future.result()
+                if result["needs_rates"]:
+                    deferred.append(result)
+                elif result["needs_batch"]:
+                    pending.append(result)
+                else:
+                    write(result)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            collect([
+                executor.submit(
+                    self._fetch,
+                    ticker,
+                    incremental,
+                    plan.get(ticker, {}).get("info", True),
+                    plan.get(ticker, {}).get("prices", True),
+                    currencies.get(ticker),
+                    rated,
+                )
+                for ticker in tickers
+            ])
+            if deferred:
+                self._fetch_missing_rates(deferred, on_rates)
+                retried, deferred = deferred, []
+                collect([
+                    executor.submit(
+                        self._fetch, result["ticker"], incremental, currency=currencies.get(result["ticker"]), deferred=result
+                    )
+                    for result in retried
+                ])
+
+        if pending:
+            logger.info(f"Falling back to {self.batch_provider} for {len(pending)} tickers")
+            self._fetch_batch(pending, incremental)
+            for result in pending:
+                write(result)
+        return results
+
+
+class ExchangeRateRunner:
+    """
+    This class ingests the daily rates to EUR of many currencies concurrently, one provider call per currency.
+    The rates between two other currencies are never fetched: they are derived by triangulation through EUR
+    (see ExchangeRateCache), so N currencies need N downloads instead of one per pair.
+    Like IngestionRunner, the downloads run in a thread pool and the database writes are done by the calling thread.
+    """
+    def __init__(self, workers: int = 4, offline: bool = False, providers: ProviderChain = None):
+        self.workers = workers
+        self.repo = DatabaseHandler(model=BaseHistoricalExchangeRate)
+        self.providers = providers or build_provider_chain(offline=offline)
+
+    def _fetch(self, currency: str) -> dict:
+        """
+        Fetch the rates of a currency to EUR, without writing to the database. Runs in a worker thread.
+        """
+        result = {"currency": currency, "rates": None, "rows": None, "errors": []}
+        started = time.monotonic()
+        try:
+            payload, name = self.providers.call(
+                f"{currency}/{BASE_CURRENCY}",
+                lambda client: client.get_exchange_rates(currency, BASE_CURRENCY),
+                names=self.providers.supporting("get_exchange_rates"),
+                stage="exchange_rates",
+            )
+            result["rates"] = (payload["Time Series FX (Daily)"], name)
+        except Exception as e:
+            result["errors"].append(str(e))
+        result["fetch_seconds"] = time.monotonic() - started
+        return result
+
+    def _write(self, result: dict):
+        """
+        Write the fetched rates of a currency to the database. Runs in the calling thread only.
+        """
+        started = time.monotonic()
+        if result["rates"]:
+            rates, name = result["rates"]
+            try:
+                result["rows"] = self.repo.save_daily_exchange_rates(result["currency"], BASE_CURRENCY, rates)
+            except Exception as e:
+                result["errors"].append(str(e))
+                FAILURES.inc(ticker=result["currency"], provider=name, stage="write")
+        result["write_seconds"] = time.monotonic() - started
+
+    def run(self, currencies: list = None, on_result=None) -> list:
+        """
+        Ingest the rates of the given currencies, or of every currency returned by get_required_currencies,
+        and return one result dict per currency, in completion order.
+        on_result(result) is called as soon as the rates of a currency have been written.
+        """
+        if currencies is None:
+            currencies = get_required_currencies()
+        currencies = [currency for currency in dict.fromkeys(currencies) if currency != BASE_CURRENCY]
+
+        results = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._fetch, currency) for currency in currencies]
+            for future in as_completed(futures):
+                result = future.result()
+                self._write(result)
+                results.append(result)
+                if on_result:
+                    on_result(result)
+        return results
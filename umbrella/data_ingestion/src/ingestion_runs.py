@@ -0,0 +1,87 @@
+import logging
+import time
+from contextlib import contextmanager
+from django.db.models import Max
+from django.utils import timezone
+from data_ingestion.models import IngestionRun
+from data_ingestion.src.metrics import REGISTRY, format_series, format_value
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def record_ingestion_run(command: str):
+    """
+    Record a run of an ingestion command as an IngestionRun, with the metrics recorded while it ran.
+    The command adds the tickers or currencies to the `succeeded` and `failed` lists of the yielded run.
+    The run is failed when nothing succeeded, and partial when some items failed or the block raised after some succeeded.
+    """
+    before = REGISTRY.snapshot()
+    started = time.monotonic()
+    run = IngestionRun.objects.create(command=command, started_at=timezone.now())
+    try:
+        yield run
+    except BaseException:
+        run.status = IngestionRun.Status.PARTIAL if run.succeeded else IngestionRun.Status.FAILED
+        raise
+    else:
+        if run.failed:
+            run.status = IngestionRun.Status.PARTIAL if run.succeeded else IngestionRun.Status.FAILED
+        else:
+            run.status = IngestionRun.Status.SUCCESS
+    finally:
+        run.finished_at = timezone.now()
+        run.duration_seconds = time.monotonic() - started
+        run.metrics = REGISTRY.since(before)
+        try:
+            run.save()
+        except Exception as e:
+            logger.error(f"Failed to save the {command} run: {e}")
+
+
+def get_last_runs() -> list:
+    """
+    Return the last finished run of each ingestion command.
+    """
+    last = (
+        IngestionRun.objects.exclude(finished_at=None)
+        .values("command")
+        .annotate(last_started_at=Max("started_at"))
+    )
+    runs = []
+    for item in last:
+        run = IngestionRun.objects.filter(command=item["command"], started_at=item["last_started_at"]).first()
+        if run:
+            runs.append(run)
+    return runs
+
+
+def render_last_runs() -> str:
+    """
+    Render the last run of each ingestion command in the Prometheus text format, as gauges.
+    The ingestion commands run in their own processes, so the metrics they recorded are read back from the runs:
+    each series of a run is exposed as ingestion_last_run_<metric>, labelled with the command.
+    """
+    families = {
+        "ingestion_last_run_timestamp_seconds": ("Time at which the last run of the command finished.", []),
+        "ingestion_last_run_duration_seconds": ("Duration of the last run of the command.", []),
+        "ingestion_last_run_succeeded": ("Tickers and currencies ingested by the last run of the command.", []),
+        "ingestion_last_run_failed": ("Tickers and currencies that failed in the last run of the command.", []),
+    }
+    for run in get_last_runs():
+        labels = {"command": run.command, "status": run.status}
+        families["ingestion_last_run_timestamp_seconds"][1].append((labels, run.finished_at.timestamp()))
+        families["ingestion_last_run_duration_seconds"][1].append((labels, run.duration_seconds or 0))
+        families["ingestion_last_run_succeeded"][1].append((labels, len(run.succeeded)))
+        families["ingestion_last_run_failed"][1].append((labels, len(run.failed)))
+        for sample in run.metrics:
+            name = "ingestion_last_run_" + sample["name"].removeprefix("ingestion_")
+            family = families.setdefault(name, (f"Increase of {sample['name']} during the last run of the command.", []))
+            family[1].append(({"command": run.command, **sample["labels"]}, sample["value"]))
+
+    lines = []
+    for name, (help_text, samples) in families.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f"{format_series(name, labels)} {format_value(value)}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
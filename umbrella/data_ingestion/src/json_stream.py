@@ -0,0 +1,114 @@
+import codecs
+import json
+import re
+
+WHITESPACE = " \t\n\r"
+
+_decoder = json.JSONDecoder()
+
+
+class JSONObjectStream:
+    """
+    Incremental reader of an object member of a JSON document, such as the "Time Series (Daily)" object of an
+    Alpha Vantage payload. The document is read from an iterable of text or UTF-8 byte chunks, and the
+    (key, value) pairs of the member are yielded one at a time, so that only the current chunk and item
+    are held in memory instead of the whole document.
+    """
+    def __init__(self, chunks, key: str, on_close=None):
+        """
+        Args:
+            chunks (iterable): Chunks of the document, as str or bytes
+            key (str): Name of the object member to stream
+            on_close (callable, optional): Called once the stream is exhausted or closed, e.g. to release the connection
+        """
+        self.chunks = iter(chunks)
+        self.key = key
+        self.on_close = on_close
+        self.unicode_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.position = 0
+
+    def _read(self) -> bool:
+        """
+        Append the next chunk to the buffer, dropping what was already consumed. Returns False at the end of the document.
+        """
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            return False
+        if isinstance(chunk, bytes):
+            chunk = self.unicode_decoder.decode(chunk)
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def open(self):
+        """
+        Read the document up to the start of the member.
+        Returns None once the member is found. When the document does not contain it (e.g. an error message),
+        the whole document is parsed and returned instead.
+        """
+        start = re.compile(re.escape(json.dumps(self.key)) + r"\s*:\s*\{")
+        while True:
+            match = start.search(self.buffer)
+            if match:
+                self.position = match.end()
+                return None
+            if not self._read():
+                self.close()
+                return json.loads(self.buffer)
+
+    def _peek(self):
+        """
+        Return the next non-whitespace character, reading more chunks if needed, or None at the end of the document.
+        """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._read():
+                return None
+
+    def _decode(self):
+        """
+        Decode the JSON value at the current position, reading more chunks until it is complete.
+        """
+        while True:
+            self._peek()
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                value, end = None, None
+            # A value ending with the buffer may be truncated (e.g. a number), unless the document is over
+            if end is not None and end < len(self.buffer):
+                self.position = end
+                return value
+            if not self._read():
+                if end is None:
+                    raise ValueError(f"Truncated JSON document while reading {self.key}")
+                self.position = end
+                return value
+
+    def __iter__(self):
+        try:
+            while True:
+                char = self._peek()
+                if char == ",":
+                    self.position += 1
+                    char = self._peek()
+                if char == "}":
+                    return
+                if char != '"':
+                    raise ValueError(f"Unexpected {char!r} while reading {self.key}")
+                key = self._decode()
+                if self._peek() != ":":
+                    raise ValueError(f"Missing ':' after {key!r} while reading {self.key}")
+                self.position += 1
+                yield key, self._decode()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.on_close:
+            self.on_close()
+            self.on_close = None
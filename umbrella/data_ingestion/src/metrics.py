@@ -0,0 +1,236 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the duration histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_series(name: str, labels: dict) -> str:
+    """
+    Return a series in the Prometheus text format, e.g. provider_requests_total{provider="yahoo_finance"}.
+    """
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    Base class of the metrics: a name, a help text and the label names, with one value per label set.
+    """
+    kind = None
+
+    def __init__(self, name: str, help_text: str, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects the labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _labels(self, key: tuple) -> dict:
+        return dict(zip(self.label_names, key))
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    """
+    Monotonic counter, e.g. a number of rows or bytes.
+    """
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list:
+        with self.lock:
+            return [(self.name, self._labels(key), value) for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values (durations in seconds), as cumulative bucket counts, a sum and a count.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                counts[index] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def samples(self) -> list:
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                labels = self._labels(key)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((f"{self.name}_bucket", {**labels, "le": format_value(bound)}, cumulative))
+                samples.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, count))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of the metrics of the process, rendered in the Prometheus text exposition format.
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                    raise ValueError(f"Metric {metric.name} is already registered with another type or labels")
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, label_names=()) -> Counter:
+        return self._register(Counter(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def samples(self) -> list:
+        """
+        Return every (series name, labels, value) sample of the registry.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return [sample for metric in metrics for sample in metric.samples()]
+
+    def snapshot(self) -> dict:
+        """
+        Return the values of the counters and the sums and counts of the histograms (not their buckets),
+        keyed by (series name, labels), to compute what a run added with `since`.
+        """
+        return {
+            (name, tuple(labels.items())): value
+            for name, labels, value in self.samples()
+            if not name.endswith("_bucket")
+        }
+
+    def since(self, before: dict) -> list:
+        """
+        Return the increase of each series since a snapshot, as JSON serializable
+        {"name", "labels", "value"} dicts, leaving out the series that did not change.
+        """
+        return [
+            {"name": name, "labels": dict(labels), "value": value - before.get((name, labels), 0)}
+            for (name, labels), value in self.snapshot().items()
+            if value != before.get((name, labels), 0)
+        ]
+
+    def render(self) -> str:
+        """
+        Return the metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{format_series(name, labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        """
+        Reset the values of every metric, keeping them registered.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels):
+    """
+    Observe the duration of the block in the histogram, with an outcome label set to "ok" or "error"
+    (when the block raises). The yielded labels can be updated by the block, e.g. to set another outcome.
+    """
+    labels = {**labels, "outcome": "ok"}
+    started = time.monotonic()
+    try:
+        yield labels
+    except Exception:
+        labels["outcome"] = "error"
+        raise
+    finally:
+        histogram.observe(time.monotonic() - started, **labels)
+
+
+REGISTRY = MetricsRegistry()
+
+PROVIDER_REQUEST_SECONDS = REGISTRY.histogram(
+    "ingestion_provider_request_seconds",
+    "Duration of the requests to the data providers, including the download of the response.",
+    ["provider", "endpoint", "outcome"],
+)
+PROVIDER_BYTES = REGISTRY.counter(
+    "ingestion_provider_downloaded_bytes_total",
+    "Bytes of the response bodies downloaded from the data providers.",
+    ["provider", "endpoint"],
+)
+PROVIDER_RETRIES = REGISTRY.counter(
+    "ingestion_provider_retries_total",
+    "Requests to the data providers retried after a network error, a throttling or a server error.",
+    ["provider", "reason"],
+)
+ROWS_WRITTEN = REGISTRY.counter(
+    "ingestion_rows_written_total",
+    "Rows written to the database by the ingestion.",
+    ["table", "operation"],
+)
+DB_WRITE_SECONDS = REGISTRY.histogram(
+    "ingestion_db_write_seconds",
+    "Duration of the database writes of the ingestion.",
+    ["table", "operation", "outcome"],
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "ingestion_stage_seconds",
+    "Duration of the ingestion stages (fetch, prepare, write) of a ticker or currency.",
+    ["stage", "outcome"],
+)
+FAILURES = REGISTRY.counter(
+    "ingestion_failures_total",
+    "Failed ingestions, by ticker (or currency), provider and stage.",
+    ["ticker", "provider", "stage"],
+)
@@ -0,0 +1,202 @@
+import logging
+import os
+import shutil
+import threading
+from datetime import date
+from pathlib import Path
+from urllib.parse import quote, unquote
+import pandas as pd
+from django.conf import settings
+from data_ingestion.models import HistoricalPrice
+
+logger = logging.getLogger(__name__)
+
+# Numeric HistoricalPrice columns kept in the store, as float64
+PRICE_FIELDS = [
+    "open", "high", "low", "close", "volume",
+    "open_euro", "high_euro", "low_euro", "close_euro",
+]
+
+
+def _import_pyarrow():
+    """
+    pyarrow is an optional dependency, only needed when the Parquet store is enabled (poetry install -E parquet).
+    """
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.fs
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("The Parquet price store needs pyarrow: poetry install -E parquet") from e
+    return pyarrow
+
+
+class ParquetPriceStore:
+    """
+    Columnar copy of the HistoricalPrice table, for the analytics reading many prices at once.
+    The prices are stored as Parquet files partitioned by ticker and year
+    (<directory>/ticker=<ticker>/year=<year>/prices.parquet), and are read through memory-mapped files,
+    reading only the requested columns and the partitions and row groups matching the ticker and date filters.
+    The database stays the source of truth: partitions are rewritten from it when ingestion writes a ticker.
+    """
+    def __init__(self, directory):
+        self.pa = _import_pyarrow()
+        self.directory = Path(directory)
+        self.lock = threading.Lock()
+
+    def _ticker_dir(self, ticker: str) -> Path:
+        return self.directory / f"ticker={quote(ticker, safe='')}"
+
+    def _schema(self):
+        pa = self.pa
+        return pa.schema(
+            [("date", pa.date32()), ("currency", pa.string())] + [(field, pa.float64()) for field in PRICE_FIELDS]
+        )
+
+    def _write_partition(self, ticker: str, year: int, rows: list):
+        """
+        Write the rows of a ticker for one year. The file is written next to its final path and renamed,
+        so readers never see a partial file (hidden files are ignored by the dataset discovery).
+        """
+        columns = ["date", "currency"] + PRICE_FIELDS
+        data = {column: [row[i] for row in rows] for i, column in enumerate(columns)}
+        for field in PRICE_FIELDS:
+            data[field] = [None if value is None else float(value) for value in data[field]]
+        table = self.pa.table(data, schema=self._schema())
+
+        path = self._ticker_dir(ticker) / f"year={year}" / "prices.parquet"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        self.pa.parquet.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, path)
+
+    def sync_ticker(self, ticker: str, first_date: date = None, last_date: date = None):
+        """
+        Rewrite the partitions of a ticker from the database: the years overlapping the given dates,
+        or every year when no date is given (partitions of years without rows anymore are then removed).
+        Returns the number of rows written.
+        """
+        rows = HistoricalPrice.objects.filter(ticker=ticker)
+        if first_date and last_date:
+            rows = rows.filter(date__range=(date(first_date.year, 1, 1), date(last_date.year, 12, 31)))
+        years = {}
+        for row in rows.order_by("date").values_list("date", "currency", *PRICE_FIELDS):
+            years.setdefault(row[0].year, []).append(row)
+
+        with self.lock:
+            if first_date and last_date:
+                stale_years = set(range(first_date.year, last_date.year + 1)) - set(years)
+            else:
+                ticker_dir = self._ticker_dir(ticker)
+                existing = {int(path.name.split("=", 1)[1]) for path in ticker_dir.glob("year=*")} if ticker_dir.exists() else set()
+                stale_years = existing - set(years)
+            for year in stale_years:
+                shutil.rmtree(self._ticker_dir(ticker) / f"year={year}", ignore_errors=True)
+            for year, year_rows in years.items():
+                self._write_partition(ticker, year, year_rows)
+        written = sum(len(year_rows) for year_rows in years.values())
+        logger.info(f"Synced {written} prices of {ticker} to the Parquet store")
+        return written
+
+    def sync_all(self, tickers=None) -> int:
+        """
+        Rebuild the store from the database, for the given tickers or for all of them.
+        """
+        if tickers is None:
+            tickers = list(HistoricalPrice.objects.values_list("ticker", flat=True).distinct())
+            # Tickers removed from the database are removed from the store too
+            stored = {ticker for ticker in self.tickers()}
+            for ticker in stored - set(tickers):
+                shutil.rmtree(self._ticker_dir(ticker), ignore_errors=True)
+        return sum(self.sync_ticker(ticker) for ticker in tickers)
+
+    def tickers(self) -> list:
+        """
+        Return the tickers present in the store.
+        """
+        return sorted(unquote(path.name.split("=", 1)[1]) for path in self.directory.glob("ticker=*"))
+
+    def _dataset(self):
+        pa = self.pa
+        if not any(self.directory.glob("ticker=*/year=*/*.parquet")):
+            return None
+        partitioning = pa.dataset.partitioning(
+            pa.schema([("ticker", pa.string()), ("year", pa.int32())]), flavor="hive"
+        )
+        return pa.dataset.dataset(
+            str(self.directory),
+            format="parquet",
+            partitioning=partitioning,
+            filesystem=pa.fs.LocalFileSystem(use_mmap=True),
+        )
+
+    def read(self, tickers=None, start_date: date = None, end_date: date = None, columns=("close_euro",)) -> pd.DataFrame:
+        """
+        Read prices as a long DataFrame with the ticker, date and requested columns, sorted by ticker and date.
+        The ticker and date filters are pushed down to the partitions and row groups.
+        """
+        pa = self.pa
+        columns = list(columns)
+        dataset = self._dataset()
+        if dataset is None:
+            return pd.DataFrame(columns=["ticker", "date"] + columns)
+
+        field = pa.dataset.field
+        predicate = None
+
+        def conjunction(expression):
+            return expression if predicate is None else predicate & expression
+
+        if tickers is not None:
+            predicate = conjunction(field("ticker").isin(list(tickers)))
+        if start_date:
+            predicate = conjunction((field("year") >= start_date.year) & (field("date") >= pa.scalar(start_date, pa.date32())))
+        if end_date:
+            predicate = conjunction((field("year") <= end_date.year) & (field("date") <= pa.scalar(end_date, pa.date32())))
+
+        table = dataset.to_table(columns=["ticker", "date"] + columns, filter=predicate)
+        df = table.to_pandas(date_as_object=False)
+        return df.sort_values(["ticker", "date"], ignore_index=True)
+
+    def read_matrix(self, tickers=None, start_date: date = None, end_date: date = None, column: str = "close_euro") -> pd.DataFrame:
+        """
+        Read one column as a dates x tickers float DataFrame.
+        """
+        df = self.read(tickers, start_date, end_date, columns=[column])
+        return df.pivot(index="date", columns="ticker", values=column)
+
+
+def get_parquet_store():
+    """
+    Return the Parquet store configured by the PRICE_PARQUET_STORE_DIR setting, or None when it is disabled.
+    """
+    if not settings.PRICE_PARQUET_STORE_DIR:
+        return None
+    return ParquetPriceStore(settings.PRICE_PARQUET_STORE_DIR)
+
+
+def load_price_matrix(tickers=None, start_date: date = None, end_date: date = None, column: str = "close_euro") -> pd.DataFrame:
+    """
+    Load one price column of the given tickers (or of all of them) between two dates (inclusive, both optional)
+    as a dates x tickers float DataFrame, indexed by Timestamp.
+    It is read from the Parquet store when it is enabled, otherwise from the database.
+    """
+    tickers = None if tickers is None else list(tickers)
+    store = get_parquet_store()
+    if store is not None:
+        matrix = store.read_matrix(tickers, start_date, end_date, column)
+    else:
+        rows = HistoricalPrice.objects.all()
+        if tickers is not None:
+            rows = rows.filter(ticker__in=tickers)
+        if start_date:
+            rows = rows.filter(date__gte=start_date)
+        if end_date:
+            rows = rows.filter(date__lte=end_date)
+        prices = pd.DataFrame(rows.values_list("ticker", "date", column), columns=["ticker", "date", column])
+        matrix = prices.pivot(index="date", columns="ticker", values=column).astype(float)
+    matrix.index = pd.to_datetime(matrix.index).as_unit("ns")
+    if tickers is not None:
+        matrix = matrix.reindex(columns=tickers)
+    return matrix.sort_index()
@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from data_ingestion.models import BaseHistoricalExchangeRate
+from data_ingestion.src.exchange_rate_cache import BASE_CURRENCY, normalize_currency
+from data_ingestion.src.parquet_store import load_price_matrix
+
+logger = logging.getLogger(__name__)
+
+_version = 0
+_version_lock = threading.Lock()
+
+
+def invalidate():
+    """
+    Mark every PriceStore of the process as stale. Called whenever prices or exchange rates are written.
+    """
+    global _version
+    with _version_lock:
+        _version += 1
+
+
+def _current_version() -> int:
+    with _version_lock:
+        return _version
+
+
+class AsOfMatrix:
+    """
+    Dense dates x keys float matrix, forward filled along the dates, so that the value of a key "as of" a date
+    (the last available value on or before it) is a single array lookup.
+    """
+    def __init__(self, frame: pd.DataFrame):
+        """
+        Args:
+            frame (DataFrame): Values indexed by date, one column per key, with NaN for the missing values
+        """
+        frame = frame.sort_index().ffill()
+        self.dates = frame.index.values.astype("datetime64[D]")
+        self.keys = list(frame.columns)
+        self.key_index = {key: i for i, key in enumerate(self.keys)}
+        self.values = frame.to_numpy(dtype=float)
+
+    def as_of(self, keys, dates) -> np.ndarray:
+        """
+        Return the values of the keys as of each date, as a len(dates) x len(keys) array.
+        NaN is returned for unknown keys and for dates before the first value of a key.
+        """
+        dates = np.asarray(pd.to_datetime(dates).values.astype("datetime64[D]"))
+        rows = np.searchsorted(self.dates, dates, side="right") - 1
+        columns = np.array([self.key_index.get(key, -1) for key in keys], dtype=int)
+        result = np.full((len(dates), len(columns)), np.nan)
+        if not len(self.dates):
+            return result
+        values = self.values[np.clip(rows, 0, None)][:, np.clip(columns, 0, None)]
+        valid = (rows >= 0)[:, None] & (columns >= 0)[None, :]
+        result[valid] = values[valid]
+        return result
+
+
+class PriceStore:
+    """
+    In-process cache of the close prices in EUR of every ticker and of the exchange rates to EUR,
+    as AsOfMatrix instances shared by the valuation, the composition snapshots and the VaR.
+    The prices are loaded in one read (from the Parquet store when it is enabled), and reloaded when they are stale:
+    when prices or exchange rates were written by this process, or after PRICE_STORE_TTL_SECONDS for the writes
+    of other processes.
+    """
+    def __init__(self, ttl_seconds: float = None):
+        self.ttl_seconds = settings.PRICE_STORE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.lock = threading.Lock()
+        self.prices = None
+        self.rates = None
+        self.version = None
+        self.loaded_at = None
+
+    def _fresh(self) -> bool:
+        return (
+            self.version == _current_version()
+            and self.loaded_at is not None
+            and time.monotonic() - self.loaded_at < self.ttl_seconds
+        )
+
+    def _load(self):
+        version = _current_version()
+        started = time.monotonic()
+        prices = AsOfMatrix(load_price_matrix(column="close_euro"))
+
+        rates = pd.DataFrame(
+            BaseHistoricalExchangeRate.objects.filter(to_currency=BASE_CURRENCY).values_list("from_currency", "date", "close"),
+            columns=["currency", "date", "close"],
+        )
+        rates = rates.pivot(index="date", columns="currency", values="close").astype(float)
+        rates.index = pd.to_datetime(rates.index)
+
+        self.prices, self.rates = prices, AsOfMatrix(rates)
+        self.version, self.loaded_at = version, time.monotonic()
+        logger.info(
+            f"Loaded {len(prices.dates)} dates x {len(prices.keys)} tickers of prices "
+            f"in {time.monotonic() - started:.3f}s"
+        )
+
+    def _get(self):
+        with self.lock:
+            if not self._fresh():
+                self._load()
+            return self.prices, self.rates
+
+    def close_as_of(self, tickers, dates) -> pd.DataFrame:
+        """
+        Return the close prices in EUR of the tickers as of each date (last price on or before it),
+        as a dates x tickers float DataFrame with NaN where no price is known.
+        """
+        prices, _ = self._get()
+        tickers = list(tickers)
+        index = pd.DatetimeIndex(pd.to_datetime(dates))
+        return pd.DataFrame(prices.as_of(tickers, index), index=index, columns=tickers)
+
+    def get_close_prices(self, tickers, date) -> dict:
+        """
+        Return the close price in EUR of each ticker as of a date, as Decimal with 2 decimal places
+        like the HistoricalPrice field. Tickers without any price on or before the date are left out.
+        """
+        prices, _ = self._get()
+        tickers = list(tickers)
+        values = prices.as_of(tickers, [date])[0]
+        return {
+            ticker: Decimal(f"{value:.2f}")
+            for ticker, value in zip(tickers, values)
+            if not np.isnan(value)
+        }
+
+    def rate_as_of(self, currency: str, date) -> float:
+        """
+        Return the exchange rate from a currency to EUR as of a date, or None when no rate is known.
+        """
+        currency, factor = normalize_currency(currency)
+        if currency == BASE_CURRENCY:
+            return factor
+        _, rates = self._get()
+        value = rates.as_of([currency], [date])[0, 0]
+        return None if np.isnan(value) else float(value) * factor
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_price_store() -> PriceStore:
+    """
+    Return the PriceStore shared by the whole process.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PriceStore()
+        return _store
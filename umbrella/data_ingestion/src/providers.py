@@ -0,0 +1,226 @@
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+from data_ingestion.src.alpha_vantage_client import AlphaVantageClient
+from data_ingestion.src.yahoo_finance_client import YahooFinanceClient
+from data_ingestion.src.api_fetcher import ProviderUnavailableError
+from data_ingestion.src.metrics import FAILURES
+from data_ingestion.src.rate_limiter import TokenBucket
+from data_ingestion.src.response_cache import CacheMiss, with_cache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class ProviderSkippedError(ProviderUnavailableError):
+    """
+    Raised instead of calling a provider whose circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker of a provider.
+    It opens after `failure_threshold` consecutive failures, then rejects the calls for `cooldown_seconds`.
+    Once the cool-down is over it half-opens and lets a single probe call through: the breaker closes again
+    if the probe succeeds and re-opens for another cool-down if it fails.
+    """
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Return whether a call may go through. In the half-open state, only the first caller gets to probe.
+        """
+        with self.lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown_seconds:
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+class Provider:
+    """
+    A data provider of the fallback chain: a client, its circuit breaker and its call statistics.
+    """
+    def __init__(self, name: str, client, breaker: CircuitBreaker):
+        self.name = name
+        self.client = client
+        self.breaker = breaker
+        self.calls = 0
+        self.failures = 0
+        self.skipped = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_provider_failure(error: Exception) -> bool:
+        """
+        Tell whether an error says something about the health of the provider.
+        Missing or invalid data for one ticker (ValueError, including ProviderDataError) and offline cache misses
+        are specific to the request, so they do not count towards opening the breaker.
+        """
+        return not isinstance(error, (ValueError, CacheMiss))
+
+    def call(self, fetch):
+        """
+        Return fetch(client), going through the circuit breaker and recording the call statistics.
+        """
+        if not self.breaker.allow():
+            with self.lock:
+                self.skipped += 1
+            raise ProviderSkippedError(f"{self.name} is skipped, its circuit breaker is {self.breaker.state}")
+
+        started = time.monotonic()
+        try:
+            result = fetch(self.client)
+        except Exception as e:
+            if self.is_provider_failure(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            self._record(time.monotonic() - started, failed=True)
+            raise
+        self.breaker.record_success()
+        self._record(time.monotonic() - started, failed=False)
+        return result
+
+    def _record(self, seconds: float, failed: bool):
+        with self.lock:
+            self.calls += 1
+            self.failures += failed
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def health(self) -> dict:
+        """
+        Return the breaker state and the call statistics of the provider.
+        """
+        with self.lock:
+            return {
+                "name": self.name,
+                "state": self.breaker.state,
+                "calls": self.calls,
+                "failures": self.failures,
+                "skipped": self.skipped,
+                "avg_seconds": self.total_seconds / self.calls if self.calls else None,
+                "max_seconds": self.max_seconds,
+            }
+
+
+class ProviderChain:
+    """
+    Ordered list of providers. Each call is tried on the providers in order until one succeeds,
+    skipping the providers whose circuit breaker is open.
+    """
+    def __init__(self, providers: list):
+        self.providers = providers
+
+    @property
+    def names(self) -> list:
+        return [provider.name for provider in self.providers]
+
+    def get(self, name: str) -> Provider:
+        return next(provider for provider in self.providers if provider.name == name)
+
+    def supporting(self, method: str) -> list:
+        """
+        Return the names of the providers whose client implements the given method.
+        The response cache wrapper defines every cached method, so the wrapped client is checked instead.
+        """
+        return [
+            provider.name for provider in self.providers
+            if hasattr(getattr(provider.client, "client", provider.client), method)
+        ]
+
+    def call(self, what: str, fetch, names: list = None, stage: str = "fetch"):
+        """
+        Call fetch(client) on each provider in order, or only on the given provider names,
+        and return the first successful result with the name of the provider.
+        The failures of each provider are counted in the metrics by `what` (the ticker) and stage.
+        Raises ProviderUnavailableError listing every provider error when none of them succeeded.
+        """
+        errors = []
+        for provider in self.providers:
+            if names is not None and provider.name not in names:
+                continue
+            try:
+                return provider.call(fetch), provider.name
+            except ProviderSkippedError as e:
+                logger.info(f"{e} for {what}")
+                errors.append(f"{provider.name}: skipped")
+            except Exception as e:
+                logger.warning(f"{provider.name} failed for {what}: {e}")
+                FAILURES.inc(ticker=what, provider=provider.name, stage=stage)
+                errors.append(f"{provider.name}: {e}")
+        raise ProviderUnavailableError("; ".join(errors) or f"No provider available for {what}")
+
+    def health(self) -> list:
+        return [provider.health() for provider in self.providers]
+
+
+# Registry of the known providers: name -> function building the client
+PROVIDER_FACTORIES = {
+    "alpha_vantage": lambda: AlphaVantageClient(
+        api_key=os.getenv("ALPHA_VANTAGE_API_KEY"),
+        rate_limiter=TokenBucket.per_minute(settings.ALPHA_VANTAGE_REQUESTS_PER_MINUTE),
+    ),
+    "yahoo_finance": lambda: YahooFinanceClient(
+        rate_limiter=TokenBucket.per_minute(settings.YAHOO_FINANCE_REQUESTS_PER_MINUTE),
+    ),
+}
+
+
+def register_provider(name: str, factory):
+    """
+    Register a provider, so that it can be listed in the DATA_PROVIDERS setting.
+    """
+    PROVIDER_FACTORIES[name] = factory
+
+
+def build_provider_chain(names: list = None, offline: bool = False) -> ProviderChain:
+    """
+    Build the fallback chain of the given providers, or of the DATA_PROVIDERS setting, in that order.
+    Every client is wrapped with the response cache and gets its own circuit breaker.
+    """
+    providers = []
+    for name in names or settings.DATA_PROVIDERS:
+        if name not in PROVIDER_FACTORIES:
+            raise ValueError(f"Unknown data provider: {name}")
+        breaker = CircuitBreaker(
+            failure_threshold=settings.PROVIDER_BREAKER_FAILURE_THRESHOLD,
+            cooldown_seconds=settings.PROVIDER_BREAKER_COOLDOWN_SECONDS,
+        )
+        providers.append(Provider(name, with_cache(PROVIDER_FACTORIES[name](), name, offline=offline), breaker))
+    return ProviderChain(providers)
@@ -0,0 +1,38 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    Tokens are refilled at `rate` per second up to `capacity`, and every call to the provider consumes one token.
+    A single bucket is shared by all the threads calling the same provider.
+    """
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, calls: int):
+        """
+        Build a bucket allowing `calls` requests per minute, which can all be spent in a burst.
+        """
+        return cls(rate=calls / 60, capacity=calls)
+
+    def acquire(self):
+        """
+        Block until a token is available and consume it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
@@ -1,5 +1,9 @@
 from data_ingestion.models import TickerInfo
 from data_ingestion.models import HistoricalPrice, BaseHistoricalExchangeRate
+from data_ingestion.src.exchange_rate_cache import BASE_CURRENCY, get_exchange_rate_cache
+from data_ingestion.src.base_prices import get_base_price_index, get_default_base_date
+from decimal import Decimal
+import pandas as pd
 from django.utils.dateparse import parse_date
 from django.utils.timezone import now
 
@@ -20,10 +24,34 @@ class PriceReader:
 
         return queryset.order_by('date')
 
+    def get_base_price(self, ticker: str, rebase_to=None):
+        """
+        Return the price on which the prices of a ticker are rebased: its close as of the rebase_to date,
+        or as of the date of the first transaction by default. None when there is no such price.
+        Raises ValueError when rebase_to is not a valid date.
+        """
+        if rebase_to:
+            base_date = parse_date(rebase_to)
+            if base_date is None:
+                raise ValueError(f"Invalid rebase_to date: {rebase_to}")
+        else:
+            base_date = get_default_base_date()
+            if base_date is None:
+                return None
+        return get_base_price_index().get(ticker, base_date)
+
 class ExchangeRateReader:
     def get_exchange_rates(self, from_currency: str, to_currency='EUR', start_date=None, end_date=None):
+        """
+        Return the daily rates of a currency pair, sorted by date. The rates of each currency are only ingested
+        against EUR: the other pairs are derived by triangulation through EUR, as unsaved instances with the
+        close rate only. Raises ValueError when the rates of one of the currencies are not stored.
+        """
         queryset = BaseHistoricalExchangeRate.objects.filter(from_currency=from_currency, to_currency=to_currency)  
 
+        if (to_currency != BASE_CURRENCY or from_currency == BASE_CURRENCY) and not queryset.exists():
+            return self.get_cross_rates(from_currency, to_currency, start_date, end_date)
+
         if start_date:
             queryset = queryset.filter(date__gte=parse_date(start_date))
         if end_date:
@@ -32,3 +60,21 @@ class ExchangeRateReader:
             queryset = queryset.filter(date__lte=now())
 
         return queryset.order_by('date')
+
+    def get_cross_rates(self, from_currency: str, to_currency: str, start_date=None, end_date=None):
+        """
+        Return the triangulated rates of a currency pair, read from the cross rate cache shared by the process.
+        """
+        rates = get_exchange_rate_cache().get_rates(from_currency, to_currency)
+        start = pd.Timestamp(parse_date(start_date)) if start_date else None
+        end = pd.Timestamp(parse_date(end_date) if end_date else now().date())
+        rates = rates.loc[start:end]
+        return [
+            BaseHistoricalExchangeRate(
+                from_currency=from_currency,
+                to_currency=to_currency,
+                close=Decimal(f"{rate:.8f}"),
+                date=date.date(),
+            )
+            for date, rate in rates.items()
+        ]
@@ -0,0 +1,153 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date
+from pathlib import Path
+from django.conf import settings
+from data_ingestion.src.api_fetcher import APIFetcher, ProviderUnavailableError
+
+logger = logging.getLogger(__name__)
+
+
+class CacheMiss(ProviderUnavailableError):
+    """
+    Raised in offline mode when a response is not in the cache.
+    """
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of raw provider responses, stored as gzip-compressed JSON files on disk.
+    Entries are keyed by provider, endpoint, parameters and as-of date, expire after `ttl_seconds`,
+    and the oldest entries are evicted once the cache grows over `max_bytes`.
+    """
+    def __init__(self, directory, ttl_seconds: int, max_bytes: int):
+        self.directory = Path(directory)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(provider: str, endpoint: str, params: dict, as_of: date) -> str:
+        payload = json.dumps([provider, endpoint, params, as_of], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json.gz"
+
+    def get(self, key: str):
+        """
+        Return the cached payload for a key, or None if it is missing or expired.
+        """
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl_seconds:
+                path.unlink(missing_ok=True)
+                return None
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+
+    def put(self, key: str, payload):
+        """
+        Store a payload. The file is written next to its final path and renamed, so readers never see partial files.
+        """
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f, default=str)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Delete the expired entries, then the least recently written ones until the cache fits in max_bytes.
+        """
+        with self.lock:
+            now = time.time()
+            entries = []
+            for path in self.directory.glob("*/*.json.gz"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.ttl_seconds:
+                    path.unlink(missing_ok=True)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+
+
+class CachedAPIFetcher(APIFetcher):
+    """
+    Wraps any APIFetcher and serves its responses from a ResponseCache.
+    The responses of the APIFetcher methods are cached; any other attribute is forwarded to the wrapped client.
+    Streamed responses (stream_* methods) are never cached, since they are read without being held in memory.
+    In offline mode, the wrapped client is never called and a miss raises CacheMiss.
+    """
+    def __init__(self, client, cache: ResponseCache, provider: str = None, offline: bool = False, as_of: date = None):
+        self.client = client
+        self.cache = cache
+        self.provider = provider or type(client).__name__
+        self.offline = offline
+        self.as_of = as_of or date.today()
+
+    def __getattr__(self, name):
+        if name == "client":
+            raise AttributeError(name)
+        attribute = getattr(self.client, name)
+        if self.offline and name.startswith(("get_", "stream_")) and callable(attribute):
+            def offline_call(*args, **kwargs):
+                raise CacheMiss(f"{self.provider}.{name} is not cached (offline mode)")
+            return offline_call
+        return attribute
+
+    def _cached(self, endpoint: str, *args, **kwargs):
+        key = self.cache.make_key(self.provider, endpoint, {"args": args, "kwargs": kwargs}, self.as_of)
+        payload = self.cache.get(key)
+        if payload is not None:
+            logger.debug(f"Cache hit for {self.provider}.{endpoint}{args}")
+            return payload
+        if self.offline:
+            raise CacheMiss(f"No cached response for {self.provider}.{endpoint}{args} (offline mode)")
+        payload = getattr(self.client, endpoint)(*args, **kwargs)
+        self.cache.put(key, payload)
+        return payload
+
+    def get_daily_time_series(self, ticker: str, start_date=None) -> dict:
+        return self._cached("get_daily_time_series", ticker, start_date=start_date)
+
+    def get_overview(self, ticker: str) -> dict:
+        return self._cached("get_overview", ticker)
+
+    def get_exchange_rates(self, from_symbol: str, to_symbol="EUR") -> dict:
+        return self._cached("get_exchange_rates", from_symbol, to_symbol)
+
+
+def with_cache(client, provider: str = None, offline: bool = False):
+    """
+    Wrap a client with the on-disk response cache configured in the settings.
+    Offline mode is enabled by the argument or by the PROVIDER_CACHE_OFFLINE setting.
+    The client is returned as is when the cache is disabled and offline mode is not requested.
+    """
+    offline = offline or settings.PROVIDER_CACHE_OFFLINE
+    if not settings.PROVIDER_CACHE_ENABLED and not offline:
+        return client
+    cache = ResponseCache(
+        settings.PROVIDER_CACHE_DIR,
+        ttl_seconds=settings.PROVIDER_CACHE_TTL_SECONDS,
+        max_bytes=settings.PROVIDER_CACHE_MAX_BYTES,
+    )
+    return CachedAPIFetcher(client, cache, provider=provider, offline=offline)
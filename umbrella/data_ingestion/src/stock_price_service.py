@@ -1,113 +1,280 @@
 from data_ingestion.src.database_handler import DatabaseHandler
 from data_ingestion.src.api_fetcher import APIFetcher
-from data_ingestion.models import BaseHistoricalExchangeRate
+from data_ingestion.src.exchange_rate_cache import ExchangeRateCache
+from data_ingestion.src.calendars import get_sessions
+from data_ingestion.src.metrics import STAGE_SECONDS, timed
+from data_ingestion.models import TickerInfo
 import logging
 from datetime import datetime, timedelta
+from itertools import islice
 import pandas as pd
-from transactions.models import Transaction
 
 logger = logging.getLogger(__name__)
 
+# Depth of the price history kept for each ticker
+HISTORY_DAYS = 1825  # 5 years
+# Number of days re-fetched before the last ingested date, so that revised prices get picked up
+INCREMENTAL_OVERLAP_DAYS = 7
+# Number of rows parsed and written at once by the streaming ingestion
+STREAM_CHUNK_ROWS = 500
+
+# Mapping of the Alpha Vantage time series fields to the HistoricalPrice columns
+PRICE_COLUMNS = {
+    "1. open": "open",
+    "2. high": "high",
+    "3. low": "low",
+    "4. close": "close",
+    "5. volume": "volume",
+}
+# Columns converted to EUR with the exchange rate of the day
+EURO_COLUMNS = {
+    "open": "open_euro",
+    "high": "high_euro",
+    "low": "low_euro",
+    "close": "close_euro",
+}
+
+
+def iter_chunks(items, size: int):
+    """
+    Group an iterator into lists of at most `size` items.
+    """
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
 class StockPriceService:
     """
     This class is responsible for fetching stock prices and exchange rates from the Alpha Vantage API,
     enriching the data with additional information, and saving it to the database using the DatabaseHandler.
     """
-    def __init__(self, client: APIFetcher, repository: DatabaseHandler):
+    def __init__(self, client: APIFetcher, repository: DatabaseHandler, exchange_rates: ExchangeRateCache = None):
+        """
+        Args:
+            client (APIFetcher): The API client used to fetch the data
+            repository (DatabaseHandler): The handler used to read and save the data
+            exchange_rates (ExchangeRateCache, optional): Exchange rates shared with the other services of the run
+        """
         self.client = client
         self.repo = repository
+        self.exchange_rates = exchange_rates or ExchangeRateCache()
     
-    def _get_currency(self, ticker: str) -> str:
+    def _get_currency(self, ticker: str, currency: str = None):
         """
-        Fetches the currency of the stock ticker from the API.
+        Resolves the currency of the stock ticker, together with its daily close rate to EUR
+        as a float Series indexed by date (None for EUR tickers).
+        The currency is read from the stored company information, and only fetched from the API
+        when the ticker has no TickerInfo row yet.
         """
+        if currency is None:
+            currency = TickerInfo.objects.filter(ticker=ticker).values_list("currency", flat=True).first()
+        if currency is None:
+            try:
+                overview = self.client.get_overview(ticker)
+                currency = overview.get("Currency")
+            except Exception as e:
+                logger.error(f"Error fetching the currency for {ticker}: {e}")
+                raise e
+        logger.info(f"Currency for {ticker} is {currency}")
 
-        try:
-            overview = self.client.get_overview(ticker)
-            currency = overview.get("Currency")
-            logging.info(f"Currency for {ticker} is {currency}")
-        except Exception as e:
-            logger.error(f"Error fetching the currency for {ticker}: {e}")
-            raise e
-
-        exchange_rates = {}
+        exchange_rates = None
         if (currency != "EUR"):
-            exchange_rates = BaseHistoricalExchangeRate.objects.filter(from_currency=currency).values('date', 'close')
-            if not exchange_rates:
-                raise ValueError(f"No exchange rates found for {currency} in the database or API response.")
-            else:
-                # Convert database results to expected format
-                exchange_rates = {
-                    rate['date'].strftime("%Y-%m-%d"): {"4. close": str(rate['close'])} 
-                    for rate in exchange_rates
-                }
+            exchange_rates = self.exchange_rates.get_rates(currency)
 
         return currency, exchange_rates
 
-    def save_daily_prices(self, ticker: str):
+    @staticmethod
+    def _to_prices_frame(time_series: dict) -> pd.DataFrame:
+        """
+        Converts an Alpha Vantage style time series into a float DataFrame indexed by date,
+        with the HistoricalPrice column names.
+        """
+        df = pd.DataFrame.from_dict(time_series, orient='index').rename(columns=PRICE_COLUMNS)
+        df.index = pd.to_datetime(df.index).normalize()
+        return df[list(PRICE_COLUMNS.values())].astype(float).sort_index()
+
+    @staticmethod
+    def _enrich(df: pd.DataFrame, exchange_rates) -> pd.DataFrame:
+        """
+        Adds the EUR columns to a prices DataFrame, using columnar operations only.
+        The exchange rates are aligned on the price dates, carrying the last known rate over missing days.
+        The prices rebased on a date (the former NAV field) are computed at read time, see base_prices.
+        """
+        df = df.copy()
+        if exchange_rates is None:
+            rates = 1.0
+        else:
+            rates = exchange_rates.reindex(df.index, method="ffill")
+        for column, euro_column in EURO_COLUMNS.items():
+            df[euro_column] = df[column] * rates
+        return df
+
+    def _get_fetch_start(self, ticker: str, incremental: bool):
+        """
+        Returns the date from which the prices of the ticker must be fetched in incremental mode,
+        or None when the full history is needed.
+        """
+        if not incremental:
+            return None
+        watermark = self.repo.get_last_date(ticker)
+        if not watermark:
+            logger.info(f"No prices stored yet for {ticker}, running a full refresh")
+            return None
+        fetch_from = watermark - timedelta(days=INCREMENTAL_OVERLAP_DAYS)
+        logger.info(f"Last ingested date for {ticker} is {watermark}, fetching from {fetch_from}")
+        return fetch_from
+
+    @staticmethod
+    def _get_date_range(fetch_from):
+        """
+        Returns the first and last days of the date grid, from the fetch start (or the start of the history) to today.
+        The grid itself is made of the trading sessions of the ticker's exchange within that range.
+        """
+        end_date = pd.Timestamp(datetime.now()).normalize()
+        if fetch_from:
+            return pd.Timestamp(fetch_from), end_date
+        return end_date - pd.Timedelta(days=HISTORY_DAYS), end_date
+
+    def _prepare_prices(self, ticker: str, prices_df: pd.DataFrame, fetch_from, currency: str = None):
+        """
+        Aligns the raw prices of a ticker on the trading sessions of its exchange and enriches them
+        with the EUR values. Returns the currency and the prices DataFrame ready to be saved.
+        """
+        with timed(STAGE_SECONDS, stage="prepare"):
+            start_date, end_date = self._get_date_range(fetch_from)
+            sessions = get_sessions(ticker, start_date, end_date)
+
+            # Forward fill the sessions without data from the previous day's data, seeding from rows before the range
+            df = prices_df.reindex(sessions, method="ffill")
+            df = df.dropna(subset=["close"])
+
+            currency, exchange_rates = self._get_currency(ticker, currency)
+            return currency, self._enrich(df, exchange_rates)
+
+    def fetch_daily_prices(self, ticker: str, incremental: bool = False, currency: str = None):
+        """
+        Fetches the daily stock prices for the given ticker and enriches them with the EUR values,
+        without writing anything to the database. The currency can be given when it is already known.
+
+        In incremental mode, only the tail after the last ingested date (minus a small overlap to pick up
+        revised prices) is requested. Without a watermark, it falls back to a full refresh.
+        Returns the currency, the prices DataFrame and whether the stored history must be replaced.
+        """
+        fetch_from = self._get_fetch_start(ticker, incremental)
+        logger.info(f"Fetching daily prices for {ticker}")
+        with timed(STAGE_SECONDS, stage="fetch"):
+            raw_prices = self.client.get_daily_time_series(ticker, start_date=fetch_from)
+        prices_df = self._to_prices_frame(raw_prices["Time Series (Daily)"])
+        currency, df = self._prepare_prices(ticker, prices_df, fetch_from, currency)
+        return currency, df, fetch_from is None
+
+    def fetch_daily_prices_batch(self, tickers: list, incremental: bool = False, currencies: dict = None) -> dict:
+        """
+        Same as fetch_daily_prices for many tickers, using a single multi-symbol download.
+        The client must implement get_daily_time_series_batch. The download starts at the earliest date needed
+        by any of the tickers, and `currencies` optionally maps tickers to their known currency.
+        Returns a dict mapping each ticker to its (currency, prices, replace) tuple,
+        or to the exception raised while preparing it.
+        """
+        fetch_from = {ticker: self._get_fetch_start(ticker, incremental) for ticker in tickers}
+        starts = list(fetch_from.values())
+        start_date = None if None in starts else min(starts)
+
+        logger.info(f"Fetching daily prices for {len(tickers)} tickers in one batch")
+        with timed(STAGE_SECONDS, stage="fetch_batch"):
+            batch = self.client.get_daily_time_series_batch(tickers, start_date=start_date)
+
+        results = {}
+        for ticker in tickers:
+            try:
+                if ticker not in batch.columns.get_level_values(0):
+                    raise ValueError(f"No prices returned for {ticker}")
+                prices_df = batch[ticker][list(PRICE_COLUMNS.values())].dropna(how="all")
+                # A ticker unknown to the provider comes back as a column of NaN, not as a missing column
+                if prices_df.empty:
+                    raise ValueError(f"No prices returned for {ticker}")
+                currency, df = self._prepare_prices(ticker, prices_df, fetch_from[ticker], (currencies or {}).get(ticker))
+                results[ticker] = (currency, df, fetch_from[ticker] is None)
+            except Exception as e:
+                logger.error(f"Error preparing the prices of {ticker}: {e}")
+                results[ticker] = e
+        return results
+
+    def save_daily_prices(self, ticker: str, incremental: bool = False):
         """
         Fetches and saves daily stock prices for the given ticker.
         This method retrieves daily stock prices, enriches them with exchange rates if necessary,
-        and saves the data to the database.
+        and saves the data to the database. Returns the number of inserted and updated rows.
         """
-        logger.info(f"Fetching daily prices for {ticker}")
-        raw_prices = self.client.get_daily_time_series(ticker)
-        prices = raw_prices["Time Series (Daily)"]
-
-        prices_df = pd.DataFrame.from_dict(prices, orient='index')
-        prices_df.index = pd.to_datetime(prices_df.index).normalize()
-        
-        # Get data for the last 5 years
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=1825)  # 5 years
-
-        # Create a DataFrame with all weekdays in the date range, with timezone-aware datetime
-        all_weekdays = pd.date_range(start=start_date, end=end_date, freq='B').normalize()
-        df = prices_df.reindex(all_weekdays)
-
-        # Forward fill to replace empty values with previous day's data
-        df = df.ffill()
-
-        # --------------------------
-        # Compute NAV field
-        # --------------------------
-        # Get the date of the first transaction from the Transaction table
-        first_transaction = Transaction.objects.order_by('date').first()
-        if first_transaction:
-            base_date = first_transaction.date
-            # Ensure base_date is normalized to match df.index
-            base_date = pd.to_datetime(base_date).normalize()
-        else:
-            logger.warning("No transactions found in the Transaction table, NAV will be None")
-            base_date = None
+        currency, df, replace = self.fetch_daily_prices(ticker, incremental=incremental)
+        logger.info(f"Saving {len(df)} daily prices for {ticker} in {currency}")
+        with timed(STAGE_SECONDS, stage="write"):
+            return self.repo.save_prices(ticker, currency, df, replace=replace)
 
-        if base_date in df.index:
-            base_price = float(df.loc[base_date]["4. close"])
-            df["nav"] = df["4. close"].astype(float) / base_price
-        else:
-            logger.warning(f"Base date {base_date.date()} not in data for {ticker}, NAV will be None")
-            df["nav"] = None
+    def save_daily_prices_streaming(self, ticker: str, incremental: bool = False, chunk_size: int = STREAM_CHUNK_ROWS):
+        """
+        Same as save_daily_prices, with a bounded memory use whatever the length of the history.
+        The client must implement stream_daily_time_series, which yields the prices latest first while the response
+        is downloaded. They are aligned on the date grid, enriched and upserted `chunk_size` rows at a time, and the
+        download stops as soon as the start of the grid is reached.
 
-        # --------------------------
-        # Merge with exchange rates
-        # --------------------------
+        Each chunk fills the sessions from its oldest date up to the oldest date of the previous (more recent) chunk,
+        forward filling from its own rows.
+        Returns the number of inserted and updated rows.
+        """
+        fetch_from = self._get_fetch_start(ticker, incremental)
+        start_date, end_date = self._get_date_range(fetch_from)
         currency, exchange_rates = self._get_currency(ticker)
 
-        merged = {}
-        for date, row in df.iterrows():
-            date_str = date.strftime("%Y-%m-%d")
-            price_data = row.to_dict()
-            exchange_rate = exchange_rates.get(date_str, {}).get("4. close", 1)
+        logger.info(f"Streaming daily prices for {ticker}")
+        items = self.client.stream_daily_time_series(ticker, start_date=fetch_from)
+        # Exclusive upper bound of the grid days not filled yet
+        upper = end_date + pd.Timedelta(days=1)
+        first_date = last_date = None
+        inserted = updated = 0
+        try:
+            for chunk in iter_chunks(items, chunk_size):
+                prices_df = self._to_prices_frame(dict(chunk))
+                oldest = prices_df.index[0]
+                grid = get_sessions(ticker, max(oldest, start_date), upper - pd.Timedelta(days=1))
+                df = prices_df.reindex(grid, method="ffill").dropna(subset=["close"])
+                upper = min(upper, oldest)
+                if not df.empty:
+                    chunk_inserted, chunk_updated = self.repo.save_prices(
+                        ticker, currency, self._enrich(df, exchange_rates), replace=False
+                    )
+                    inserted += chunk_inserted
+                    updated += chunk_updated
+                    first_date = df.index[0].date() if first_date is None else min(first_date, df.index[0].date())
+                    last_date = df.index[-1].date() if last_date is None else max(last_date, df.index[-1].date())
+                if oldest <= start_date:
+                    break
+        finally:
+            # Stops the download when the history needed was read before the end of the response
+            items.close()
 
-            merged[date_str] = {
-                **price_data,
-                "exchange_rate": exchange_rate,
-                "nav": float(row["nav"]),
-            }
+        if first_date is None:
+            logger.warning(f"No prices returned for {ticker}")
+            return inserted, updated
+        if fetch_from is None:
+            self.repo.trim_prices(ticker, first_date, last_date)
+        logger.info(f"Saved prices for {ticker}: {inserted} inserted, {updated} updated")
+        return inserted, updated
 
-        self.repo.ensure_table_exists()
-        logger.info(f"Saving daily prices for {ticker} in {currency}")
-        self.repo.save_prices(ticker, currency, merged)
+    def save_daily_prices_batch(self, tickers: list, incremental: bool = False) -> dict:
+        """
+        Fetches the daily stock prices of many tickers in one batch and saves them.
+        Returns a dict mapping each ticker to its number of inserted and updated rows, or to the exception raised.
+        """
+        results = {}
+        for ticker, prepared in self.fetch_daily_prices_batch(tickers, incremental=incremental).items():
+            if isinstance(prepared, Exception):
+                results[ticker] = prepared
+                continue
+            currency, df, replace = prepared
+            results[ticker] = self.repo.save_prices(ticker, currency, df, replace=replace)
+        return results
 
     def save_daily_exchange_rates(self, from_symbol: str, to_symbol="EUR"):
         """
@@ -115,7 +282,23 @@ class StockPriceService:
         This method retrieves daily exchange rates for the specified `from_symbol` and `to_symbol`
         """
         logger.info(f"Fetching daily exchange rates from {from_symbol} to {to_symbol}")
-        raw_fx = self.client.get_exchange_rates(from_symbol, to_symbol)
+        with timed(STAGE_SECONDS, stage="fetch_exchange_rates"):
+            raw_fx = self.client.get_exchange_rates(from_symbol, to_symbol)
         exchange_rates = raw_fx["Time Series FX (Daily)"]
-        self.repo.ensure_table_exists()
-        self.repo.save_daily_exchange_rates(from_symbol, to_symbol, exchange_rates)
\ No newline at end of file
+        saved = self.repo.save_daily_exchange_rates(from_symbol, to_symbol, exchange_rates)
+        self.exchange_rates.invalidate(from_symbol)
+        return saved
+
+    def save_daily_exchange_rates_streaming(self, from_symbol: str, to_symbol="EUR", chunk_size: int = STREAM_CHUNK_ROWS):
+        """
+        Same as save_daily_exchange_rates, with a bounded memory use: the rates are parsed while the response
+        is downloaded and upserted `chunk_size` rows at a time. The client must implement stream_exchange_rates.
+        """
+        logger.info(f"Streaming daily exchange rates from {from_symbol} to {to_symbol}")
+        inserted = updated = 0
+        for chunk in iter_chunks(self.client.stream_exchange_rates(from_symbol, to_symbol), chunk_size):
+            chunk_inserted, chunk_updated = self.repo.save_daily_exchange_rates(from_symbol, to_symbol, dict(chunk))
+            inserted += chunk_inserted
+            updated += chunk_updated
+        self.exchange_rates.invalidate(from_symbol)
+        return inserted, updated
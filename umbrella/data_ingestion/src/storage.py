@@ -0,0 +1,134 @@
+import csv
+import io
+import logging
+from django.db import connections, models
+
+logger = logging.getLogger(__name__)
+
+# Number of rows sent to the database per INSERT statement
+BATCH_SIZE = 500
+
+
+class StorageBackend:
+    """
+    Writes rows through the Django ORM, with `INSERT ... ON CONFLICT DO UPDATE` statements generated by bulk_create.
+    Works on every database supported by Django (SQLite, PostgreSQL) and relies on the schema created by the migrations.
+    """
+    def __init__(self, using: str = "default"):
+        self.using = using
+
+    @staticmethod
+    def get_update_fields(model, unique_fields):
+        return [
+            field for field in model._meta.concrete_fields
+            if not field.primary_key and field.name not in unique_fields
+        ]
+
+    def count_existing(self, model, instances, unique_fields) -> int:
+        """
+        Return how many of the given instances already have a row with the same unique_fields key, in one query.
+        Date keys are filtered on their range, the other keys on their distinct values.
+        """
+        filters = {}
+        for name in unique_fields:
+            values = {getattr(instance, name) for instance in instances}
+            if isinstance(model._meta.get_field(name), models.DateField):
+                filters[f"{name}__range"] = (min(values), max(values))
+            else:
+                filters[f"{name}__in"] = values
+        existing = set(model.objects.using(self.using).filter(**filters).values_list(*unique_fields))
+        return sum(1 for instance in instances if tuple(getattr(instance, name) for name in unique_fields) in existing)
+
+    def upsert(self, model, instances, unique_fields) -> tuple:
+        """
+        Insert the given model instances, updating every other column of the rows that already exist
+        for the unique_fields key. Must be called inside a transaction.
+        Returns the number of inserted and updated rows.
+        """
+        if not instances:
+            return 0, 0
+        existing_count = self.count_existing(model, instances, unique_fields)
+        model.objects.using(self.using).bulk_create(
+            instances,
+            batch_size=BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=[field.name for field in self.get_update_fields(model, unique_fields)],
+        )
+        return len(instances) - existing_count, existing_count
+
+
+class PostgresStorageBackend(StorageBackend):
+    """
+    PostgreSQL fast path: the rows are streamed with COPY into a temporary table, then merged into the target table
+    with a single `INSERT ... SELECT ... ON CONFLICT DO UPDATE`. The inserted and updated rows are counted
+    by the merge statement itself, so no extra lookup is needed.
+    Small writes go through the ORM path, where a COPY would not pay off.
+    """
+    # Below this number of rows, the ORM path is used
+    COPY_THRESHOLD = 50
+
+    def upsert(self, model, instances, unique_fields) -> tuple:
+        if len(instances) < self.COPY_THRESHOLD:
+            return super().upsert(model, instances, unique_fields)
+
+        connection = connections[self.using]
+        quote = connection.ops.quote_name
+        key_fields = [model._meta.get_field(name) for name in unique_fields]
+        fields = key_fields + self.get_update_fields(model, unique_fields)
+        columns = ", ".join(quote(field.column) for field in fields)
+        table = quote(model._meta.db_table)
+        staging = quote(f"{model._meta.db_table}_staging")
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA"
+            )
+            rows = (
+                [field.get_db_prep_save(getattr(instance, field.attname), connection) for field in fields]
+                for instance in instances
+            )
+            self._copy(cursor.cursor, f"COPY {staging} ({columns}) FROM STDIN", rows)
+
+            updates = ", ".join(
+                f"{quote(field.column)} = EXCLUDED.{quote(field.column)}" for field in fields[len(key_fields):]
+            )
+            conflict = ", ".join(quote(field.column) for field in key_fields)
+            # xmax is 0 for freshly inserted rows and set for the rows rewritten by the DO UPDATE clause
+            cursor.execute(
+                f"WITH merged AS ("
+                f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} "
+                f"ON CONFLICT ({conflict}) DO UPDATE SET {updates} "
+                f"RETURNING (xmax = 0) AS inserted"
+                f") SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM merged"
+            )
+            inserted, updated = cursor.fetchone()
+            cursor.execute(f"DROP TABLE {staging}")
+        return inserted, updated
+
+    @staticmethod
+    def _copy(raw_cursor, statement, rows):
+        """
+        Stream rows to a COPY ... FROM STDIN statement, with psycopg 3 or psycopg2.
+        """
+        if hasattr(raw_cursor, "copy"):
+            with raw_cursor.copy(statement) as copy:
+                for row in rows:
+                    copy.write_row(row)
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([r"\N" if value is None else value for value in row])
+        buffer.seek(0)
+        raw_cursor.copy_expert(f"{statement} WITH (FORMAT csv, NULL '\\N')", buffer)
+
+
+def get_storage_backend(using: str = "default") -> StorageBackend:
+    """
+    Return the storage backend matching the vendor of a database connection.
+    """
+    if connections[using].vendor == "postgresql":
+        return PostgresStorageBackend(using)
+    return StorageBackend(using)
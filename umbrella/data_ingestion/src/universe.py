@@ -0,0 +1,86 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from data_ingestion.models import TickerFreshness, WatchlistTicker
+from data_ingestion.src.calendars import get_last_close
+from transactions.src.ledger import get_positions
+
+logger = logging.getLogger(__name__)
+
+
+def get_traded_tickers() -> dict:
+    """
+    Return the net quantity held of every ticker the fund ever traded, from the position ledger.
+    """
+    return get_positions()
+
+
+def get_universe() -> dict:
+    """
+    Return the tickers to ingest: every ticker the fund holds or held, and the watchlist.
+    Each ticker maps to whether it is active, i.e. currently held or on the watchlist.
+    Tickers that are no longer held keep their history but are not refreshed anymore.
+    """
+    universe = {ticker: quantity > 0 for ticker, quantity in get_traded_tickers().items()}
+    for ticker in WatchlistTicker.objects.values_list("ticker", flat=True):
+        universe[ticker] = True
+    return universe
+
+
+def is_price_refresh_due(ticker: str, refreshed_at, now) -> bool:
+    """
+    Tell whether a session of the ticker's exchange closed since its prices were last refreshed.
+    A session counts as closed PRICE_CLOSE_DELAY_MINUTES after its close, once the providers published its prices.
+    """
+    if refreshed_at is None:
+        return True
+    delay = timedelta(minutes=settings.PRICE_CLOSE_DELAY_MINUTES)
+    last_close = get_last_close(ticker, now - delay)
+    return last_close is not None and refreshed_at < last_close + delay
+
+
+def plan_ingestion(now=None, force: bool = False) -> dict:
+    """
+    Return what must be refreshed for each ticker of the universe, as a dict mapping the tickers to
+    {"info": bool, "prices": bool}, leaving out the tickers that are up to date.
+    The company information of the active tickers is refreshed after TICKER_INFO_TTL_DAYS, and their prices once
+    a session of their exchange closed since the last refresh. The tickers no longer held are only ingested
+    when they were never ingested. With force, everything is refreshed.
+    """
+    now = now or timezone.now()
+    info_ttl = timedelta(days=settings.TICKER_INFO_TTL_DAYS)
+    freshness = {row.ticker: row for row in TickerFreshness.objects.all()}
+
+    universe = get_universe()
+    plan = {}
+    for ticker, active in sorted(universe.items()):
+        row = freshness.get(ticker)
+        info_refreshed_at = row.info_refreshed_at if row else None
+        prices_refreshed_at = row.prices_refreshed_at if row else None
+        if force:
+            refresh_info = refresh_prices = True
+        elif active:
+            refresh_info = info_refreshed_at is None or now - info_refreshed_at >= info_ttl
+            refresh_prices = is_price_refresh_due(ticker, prices_refreshed_at, now)
+        else:
+            refresh_info = info_refreshed_at is None
+            refresh_prices = prices_refreshed_at is None
+        if refresh_info or refresh_prices:
+            plan[ticker] = {"info": refresh_info, "prices": refresh_prices}
+    logger.info(f"{len(plan)} tickers to refresh out of a universe of {len(universe)} tickers")
+    return plan
+
+
+def mark_refreshed(ticker: str, info: bool = False, prices: bool = False, now=None):
+    """
+    Record that the company information and/or the prices of a ticker were just refreshed.
+    """
+    now = now or timezone.now()
+    defaults = {}
+    if info:
+        defaults["info_refreshed_at"] = now
+    if prices:
+        defaults["prices_refreshed_at"] = now
+    if defaults:
+        TickerFreshness.objects.update_or_create(ticker=ticker, defaults=defaults)
@@ -1,19 +1,28 @@
 import yfinance as yf
+import pandas as pd
 import logging
 from datetime import datetime, timedelta
+from data_ingestion.src.metrics import PROVIDER_REQUEST_SECONDS, timed
 
 logger = logging.getLogger(__name__)
 
+# Name of the provider in the metrics. yfinance does not expose the size of the responses, so only the durations are recorded.
+PROVIDER_NAME = "yahoo_finance"
+
 class YahooFinanceClient:
     """
     This class is used to get data from the Yahoo Finance API.
     It mimics the AlphaVantageClient interface for consistency.
     """
-    def __init__(self):
+    def __init__(self, rate_limiter=None):
         """
         Initialize the Yahoo Finance client.
         No API key is needed for Yahoo Finance.
+
+        Args:
+            rate_limiter (TokenBucket, optional): Limiter shared by every caller of the API
         """
+        self.rate_limiter = rate_limiter
         self.YAHOO_TO_MODEL = {
             "longName": "Name",
             "longBusinessSummary": "Description",
@@ -45,24 +54,32 @@ class YahooFinanceClient:
 
         pass
 
-    def get_daily_time_series(self, ticker: str) -> dict:
+    def _wait_for_rate_limit(self):
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+    def get_daily_time_series(self, ticker: str, start_date=None) -> dict:
         """
         Get the daily stock price series for a given ticker.
         Returns data in the same format as AlphaVantageClient.
         
         Args:
             ticker (str): The stock ticker symbol
+            start_date (date, optional): First date to fetch. Defaults to 5 years ago.
             
         Returns:
             dict: A dictionary containing the daily time series data in AlphaVantage format
         """
-        # Get data for the last 5 years
         end_date = datetime.now()
-        start_date = end_date - timedelta(days=1825)  # 5 years
+        if start_date is None:
+            # Get data for the last 5 years
+            start_date = end_date - timedelta(days=1825)  # 5 years
         
         # Fetch data from Yahoo Finance
+        self._wait_for_rate_limit()
         stock = yf.Ticker(ticker)
-        df = stock.history(start=start_date, end=end_date)
+        with timed(PROVIDER_REQUEST_SECONDS, provider=PROVIDER_NAME, endpoint="history"):
+            df = stock.history(start=start_date, end=end_date)
 
         # Convert to AlphaVantage format
         time_series = {}
@@ -80,9 +97,46 @@ class YahooFinanceClient:
             "Time Series (Daily)": time_series
         } 
     
+    def get_daily_time_series_batch(self, tickers: list, start_date=None) -> pd.DataFrame:
+        """
+        Get the daily stock price series of many tickers with a single multi-symbol download.
+
+        Args:
+            tickers (list): The stock ticker symbols
+            start_date (date, optional): First date to fetch. Defaults to 5 years ago.
+
+        Returns:
+            pd.DataFrame: Float prices indexed by date, with (ticker, field) columns where field is one of
+                open, high, low, close and volume. Dates missing for a ticker hold NaN.
+        """
+        end_date = datetime.now()
+        if start_date is None:
+            # Get data for the last 5 years
+            start_date = end_date - timedelta(days=1825)  # 5 years
+
+        self._wait_for_rate_limit()
+        with timed(PROVIDER_REQUEST_SECONDS, provider=PROVIDER_NAME, endpoint="download"):
+            df = yf.download(
+                list(tickers),
+                start=start_date,
+                end=end_date,
+                group_by="ticker",
+                auto_adjust=True,
+                threads=True,
+                progress=False,
+                multi_level_index=True,
+            )
+        df.index = pd.to_datetime(df.index).tz_localize(None).normalize()
+        df.columns = pd.MultiIndex.from_tuples(
+            [(ticker, field.lower()) for ticker, field in df.columns], names=["ticker", "field"]
+        )
+        return df.sort_index()
+
     def get_overview(self, ticker: str) -> dict:
+        self._wait_for_rate_limit()
         stock = yf.Ticker(ticker)
-        stock_info = stock.info
+        with timed(PROVIDER_REQUEST_SECONDS, provider=PROVIDER_NAME, endpoint="info"):
+            stock_info = stock.info
         mapped_data = self.map_yahoo_to_model(stock_info)
         try:
             mapped_data["DividendDate"] = datetime.utcfromtimestamp(mapped_data["DividendDate"]).date()
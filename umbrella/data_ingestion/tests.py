@@ -0,0 +1,1099 @@
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+import gzip
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+import requests
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from config.test_utils import QueryPlanAssertionsMixin
+from transactions.models import Transaction
+from data_ingestion.models import HistoricalPrice, BaseHistoricalExchangeRate, IngestionRun, TickerFreshness, TickerInfo, WatchlistTicker
+from data_ingestion.signals import prices_saved
+from data_ingestion.src.alpha_vantage_client import AlphaVantageClient
+from data_ingestion.src.api_fetcher import ProviderDataError, ProviderError, ProviderRateLimitError, ProviderUnavailableError
+from data_ingestion.src.base_prices import BasePriceIndex
+from data_ingestion.src.calendars import get_fund_sessions, get_last_close, get_sessions, is_fund_session
+from data_ingestion.src.database_handler import DatabaseHandler
+from data_ingestion.src.exchange_rate_cache import ExchangeRateCache
+from data_ingestion.src.ingestion_runner import IngestionRunner
+from data_ingestion.src.ingestion_runs import record_ingestion_run, render_last_runs
+from data_ingestion.src.json_stream import JSONObjectStream
+from data_ingestion.src.metrics import FAILURES, MetricsRegistry
+from data_ingestion.src.parquet_store import ParquetPriceStore, load_price_matrix
+from data_ingestion.src.price_store import AsOfMatrix, PriceStore
+from data_ingestion.src.providers import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, Provider, ProviderChain, ProviderSkippedError
+from data_ingestion.src.rate_limiter import TokenBucket
+from data_ingestion.src.readers import PriceReader, ExchangeRateReader
+from data_ingestion.src.storage import PostgresStorageBackend, StorageBackend, get_storage_backend
+from data_ingestion.src.stock_price_service import INCREMENTAL_OVERLAP_DAYS, StockPriceService
+from data_ingestion.src.yahoo_finance_client import YahooFinanceClient
+from data_ingestion.src.universe import get_universe, is_price_refresh_due, mark_refreshed, plan_ingestion
+from data_ingestion.src.response_cache import CacheMiss, CachedAPIFetcher, ResponseCache, with_cache
+
+
+class ReaderQueryPlanTest(QueryPlanAssertionsMixin, TestCase):
+    def test_price_reader_uses_index(self):
+        self.assertNoFullTableScan(PriceReader().get_prices("AAPL", "2024-01-01", "2024-12-31"))
+        self.assertNoFullTableScan(PriceReader().get_prices("AAPL"))
+
+    def test_exchange_rate_reader_uses_index(self):
+        self.assertNoFullTableScan(ExchangeRateReader().get_exchange_rates("USD", "EUR", "2024-01-01", "2024-12-31"))
+
+    def test_company_info_lookup_uses_index(self):
+        self.assertNoFullTableScan(TickerInfo.objects.filter(ticker="AAPL"))
+
+    def test_price_lookup_by_ticker_and_date_uses_index(self):
+        self.assertNoFullTableScan(HistoricalPrice.objects.filter(ticker="AAPL", date="2024-01-02"))
+        self.assertNoFullTableScan(
+            BaseHistoricalExchangeRate.objects.filter(from_currency="USD", to_currency="EUR", date__gte="2024-01-02")
+        )
+
+
+class PerTickerClient:
+    """
+    Client of a provider serving one ticker per call.
+    """
+
+
+class BatchClient:
+    """
+    Client of a provider also downloading many tickers per call.
+    """
+    def get_daily_time_series_batch(self, tickers, start_date=None):
+        raise NotImplementedError
+
+
+def build_chain(*clients) -> ProviderChain:
+    return ProviderChain([Provider(name, client, CircuitBreaker(3, 60)) for name, client in clients])
+
+
+class IngestionRunnerProvidersTest(TestCase):
+    def test_batch_provider_supports_batch_downloads(self):
+        runner = IngestionRunner(providers=build_chain(("yahoo", BatchClient()), ("av", PerTickerClient())))
+        self.assertEqual(runner.batch_provider, "yahoo")
+        self.assertEqual(runner.ticker_providers, ["av"])
+
+    def test_every_provider_serves_tickers_without_batch_provider(self):
+        runner = IngestionRunner(providers=build_chain(("av", PerTickerClient()), ("other", PerTickerClient())))
+        self.assertIsNone(runner.batch_provider)
+        self.assertEqual(runner.ticker_providers, ["av", "other"])
+
+
+def fail(error: Exception):
+    def fetch(client):
+        raise error
+    return fetch
+
+
+@mock.patch("data_ingestion.src.providers.time.monotonic", return_value=1000)
+class CircuitBreakerTest(SimpleTestCase):
+    def test_opens_after_consecutive_failures(self, monotonic):
+        breaker = CircuitBreaker(3, 60)
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        monotonic.return_value = 1059
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_lets_a_single_probe_through(self, monotonic):
+        breaker = CircuitBreaker(1, 60)
+        breaker.record_failure()
+        monotonic.return_value = 1060
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_failed_probe_reopens(self, monotonic):
+        breaker = CircuitBreaker(3, 60)
+        for _ in range(3):
+            breaker.record_failure()
+        monotonic.return_value = 1060
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        monotonic.return_value = 1119
+        self.assertFalse(breaker.allow())
+        monotonic.return_value = 1120
+        self.assertTrue(breaker.allow())
+
+    def test_successful_probe_closes(self, monotonic):
+        breaker = CircuitBreaker(1, 60)
+        breaker.record_failure()
+        monotonic.return_value = 1060
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+    def test_request_errors_do_not_trip_the_breaker(self, monotonic):
+        provider = Provider("av", PerTickerClient(), CircuitBreaker(1, 60))
+        for error in (ValueError("no data"), ProviderDataError("invalid payload"), CacheMiss("not cached")):
+            with self.assertRaises(type(error)):
+                provider.call(fail(error))
+        self.assertEqual(provider.breaker.state, CLOSED)
+        self.assertEqual((provider.calls, provider.failures), (3, 3))
+
+    def test_open_breaker_skips_the_calls(self, monotonic):
+        provider = Provider("av", PerTickerClient(), CircuitBreaker(1, 60))
+        with self.assertRaises(ProviderUnavailableError):
+            provider.call(fail(ProviderUnavailableError("down")))
+        with self.assertRaises(ProviderSkippedError):
+            provider.call(lambda client: "prices")
+        monotonic.return_value = 1060
+        self.assertEqual(provider.call(lambda client: "prices"), "prices")
+        self.assertEqual(provider.breaker.state, CLOSED)
+        self.assertEqual(provider.skipped, 1)
+
+class BasePriceIndexTest(TestCase):
+    """
+    The prices written by another process, which sends no signal to this one, are only seen once the cache expires.
+    """
+    def test_missing_base_price_is_not_cached(self):
+        index = BasePriceIndex(ttl_seconds=60)
+        self.assertIsNone(index.get("AAA", date(2024, 1, 3)))
+        HistoricalPrice.objects.create(ticker="AAA", date=date(2024, 1, 2), close=Decimal("10.00"))
+        self.assertEqual(index.get("AAA", date(2024, 1, 3)), Decimal("10.00"))
+
+    def test_base_price_expires(self):
+        HistoricalPrice.objects.create(ticker="AAA", date=date(2024, 1, 2), close=Decimal("10.00"))
+        index = BasePriceIndex(ttl_seconds=60)
+        with mock.patch("data_ingestion.src.base_prices.time.monotonic", return_value=1000):
+            self.assertEqual(index.get("AAA", date(2024, 1, 3)), Decimal("10.00"))
+        HistoricalPrice.objects.filter(ticker="AAA").update(close=Decimal("12.00"))
+        with mock.patch("data_ingestion.src.base_prices.time.monotonic", return_value=1059):
+            self.assertEqual(index.get("AAA", date(2024, 1, 3)), Decimal("10.00"))
+        with mock.patch("data_ingestion.src.base_prices.time.monotonic", return_value=1060):
+            self.assertEqual(index.get("AAA", date(2024, 1, 3)), Decimal("12.00"))
+
+
+class ExchangeRateCacheTest(TestCase):
+    def test_rates_expire(self):
+        BaseHistoricalExchangeRate.objects.create(from_currency="USD", to_currency="EUR", date=date(2024, 1, 2), close=Decimal("0.9"))
+        with mock.patch("data_ingestion.src.exchange_rate_cache.time.monotonic", return_value=1000):
+            cache = ExchangeRateCache(ttl_seconds=60)
+            self.assertEqual(cache.get_rates("USD").iloc[-1], 0.9)
+        BaseHistoricalExchangeRate.objects.create(from_currency="USD", to_currency="EUR", date=date(2024, 1, 3), close=Decimal("0.8"))
+        with mock.patch("data_ingestion.src.exchange_rate_cache.time.monotonic", return_value=1059):
+            self.assertEqual(len(cache.get_rates("USD")), 1)
+        with mock.patch("data_ingestion.src.exchange_rate_cache.time.monotonic", return_value=1060):
+            self.assertEqual(cache.get_rates("USD").iloc[-1], 0.8)
+
+    def rate(self, from_currency: str, to_currency: str, day: int, close: str):
+        BaseHistoricalExchangeRate.objects.create(
+            from_currency=from_currency, to_currency=to_currency, date=date(2024, 1, day), close=Decimal(close)
+        )
+
+    def test_cross_rates_through_eur(self):
+        self.rate("USD", "EUR", 2, "0.9")
+        self.rate("USD", "EUR", 4, "0.8")
+        # Only the EUR/GBP rates are stored for the pound, the rates of GBP to EUR are their inverse
+        self.rate("EUR", "GBP", 3, "0.5")
+        rates = ExchangeRateCache().get_rates("USD", "GBP")
+        # Both series are aligned on the union of their dates, carrying the last rate over
+        self.assertEqual(list(rates.index), list(pd.to_datetime(["2024-01-03", "2024-01-04"])))
+        np.testing.assert_allclose(rates.values, [0.45, 0.4])
+
+    def test_minor_units(self):
+        self.rate("GBP", "EUR", 2, "1.2")
+        cache = ExchangeRateCache()
+        np.testing.assert_allclose(cache.get_rates("GBp").values, [0.012])
+        np.testing.assert_allclose(cache.get_rates("EUR", "GBp").values, [1 / 0.012])
+
+    def test_stored_pair_used_as_is(self):
+        self.rate("USD", "JPY", 2, "140")
+        self.assertEqual(ExchangeRateCache().get_rates("USD", "JPY").tolist(), [140.0])
+
+    def test_missing_rates(self):
+        self.rate("USD", "EUR", 2, "0.9")
+        cache = ExchangeRateCache()
+        with self.assertRaises(ValueError):
+            cache.get_rates("CHF")
+        with self.assertRaises(ValueError):
+            cache.get_rates("USD", "CHF")
+
+    def test_rates_of_a_run_do_not_expire(self):
+        BaseHistoricalExchangeRate.objects.create(from_currency="USD", to_currency="EUR", date=date(2024, 1, 2), close=Decimal("0.9"))
+        cache = ExchangeRateCache()
+        cache.get_rates("USD")
+        BaseHistoricalExchangeRate.objects.create(from_currency="USD", to_currency="EUR", date=date(2024, 1, 3), close=Decimal("0.8"))
+        with mock.patch("data_ingestion.src.exchange_rate_cache.time.monotonic", return_value=10 ** 9):
+            self.assertEqual(len(cache.get_rates("USD")), 1)
+
+
+def byte_chunks(document: dict):
+    """
+    Split a JSON document into 1-byte chunks, so that every token and multi-byte character spans many chunks.
+    """
+    encoded = json.dumps(document, ensure_ascii=False, indent=2).encode("utf-8")
+    return [encoded[i:i + 1] for i in range(len(encoded))]
+
+
+class JSONObjectStreamTest(SimpleTestCase):
+    series = {
+        "2024-01-03": {"1. open": "184.2200", "5. volume": 58414460, "6. ratio": 1.25e-3},
+        "2024-01-02": {"1. open": "187.1500", "5. volume": 82488700, "6. ratio": -0.5},
+    }
+
+    def open(self, chunks):
+        stream = JSONObjectStream(chunks, "Time Series (Daily)")
+        self.assertIsNone(stream.open())
+        return stream
+
+    def test_member_read_from_1_byte_chunks(self):
+        document = {"Meta Data": {"1. Information": "Prix quotidiens – €"}, "Time Series (Daily)": self.series, "Next": 1}
+        closed = []
+        stream = JSONObjectStream(byte_chunks(document), "Time Series (Daily)", on_close=lambda: closed.append(True))
+        self.assertIsNone(stream.open())
+        self.assertEqual(list(stream), list(self.series.items()))
+        self.assertEqual(closed, [True])
+
+    def test_number_at_the_end_of_a_chunk(self):
+        chunks = ['{"Time Series (Daily)": {"a": 12', '34, "b": 5', '6}}']
+        self.assertEqual(list(self.open(chunks)), [("a", 1234), ("b", 56)])
+
+    def test_missing_member_returns_the_document(self):
+        document = {"Error Message": "Invalid API call."}
+        closed = []
+        stream = JSONObjectStream(byte_chunks(document), "Time Series (Daily)", on_close=lambda: closed.append(True))
+        self.assertEqual(stream.open(), document)
+        self.assertEqual(closed, [True])
+
+    def test_truncated_document(self):
+        stream = self.open(byte_chunks({"Time Series (Daily)": self.series})[:60])
+        with self.assertRaises(ValueError):
+            list(stream)
+
+
+class AsOfMatrixTest(SimpleTestCase):
+    def setUp(self):
+        # Thursday 4 and Friday 5 January, BBB has no price before the 5th
+        self.matrix = AsOfMatrix(pd.DataFrame(
+            {"AAA": [10.0, 11.0], "BBB": [np.nan, 20.0]},
+            index=pd.to_datetime(["2024-01-04", "2024-01-05"]),
+        ))
+
+    def test_last_value_on_or_before_each_date(self):
+        values = self.matrix.as_of(["AAA", "BBB"], ["2024-01-04", "2024-01-05", "2024-01-06", "2024-01-08"])
+        np.testing.assert_array_equal(values, [[10.0, np.nan], [11.0, 20.0], [11.0, 20.0], [11.0, 20.0]])
+
+    def test_nan_before_the_first_value_and_for_unknown_keys(self):
+        values = self.matrix.as_of(["AAA", "CCC", "BBB"], ["2024-01-03", "2024-01-04"])
+        np.testing.assert_array_equal(values, [[np.nan, np.nan, np.nan], [10.0, np.nan, np.nan]])
+
+    def test_gap_between_two_values(self):
+        matrix = AsOfMatrix(pd.DataFrame({"AAA": [10.0, np.nan, 12.0]}, index=pd.to_datetime(["2024-01-02", "2024-01-03", "2024-01-05"])))
+        np.testing.assert_array_equal(matrix.as_of(["AAA"], ["2024-01-03", "2024-01-04", "2024-01-05"]), [[10.0], [10.0], [12.0]])
+
+
+class PriceStoreTest(TestCase):
+    def setUp(self):
+        HistoricalPrice.objects.create(ticker="AAA", date=date(2024, 1, 4), close_euro=Decimal("19.99"))
+        HistoricalPrice.objects.create(ticker="AAA", date=date(2024, 1, 5), close_euro=Decimal("20.07"))
+        HistoricalPrice.objects.create(ticker="BBB", date=date(2024, 1, 5), close_euro=Decimal("0.10"))
+        BaseHistoricalExchangeRate.objects.create(from_currency="USD", to_currency="EUR", date=date(2024, 1, 4), close=Decimal("0.91"))
+        self.store = PriceStore(ttl_seconds=3600)
+
+    def test_close_prices_as_of_a_date(self):
+        self.assertEqual(self.store.get_close_prices(["AAA", "BBB", "CCC"], date(2024, 1, 4)), {"AAA": Decimal("19.99")})
+        prices = self.store.get_close_prices(["AAA", "BBB"], date(2024, 1, 7))
+        self.assertEqual(prices, {"AAA": Decimal("20.07"), "BBB": Decimal("0.10")})
+        # The Decimal has the 2 decimal places of the stored price, not the binary expansion of the float
+        self.assertEqual([str(price) for price in prices.values()], ["20.07", "0.10"])
+
+    def test_close_as_of_frame(self):
+        frame = self.store.close_as_of(["BBB", "AAA"], [date(2024, 1, 4), date(2024, 1, 6)])
+        self.assertEqual(list(frame.columns), ["BBB", "AAA"])
+        self.assertTrue(np.isnan(frame.iloc[0, 0]))
+        self.assertEqual(frame.iloc[1].tolist(), [0.1, 20.07])
+
+    def test_rate_as_of(self):
+        self.assertEqual(self.store.rate_as_of("EUR", date(2024, 1, 4)), 1.0)
+        self.assertEqual(self.store.rate_as_of("USD", date(2024, 1, 8)), 0.91)
+        self.assertIsNone(self.store.rate_as_of("USD", date(2024, 1, 3)))
+
+    def test_reloaded_when_prices_are_saved(self):
+        self.assertEqual(self.store.get_close_prices(["AAA"], date(2024, 1, 8)), {"AAA": Decimal("20.07")})
+        HistoricalPrice.objects.create(ticker="AAA", date=date(2024, 1, 8), close_euro=Decimal("21.00"))
+        self.assertEqual(self.store.get_close_prices(["AAA"], date(2024, 1, 8)), {"AAA": Decimal("20.07")})
+        prices_saved.send(sender=None, ticker="AAA", first_date=date(2024, 1, 8), last_date=date(2024, 1, 8))
+        self.assertEqual(self.store.get_close_prices(["AAA"], date(2024, 1, 8)), {"AAA": Decimal("21.00")})
+
+
+class FakeTimeSeriesClient:
+    def __init__(self):
+        self.calls = []
+
+    def get_daily_time_series(self, ticker, start_date=None):
+        self.calls.append(ticker)
+        return {"Time Series (Daily)": {"2024-01-02": {"4. close": "10.5"}}}
+
+    def get_overview(self, ticker):
+        raise AssertionError("The provider must not be called")
+
+
+class ResponseCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def key(self, ticker: str) -> str:
+        return ResponseCache.make_key("av", "get_daily_time_series", {"args": [ticker]}, date(2024, 1, 2))
+
+    def test_gzip_round_trip(self):
+        cache = ResponseCache(self.directory, ttl_seconds=60, max_bytes=10 ** 6)
+        payload = {"Time Series (Daily)": {"2024-01-02": {"4. close": "10.5"}}, "Note": "é"}
+        cache.put(self.key("AAA"), payload)
+        path, = self.directory.glob("*/*.json.gz")
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            self.assertEqual(json.load(f), payload)
+        self.assertEqual(cache.get(self.key("AAA")), payload)
+        self.assertIsNone(cache.get(self.key("BBB")))
+
+    def test_entries_expire(self):
+        cache = ResponseCache(self.directory, ttl_seconds=60, max_bytes=10 ** 6)
+        cache.put(self.key("AAA"), {"close": 1})
+        now = os.path.getmtime(next(self.directory.glob("*/*.json.gz")))
+        with mock.patch("data_ingestion.src.response_cache.time.time", return_value=now + 60):
+            self.assertEqual(cache.get(self.key("AAA")), {"close": 1})
+        with mock.patch("data_ingestion.src.response_cache.time.time", return_value=now + 61):
+            self.assertIsNone(cache.get(self.key("AAA")))
+        self.assertEqual(list(self.directory.glob("*/*.json.gz")), [])
+
+    def test_oldest_entries_evicted_over_max_bytes(self):
+        cache = ResponseCache(self.directory, ttl_seconds=3600, max_bytes=10 ** 6)
+        for i, ticker in enumerate(["AAA", "BBB", "CCC"]):
+            cache.put(self.key(ticker), {"ticker": ticker})
+            path = cache._path(self.key(ticker))
+            os.utime(path, (path.stat().st_mtime + i, path.stat().st_mtime + i))
+        cache.max_bytes = 2 * cache._path(self.key("CCC")).stat().st_size
+        cache.evict()
+        self.assertEqual([cache.get(self.key(ticker)) is not None for ticker in ["AAA", "BBB", "CCC"]], [False, True, True])
+
+    def test_responses_served_from_the_cache(self):
+        client = FakeTimeSeriesClient()
+        cache = ResponseCache(self.directory, ttl_seconds=60, max_bytes=10 ** 6)
+        fetcher = CachedAPIFetcher(client, cache, provider="av", as_of=date(2024, 1, 2))
+        first = fetcher.get_daily_time_series("AAA")
+        self.assertEqual(fetcher.get_daily_time_series("AAA"), first)
+        self.assertEqual(client.calls, ["AAA"])
+        # Another as-of date is another entry
+        CachedAPIFetcher(client, cache, provider="av", as_of=date(2024, 1, 3)).get_daily_time_series("AAA")
+        self.assertEqual(client.calls, ["AAA", "AAA"])
+
+    def test_offline_miss(self):
+        client = FakeTimeSeriesClient()
+        cache = ResponseCache(self.directory, ttl_seconds=60, max_bytes=10 ** 6)
+        CachedAPIFetcher(client, cache, provider="av", as_of=date(2024, 1, 2)).get_daily_time_series("AAA")
+        offline = CachedAPIFetcher(client, cache, provider="av", offline=True, as_of=date(2024, 1, 2))
+        self.assertIn("Time Series (Daily)", offline.get_daily_time_series("AAA"))
+        with self.assertRaises(CacheMiss):
+            offline.get_daily_time_series("BBB")
+        with self.assertRaises(CacheMiss):
+            offline.get_overview("AAA")
+        self.assertEqual(client.calls, ["AAA"])
+
+    @override_settings(PROVIDER_CACHE_ENABLED=False, PROVIDER_CACHE_OFFLINE=False)
+    def test_client_returned_as_is_when_disabled(self):
+        client = FakeTimeSeriesClient()
+        self.assertIs(with_cache(client, "av"), client)
+        with override_settings(PROVIDER_CACHE_ENABLED=True, PROVIDER_CACHE_DIR=self.directory):
+            self.assertIsInstance(with_cache(client, "av"), CachedAPIFetcher)
+
+
+class FakeResponse:
+    def __init__(self, status_code: int = 200, payload=None, headers=None):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = headers or {}
+        self.content = json.dumps(payload).encode() if payload is not None else b"<html>"
+        self.closed = False
+
+    def json(self):
+        if self.payload is None:
+            raise ValueError("Expecting value")
+        return self.payload
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    """
+    Session answering the calls with the given responses, or raising them when they are exceptions.
+    """
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+SERIES = {"Time Series (Daily)": {"2024-01-02": {"4. close": "10.5"}}}
+
+
+@mock.patch("data_ingestion.src.alpha_vantage_client.random.uniform", return_value=1.0)
+@mock.patch("data_ingestion.src.alpha_vantage_client.time.sleep")
+class AlphaVantageRetryTest(SimpleTestCase):
+    def build_client(self, *responses, max_retries: int = 2) -> AlphaVantageClient:
+        return AlphaVantageClient("key", max_retries=max_retries, backoff=2, session=FakeSession(*responses))
+
+    def test_network_errors_retried_with_backoff(self, sleep, uniform):
+        client = self.build_client(requests.exceptions.ConnectionError("reset"), requests.exceptions.Timeout("read"), FakeResponse(payload=SERIES))
+        self.assertEqual(client.get_daily_time_series("AAA"), SERIES)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [2, 4])
+
+    def test_network_errors_exhausted(self, sleep, uniform):
+        client = self.build_client(*[requests.exceptions.ConnectionError("reset")] * 3)
+        with self.assertRaises(ProviderUnavailableError):
+            client.get_daily_time_series("AAA")
+        self.assertEqual(client.session.calls, 3)
+
+    def test_rate_limited_response_honours_retry_after(self, sleep, uniform):
+        client = self.build_client(FakeResponse(429, headers={"Retry-After": "30"}), FakeResponse(payload=SERIES))
+        self.assertEqual(client.get_daily_time_series("AAA"), SERIES)
+        sleep.assert_called_once_with(30)
+
+    def test_status_errors_exhausted(self, sleep, uniform):
+        with self.assertRaises(ProviderRateLimitError):
+            self.build_client(*[FakeResponse(429) for _ in range(3)]).get_daily_time_series("AAA")
+        client = self.build_client(FakeResponse(500), FakeResponse(503), FakeResponse(502))
+        with self.assertRaises(ProviderUnavailableError) as raised:
+            client.get_daily_time_series("AAA")
+        self.assertNotIsInstance(raised.exception, ProviderRateLimitError)
+
+    def test_client_errors_not_retried(self, sleep, uniform):
+        client = self.build_client(FakeResponse(404), FakeResponse(payload=SERIES))
+        with self.assertRaises(ProviderError) as raised:
+            client.get_daily_time_series("AAA")
+        self.assertNotIsInstance(raised.exception, ProviderUnavailableError)
+        self.assertEqual(client.session.calls, 1)
+        sleep.assert_not_called()
+
+    def test_throttling_messages(self, sleep, uniform):
+        client = self.build_client(FakeResponse(payload={"Note": "5 calls per minute"}), FakeResponse(payload=SERIES))
+        self.assertEqual(client.get_daily_time_series("AAA"), SERIES)
+        self.assertEqual(sleep.call_count, 1)
+        # The daily quota is not retried
+        client = self.build_client(FakeResponse(payload={"Information": "25 requests per day"}), FakeResponse(payload=SERIES))
+        with self.assertRaises(ProviderRateLimitError):
+            client.get_daily_time_series("AAA")
+        self.assertEqual(client.session.calls, 1)
+        with self.assertRaises(ProviderRateLimitError):
+            self.build_client(*[FakeResponse(payload={"Note": "5 calls per minute"}) for _ in range(3)]).get_daily_time_series("AAA")
+
+    def test_data_errors(self, sleep, uniform):
+        with self.assertRaises(ProviderDataError):
+            self.build_client(FakeResponse(payload={"Error Message": "Invalid API call."})).get_daily_time_series("AAA")
+        response = FakeResponse()
+        with self.assertRaises(ProviderDataError):
+            self.build_client(response).get_daily_time_series("AAA")
+        self.assertTrue(response.closed)
+        sleep.assert_not_called()
+
+    def test_jittered_backoff_is_capped(self, sleep, uniform):
+        client = AlphaVantageClient("key", max_retries=0, backoff=40, session=FakeSession())
+        uniform.return_value = 0.5
+        client._sleep_before_retry(1)
+        uniform.return_value = 1.5
+        client._sleep_before_retry(1)
+        client._sleep_before_retry(0, retry_after=100)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [30, 90, 100])
+        uniform.assert_called_with(0.5, 1.5)
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+@override_settings(PRICE_CLOSE_DELAY_MINUTES=60, TICKER_INFO_TTL_DAYS=30)
+class UniverseTest(TestCase):
+    # NYSE closes at 21:00 UTC in winter, the prices of a session are due at 22:00 UTC
+    friday_due = utc(2024, 1, 5, 22)
+    monday = utc(2024, 1, 8, 12)
+
+    def setUp(self):
+        Transaction.objects.create(type="buy", date=date(2023, 12, 1), amount=Decimal("100"), ticker="AAA", shares=Decimal("1"))
+        Transaction.objects.create(type="buy", date=date(2023, 12, 1), amount=Decimal("100"), ticker="SOLD", shares=Decimal("1"))
+        Transaction.objects.create(type="sell", date=date(2023, 12, 4), amount=Decimal("100"), ticker="SOLD", shares=Decimal("1"))
+        WatchlistTicker.objects.create(ticker="WATCH")
+
+    def test_price_refresh_waits_for_the_close_delay(self):
+        refreshed_at = utc(2024, 1, 5, 20)
+        self.assertTrue(is_price_refresh_due("AAA", None, self.monday))
+        self.assertFalse(is_price_refresh_due("AAA", refreshed_at, self.friday_due - timedelta(minutes=1)))
+        self.assertTrue(is_price_refresh_due("AAA", refreshed_at, self.friday_due))
+        # No session closes over the weekend
+        self.assertFalse(is_price_refresh_due("AAA", self.friday_due, self.monday))
+        # Milan closes at 16:30 UTC
+        self.assertTrue(is_price_refresh_due("AAA.MI", utc(2024, 1, 5, 17), utc(2024, 1, 8, 17, 30)))
+
+    def test_universe_merges_the_watchlist(self):
+        self.assertEqual(get_universe(), {"AAA": True, "SOLD": False, "WATCH": True})
+        WatchlistTicker.objects.create(ticker="SOLD")
+        WatchlistTicker.objects.create(ticker="AAA")
+        self.assertEqual(get_universe(), {"AAA": True, "SOLD": True, "WATCH": True})
+
+    def test_plan(self):
+        self.assertEqual(plan_ingestion(self.monday), {
+            "AAA": {"info": True, "prices": True},
+            "SOLD": {"info": True, "prices": True},
+            "WATCH": {"info": True, "prices": True},
+        })
+        mark_refreshed("AAA", info=True, prices=True, now=self.monday - timedelta(days=30))
+        mark_refreshed("SOLD", info=True, prices=True, now=utc(2023, 1, 2))
+        mark_refreshed("WATCH", info=True, now=self.monday - timedelta(days=29))
+        mark_refreshed("WATCH", prices=True, now=self.friday_due)
+        # The info of AAA is 30 days old, the tickers no longer held are not refreshed once ingested
+        self.assertEqual(plan_ingestion(self.monday), {"AAA": {"info": True, "prices": True}})
+        self.assertEqual(set(plan_ingestion(self.monday, force=True)), {"AAA", "SOLD", "WATCH"})
+
+    def test_fetch_commands_mark_the_ticker_refreshed(self):
+        prices = pd.DataFrame({"close": [10.0], "close_euro": [9.0]}, index=pd.to_datetime(["2024-01-05"]))
+        with mock.patch("data_ingestion.management.commands.fetch_stock_data.build_provider_chain",
+                        return_value=build_chain(("av", PerTickerClient()))), \
+                mock.patch.object(StockPriceService, "fetch_daily_prices", return_value=("USD", prices, True)):
+            call_command("fetch_stock_data", ticker="WATCH", stdout=mock.Mock())
+        overview = mock.Mock(get_overview=mock.Mock(return_value={"Name": "Watch Inc", "Currency": "USD"}))
+        with mock.patch("data_ingestion.management.commands.fetch_company_info.build_provider_chain",
+                        return_value=build_chain(("av", overview))):
+            call_command("fetch_company_info", ticker="WATCH", stdout=mock.Mock())
+        freshness = TickerFreshness.objects.get(ticker="WATCH")
+        self.assertIsNotNone(freshness.prices_refreshed_at)
+        self.assertIsNotNone(freshness.info_refreshed_at)
+        self.assertNotIn("WATCH", plan_ingestion())
+
+
+class SavePricesTest(TestCase):
+    def setUp(self):
+        self.repo = DatabaseHandler(model=HistoricalPrice)
+        self.saved = []
+        receiver = lambda sender, ticker, first_date=None, last_date=None, **kwargs: self.saved.append((ticker, first_date, last_date))
+        prices_saved.connect(receiver)
+        self.addCleanup(prices_saved.disconnect, receiver)
+
+    def prices(self, closes: dict) -> pd.DataFrame:
+        return pd.DataFrame({"close": list(closes.values())}, index=pd.to_datetime(list(closes)))
+
+    def save(self, closes: dict, replace: bool):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.repo.save_prices("AAA", "USD", self.prices(closes), replace=replace)
+
+    def test_signal_covers_the_changed_dates(self):
+        self.save({"2024-01-02": 10.0, "2024-01-03": 11.0, "2024-01-04": 12.0}, replace=True)
+        self.save({"2024-01-02": 10.0, "2024-01-03": 11.001, "2024-01-04": 12.0}, replace=True)
+        self.save({"2024-01-02": 10.0, "2024-01-03": 11.5, "2024-01-04": 12.0}, replace=True)
+        self.save({"2024-01-02": 10.0, "2024-01-03": 11.5}, replace=True)
+        self.assertEqual(self.saved, [
+            ("AAA", date(2024, 1, 2), date(2024, 1, 4)),
+            ("AAA", date(2024, 1, 3), date(2024, 1, 3)),
+            ("AAA", date(2024, 1, 4), date(2024, 1, 4)),
+        ])
+
+    def test_trim_signal_covers_the_deleted_dates(self):
+        self.save({"2024-01-02": 10.0, "2024-01-03": 11.0, "2024-01-04": 12.0, "2024-01-05": 13.0}, replace=True)
+        self.saved.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.repo.trim_prices("AAA", date(2024, 1, 4), date(2024, 1, 5))
+            self.repo.trim_prices("AAA", date(2024, 1, 4), date(2024, 1, 5))
+        self.assertEqual(self.saved, [("AAA", date(2024, 1, 2), date(2024, 1, 3))])
+
+    def stored(self) -> dict:
+        return {day.isoformat(): float(close) for day, close in HistoricalPrice.objects.filter(ticker="AAA").values_list("date", "close")}
+
+    def test_replace_drops_stale_rows(self):
+        # Saturday 6 January is not a session, 2023-01-03 is out of the new history
+        self.save({"2023-01-03": 5.0, "2024-01-05": 10.0, "2024-01-06": 10.0}, replace=True)
+        self.assertEqual(self.save({"2024-01-05": 10.5, "2024-01-08": 11.0}, replace=True), (1, 1))
+        self.assertEqual(self.stored(), {"2024-01-05": 10.5, "2024-01-08": 11.0})
+
+    def test_incremental_replaces_the_range_only(self):
+        self.save({"2023-01-03": 5.0, "2024-01-05": 10.0, "2024-01-06": 10.0, "2024-01-09": 12.0}, replace=True)
+        self.assertEqual(self.save({"2024-01-05": 10.5, "2024-01-08": 11.0}, replace=False), (1, 1))
+        self.assertEqual(self.stored(), {"2023-01-03": 5.0, "2024-01-05": 10.5, "2024-01-08": 11.0, "2024-01-09": 12.0})
+
+
+
+class StorageBackendTest(TestCase):
+    def prices(self, ticker: str, days, close: str) -> list:
+        return [HistoricalPrice(ticker=ticker, date=date(2024, 1, day), close=Decimal(close)) for day in days]
+
+    def series(self, length: int) -> list:
+        return [HistoricalPrice(ticker="AAA", date=date(2024, 1, 1) + timedelta(days=i), close=Decimal("10.00")) for i in range(length)]
+
+    def test_upsert_counts(self):
+        backend = StorageBackend()
+        self.assertEqual(backend.upsert(HistoricalPrice, self.prices("AAA", [2, 3], "10.00") + self.prices("BBB", [4], "20.00"), ["ticker", "date"]), (3, 0))
+        # BBB has a row within the date range, but not for these keys
+        rows = self.prices("AAA", [3, 4, 5], "11.00") + self.prices("BBB", [2, 4], "21.00")
+        self.assertEqual(backend.count_existing(HistoricalPrice, rows, ["ticker", "date"]), 2)
+        self.assertEqual(backend.upsert(HistoricalPrice, rows, ["ticker", "date"]), (3, 2))
+        self.assertEqual(
+            sorted(HistoricalPrice.objects.values_list("ticker", "date__day", "close")),
+            [("AAA", 2, Decimal("10.00")), ("AAA", 3, Decimal("11.00")), ("AAA", 4, Decimal("11.00")),
+             ("AAA", 5, Decimal("11.00")), ("BBB", 2, Decimal("21.00")), ("BBB", 4, Decimal("21.00"))],
+        )
+        self.assertEqual(backend.upsert(HistoricalPrice, [], ["ticker", "date"]), (0, 0))
+
+    def test_postgres_backend_selected_by_vendor(self):
+        with mock.patch("data_ingestion.src.storage.connections", {"default": mock.Mock(vendor="postgresql")}):
+            self.assertIsInstance(get_storage_backend(), PostgresStorageBackend)
+        self.assertNotIsInstance(get_storage_backend(), PostgresStorageBackend)
+
+    def test_copy_from_the_threshold(self):
+        backend = PostgresStorageBackend()
+        threshold = PostgresStorageBackend.COPY_THRESHOLD
+        below = self.series(threshold - 1)
+        with mock.patch.object(StorageBackend, "upsert", return_value=(len(below), 0)) as orm_upsert:
+            self.assertEqual(backend.upsert(HistoricalPrice, below, ["ticker", "date"]), (threshold - 1, 0))
+        orm_upsert.assert_called_once()
+
+        rows = self.series(threshold)
+        connection = mock.MagicMock()
+        connection.ops.quote_name = lambda name: f'"{name}"'
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (30, 20)
+        with mock.patch("data_ingestion.src.storage.connections", {"default": connection}), \
+                mock.patch.object(StorageBackend, "upsert") as orm_upsert:
+            self.assertEqual(backend.upsert(HistoricalPrice, rows, ["ticker", "date"]), (30, 20))
+        orm_upsert.assert_not_called()
+        copy = cursor.cursor.copy
+        self.assertTrue(copy.call_args.args[0].startswith('COPY "data_ingestion_historicalprice_staging"'))
+        self.assertEqual(copy.return_value.__enter__.return_value.write_row.call_count, threshold)
+
+class SeriesClient(PerTickerClient):
+    """
+    Client returning the given closes from the requested start date, and recording the start dates.
+    """
+    def __init__(self, closes: dict):
+        self.closes = closes
+        self.start_dates = []
+
+    def get_daily_time_series(self, ticker, start_date=None):
+        self.start_dates.append(start_date)
+        return {"Time Series (Daily)": {
+            day.strftime("%Y-%m-%d"): {"1. open": close, "2. high": close, "3. low": close, "4. close": close, "5. volume": 100}
+            for day, close in self.closes.items()
+            if start_date is None or day.date() >= start_date
+        }}
+
+
+class IncrementalFetchTest(TestCase):
+    def setUp(self):
+        TickerInfo.objects.create(ticker="AAA", currency="EUR")
+        self.repo = DatabaseHandler(model=HistoricalPrice)
+        today = pd.Timestamp.now().normalize()
+        self.sessions = list(get_sessions("AAA", today - pd.Timedelta(days=40), today))
+        self.client = SeriesClient({day: 11.0 for day in self.sessions})
+
+    def test_full_refresh_without_stored_prices(self):
+        currency, prices, replace = StockPriceService(self.client, self.repo).fetch_daily_prices("AAA", incremental=True)
+        self.assertEqual(self.client.start_dates, [None])
+        self.assertTrue(replace)
+        self.assertEqual(currency, "EUR")
+        self.assertEqual(list(prices.index), self.sessions)
+
+    def test_incremental_refetches_the_overlap(self):
+        for day in self.sessions[:-5]:
+            HistoricalPrice.objects.create(ticker="AAA", currency="EUR", date=day.date(), close=Decimal("10.00"))
+        watermark = self.sessions[-6].date()
+
+        currency, prices, replace = StockPriceService(self.client, self.repo).fetch_daily_prices("AAA", incremental=True)
+        fetch_from = watermark - timedelta(days=INCREMENTAL_OVERLAP_DAYS)
+        self.assertEqual(self.client.start_dates, [fetch_from])
+        self.assertFalse(replace)
+        self.assertEqual(list(prices.index), [day for day in self.sessions if day.date() >= fetch_from])
+
+        self.repo.save_prices("AAA", currency, prices, replace=replace)
+        stored = dict(HistoricalPrice.objects.filter(ticker="AAA").values_list("date", "close"))
+        self.assertEqual(sorted(stored), [day.date() for day in self.sessions])
+        self.assertEqual(
+            {day: close for day, close in stored.items() if close == Decimal("10.00")},
+            {day.date(): Decimal("10.00") for day in self.sessions if day.date() < fetch_from},
+        )
+
+
+class FakeClock:
+    """
+    Clock whose sleeps advance the time at once, to patch time.monotonic and time.sleep.
+    """
+    def __init__(self, now: float = 1000):
+        self.now = now
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTest(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        for name in ("monotonic", "sleep"):
+            patcher = mock.patch(f"data_ingestion.src.rate_limiter.time.{name}", getattr(self.clock, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_burst_then_paced_calls(self):
+        bucket = TokenBucket.per_minute(6)
+        for _ in range(6):
+            bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [10, 10])
+
+    def test_tokens_refilled_up_to_capacity(self):
+        bucket = TokenBucket(rate=1, capacity=2)
+        bucket.acquire()
+        bucket.acquire()
+        self.clock.now += 60
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [1])
+
+
+class OverviewClient(PerTickerClient):
+    def get_overview(self, ticker):
+        return {"Name": ticker, "Currency": "USD"}
+
+
+class IngestionRunnerTest(TestCase):
+    """
+    The tickers are fetched by the worker threads, written by the calling thread only, and a failing ticker
+    does not stop the others.
+    """
+    def setUp(self):
+        self.runner = IngestionRunner(workers=3, providers=build_chain(("av", OverviewClient())))
+        self.writer_threads = set()
+        for repo, method in ((self.runner.price_repo, "save_prices"), (self.runner.info_repo, "save_company_information")):
+            patcher = mock.patch.object(repo, method, side_effect=self.recording(getattr(repo, method)))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def recording(self, write):
+        def recorded(ticker, *args, **kwargs):
+            self.writer_threads.add(threading.get_ident())
+            if ticker == "WRITE_FAILS":
+                raise RuntimeError("database is locked")
+            return write(ticker, *args, **kwargs)
+        return recorded
+
+    @staticmethod
+    def fetch_daily_prices(service, ticker, incremental=False, currency=None):
+        if ticker == "FETCH_FAILS":
+            raise ValueError(f"No time series found for ticker: {ticker}")
+        prices = pd.DataFrame({"close": [10.0], "close_euro": [9.0]}, index=pd.to_datetime(["2024-01-05"]))
+        return currency, prices, False
+
+    def test_failures_do_not_stop_the_run(self):
+        tickers = ["AAA", "FETCH_FAILS", "BBB", "WRITE_FAILS", "CCC"]
+        with mock.patch.object(StockPriceService, "fetch_daily_prices", autospec=True, side_effect=self.fetch_daily_prices):
+            results = {result["ticker"]: result for result in self.runner.run(tickers)}
+        self.assertEqual(set(results), set(tickers))
+        self.assertEqual({ticker for ticker, result in results.items() if not result["errors"]}, {"AAA", "BBB", "CCC"})
+        self.assertIn("prices", results["FETCH_FAILS"]["errors"][0])
+        self.assertEqual(len(results["WRITE_FAILS"]["errors"]), 2)
+        self.assertEqual(
+            sorted(HistoricalPrice.objects.values_list("ticker", "currency")),
+            [("AAA", "USD"), ("BBB", "USD"), ("CCC", "USD")],
+        )
+        self.assertEqual(TickerFreshness.objects.exclude(prices_refreshed_at=None).count(), 3)
+        self.assertEqual(self.writer_threads, {threading.get_ident()})
+
+    def test_plan_limits_the_refreshed_parts(self):
+        with mock.patch.object(StockPriceService, "fetch_daily_prices", autospec=True, side_effect=self.fetch_daily_prices) as fetch:
+            self.runner.run(["AAA", "BBB"], plan={"AAA": {"info": False, "prices": True}, "BBB": {"info": True, "prices": False}})
+        self.assertEqual([call.args[1] for call in fetch.call_args_list], ["AAA"])
+        self.assertEqual(list(TickerInfo.objects.values_list("ticker", flat=True)), ["BBB"])
+
+    def test_rates_of_a_new_currency_are_fetched_before_its_prices(self):
+        class SwissClient(PerTickerClient):
+            def get_overview(self, ticker):
+                return {"Name": ticker, "Currency": "CHF"}
+
+            def get_exchange_rates(self, from_currency, to_currency):
+                return {"Time Series FX (Daily)": {
+                    "2024-01-05": {"1. open": "1.05", "2. high": "1.07", "3. low": "1.04", "4. close": "1.06"}
+                }}
+
+        def fetch_daily_prices(service, ticker, incremental=False, currency=None):
+            # The real service converts the prices to EUR, which needs the stored rates
+            service.exchange_rates.get_rates(currency)
+            return self.fetch_daily_prices(service, ticker, incremental, currency)
+
+        runner = IngestionRunner(workers=3, providers=build_chain(("av", SwissClient())))
+        on_rates = mock.Mock()
+        with mock.patch.object(StockPriceService, "fetch_daily_prices", autospec=True, side_effect=fetch_daily_prices) as fetch:
+            results = runner.run(["NESN.SW"], on_rates=on_rates)
+        self.assertEqual(results[0]["errors"], [])
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual([call.args[0]["currency"] for call in on_rates.call_args_list], ["CHF"])
+        self.assertTrue(BaseHistoricalExchangeRate.objects.filter(from_currency="CHF", to_currency="EUR").exists())
+        self.assertEqual(list(HistoricalPrice.objects.values_list("ticker", "currency")), [("NESN.SW", "CHF")])
+
+
+class EnrichTest(SimpleTestCase):
+    """
+    The EUR prices use the rate of the price date, or the last rate before it.
+    """
+    prices = pd.DataFrame(
+        {"open": [10.0, 11.0, 12.0], "high": [10.0, 11.0, 12.0], "low": [10.0, 11.0, 12.0], "close": [10.0, 11.0, 12.0]},
+        index=pd.to_datetime(["2024-01-03", "2024-01-04", "2024-01-08"]),
+    )
+
+    def test_rates_are_forward_filled_onto_the_price_dates(self):
+        # No rate on 2024-01-04 and 2024-01-08, the rate of 2024-01-05 is for a date without prices
+        rates = pd.Series([0.5, 0.75], index=pd.to_datetime(["2024-01-03", "2024-01-05"]))
+        enriched = StockPriceService._enrich(self.prices, rates)
+        self.assertEqual(enriched["close_euro"].tolist(), [5.0, 5.5, 9.0])
+        self.assertEqual(enriched["open_euro"].tolist(), enriched["close_euro"].tolist())
+        self.assertNotIn("close_euro", self.prices)
+
+    def test_prices_before_the_first_rate_have_no_euro_price(self):
+        rates = pd.Series([0.5], index=pd.to_datetime(["2024-01-04"]))
+        enriched = StockPriceService._enrich(self.prices, rates)
+        self.assertTrue(np.isnan(enriched["close_euro"].iloc[0]))
+        self.assertEqual(enriched["close_euro"].iloc[1:].tolist(), [5.5, 6.0])
+
+    def test_euro_prices_are_unchanged(self):
+        enriched = StockPriceService._enrich(self.prices, None)
+        for column in ("open", "high", "low", "close"):
+            self.assertEqual(enriched[f"{column}_euro"].tolist(), self.prices[column].tolist())
+
+
+class YahooBatchTest(TestCase):
+    """
+    The multi-symbol download is returned with (ticker, field) columns, and a ticker without prices is a failure.
+    """
+    dates = pd.bdate_range(end=pd.Timestamp.now().normalize() - pd.Timedelta(days=7), periods=3)
+
+    def download(self, tickers, **kwargs):
+        # yfinance returns (Ticker, Price) columns, capitalized, indexed by exchange local dates, and NaN for unknown tickers
+        frames = {
+            ticker: pd.DataFrame(
+                {field: [np.nan] * 3 if ticker == "UNKNOWN" else [10.0, 11.0, 12.0]
+                 for field in ("Open", "High", "Low", "Close", "Volume")},
+                index=self.dates.tz_localize("America/New_York") + pd.Timedelta(hours=9),
+            )
+            for ticker in tickers
+        }
+        return pd.concat(frames, axis=1)
+
+    def test_columns_are_ticker_and_field(self):
+        with mock.patch("data_ingestion.src.yahoo_finance_client.yf.download", side_effect=self.download):
+            batch = YahooFinanceClient().get_daily_time_series_batch(["AAA", "BBB"])
+        self.assertEqual(batch.columns.names, ["ticker", "field"])
+        self.assertEqual(
+            batch.columns.tolist(),
+            [(ticker, field) for ticker in ("AAA", "BBB") for field in ("open", "high", "low", "close", "volume")],
+        )
+        self.assertEqual(batch.index.tolist(), self.dates.tolist())
+        self.assertEqual(batch["BBB"]["close"].tolist(), [10.0, 11.0, 12.0])
+
+    def test_ticker_without_prices_is_a_failure(self):
+        with mock.patch("data_ingestion.src.yahoo_finance_client.yf.download", side_effect=self.download):
+            service = StockPriceService(YahooFinanceClient(), DatabaseHandler(model=HistoricalPrice))
+            results = service.fetch_daily_prices_batch(["AAA", "UNKNOWN"], currencies={"AAA": "EUR", "UNKNOWN": "EUR"})
+        currency, prices, replace = results["AAA"]
+        self.assertEqual((currency, replace), ("EUR", True))
+        self.assertEqual(prices["close"].iloc[-1], 12.0)
+        self.assertIsInstance(results["UNKNOWN"], ValueError)
+
+
+class CurrencyTest(TestCase):
+    """
+    The currency of a ticker is read from its stored company information before asking the API.
+    """
+    def setUp(self):
+        self.api = mock.Mock()
+        self.api.get_overview.return_value = {"Currency": "USD"}
+        self.exchange_rates = mock.Mock()
+        self.service = StockPriceService(self.api, DatabaseHandler(model=HistoricalPrice), self.exchange_rates)
+
+    def test_stored_currency_saves_the_overview_call(self):
+        TickerInfo.objects.create(ticker="NESN.SW", currency="CHF")
+        currency, rates = self.service._get_currency("NESN.SW")
+        self.assertEqual(currency, "CHF")
+        self.assertIs(rates, self.exchange_rates.get_rates.return_value)
+        self.exchange_rates.get_rates.assert_called_once_with("CHF")
+        self.api.get_overview.assert_not_called()
+
+    def test_overview_gives_the_currency_of_a_new_ticker(self):
+        self.assertEqual(self.service._get_currency("AAPL")[0], "USD")
+        self.api.get_overview.assert_called_once_with("AAPL")
+
+    def test_euro_tickers_have_no_rates(self):
+        TickerInfo.objects.create(ticker="AIR.PA", currency="EUR")
+        self.assertEqual(self.service._get_currency("AIR.PA"), ("EUR", None))
+        self.exchange_rates.get_rates.assert_not_called()
+
+
+class FundCalendarTest(TestCase):
+    """
+    The fund trades on the days on which at least one of its exchanges is open.
+    """
+    def test_sessions_are_the_union_of_the_exchanges(self):
+        # Independence Day closes the NYSE, not Euronext Paris, and both are closed on Christmas
+        self.assertEqual(
+            get_fund_sessions("2024-07-03", "2024-07-05", ["AAPL"]).tolist(),
+            pd.to_datetime(["2024-07-03", "2024-07-05"]).tolist(),
+        )
+        self.assertEqual(
+            get_fund_sessions("2024-07-03", "2024-07-05", ["AAPL", "AIR.PA"]).tolist(),
+            pd.to_datetime(["2024-07-03", "2024-07-04", "2024-07-05"]).tolist(),
+        )
+        self.assertFalse(is_fund_session(date(2024, 12, 25), ["AAPL", "AIR.PA"]))
+
+    def test_exchanges_of_the_traded_tickers(self):
+        # Without any trade the NYSE calendar is used, then the calendar of Euronext Paris, closed on Labour Day
+        self.assertFalse(is_fund_session(date(2024, 7, 4)))
+        Transaction.objects.create(type="buy", date=date(2024, 1, 2), amount=Decimal("100"), ticker="AIR.PA", shares=Decimal("1"))
+        self.assertTrue(is_fund_session(date(2024, 7, 4)))
+        self.assertFalse(is_fund_session(date(2024, 5, 1)))
+        self.assertFalse(is_fund_session(date(2024, 7, 6)))
+
+    def test_last_close(self):
+        # Early close of the NYSE on the eve of Independence Day, and last close of the previous year in January
+        self.assertEqual(get_last_close("AAPL", "2024-07-05 15:00"), pd.Timestamp("2024-07-03 17:00", tz="UTC"))
+        self.assertEqual(get_last_close("AIR.PA", "2024-07-05 15:00"), pd.Timestamp("2024-07-04 15:30", tz="UTC"))
+        self.assertEqual(get_last_close("AAPL", "2024-01-02 10:00"), pd.Timestamp("2023-12-29 21:00", tz="UTC"))
+        self.assertEqual(
+            get_last_close("AAPL", pd.Timestamp("2024-07-03 13:00", tz="America/New_York")),
+            pd.Timestamp("2024-07-03 17:00", tz="UTC"),
+        )
+
+
+class ParquetPriceStoreTest(TestCase):
+    """
+    The Parquet store returns the prices of the database, which are read directly when the store is disabled.
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        for ticker, day, close in (("AAA", date(2023, 12, 29), "9.50"), ("AAA", date(2024, 1, 2), "10.00"),
+                                   ("AAA", date(2024, 1, 3), "10.50"), ("B.MI", date(2024, 1, 3), "1.25")):
+            HistoricalPrice.objects.create(ticker=ticker, date=day, currency="EUR", close=Decimal(close), close_euro=Decimal(close))
+
+    def test_sync_and_read(self):
+        store = ParquetPriceStore(self.directory)
+        self.assertEqual(store.sync_all(), 4)
+        self.assertEqual(store.tickers(), ["AAA", "B.MI"])
+        prices = store.read(["AAA"], start_date=date(2024, 1, 1), columns=["close", "close_euro"])
+        self.assertEqual(prices["date"].tolist(), pd.to_datetime(["2024-01-02", "2024-01-03"]).tolist())
+        self.assertEqual(prices["close"].tolist(), [10.0, 10.5])
+
+        # A full sync removes the partitions of the years without prices anymore
+        HistoricalPrice.objects.filter(date__year=2023).delete()
+        store.sync_ticker("AAA")
+        self.assertEqual(store.read(["AAA"])["close_euro"].tolist(), [10.0, 10.5])
+
+    def test_matrix_from_the_store_or_the_database(self):
+        with override_settings(PRICE_PARQUET_STORE_DIR=""):
+            from_database = load_price_matrix(["B.MI", "AAA"], start_date=date(2024, 1, 1))
+        ParquetPriceStore(self.directory).sync_all()
+        with override_settings(PRICE_PARQUET_STORE_DIR=self.directory):
+            from_store = load_price_matrix(["B.MI", "AAA"], start_date=date(2024, 1, 1))
+        pd.testing.assert_frame_equal(from_store, from_database, check_names=False)
+        self.assertEqual(from_database.columns.tolist(), ["B.MI", "AAA"])
+        self.assertEqual(from_database["AAA"].tolist(), [10.0, 10.5])
+        self.assertTrue(np.isnan(from_database["B.MI"].iloc[0]))
+
+
+class MetricsRegistryTest(SimpleTestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.rows = self.registry.counter("rows_total", "Rows written.", ["table"])
+        self.durations = self.registry.histogram("request_seconds", "Request durations.", ["provider"], buckets=(0.1, 1))
+
+    def test_render(self):
+        self.rows.inc(3, table="prices")
+        self.rows.inc(table='say "prices"')
+        for seconds in (0.05, 0.5, 4):
+            self.durations.observe(seconds, provider="av")
+        self.assertEqual(self.registry.render(), "\n".join([
+            "# HELP request_seconds Request durations.",
+            "# TYPE request_seconds histogram",
+            'request_seconds_bucket{provider="av",le="0.1"} 1',
+            'request_seconds_bucket{provider="av",le="1"} 2',
+            'request_seconds_bucket{provider="av",le="+Inf"} 3',
+            'request_seconds_sum{provider="av"} 4.55',
+            'request_seconds_count{provider="av"} 3',
+            "# HELP rows_total Rows written.",
+            "# TYPE rows_total counter",
+            'rows_total{table="prices"} 3',
+            'rows_total{table="say \\"prices\\""} 1',
+        ]) + "\n")
+
+    def test_increase_since_a_snapshot(self):
+        self.rows.inc(3, table="prices")
+        before = self.registry.snapshot()
+        self.rows.inc(2, table="prices")
+        self.rows.inc(table="rates")
+        self.assertEqual(self.registry.since(before), [
+            {"name": "rows_total", "labels": {"table": "prices"}, "value": 2},
+            {"name": "rows_total", "labels": {"table": "rates"}, "value": 1},
+        ])
+
+    def test_labels_are_checked(self):
+        with self.assertRaises(ValueError):
+            self.rows.inc(provider="av")
+        with self.assertRaises(ValueError):
+            self.registry.histogram("rows_total", "Rows written.", ["table"])
+        self.assertIs(self.registry.counter("rows_total", "Rows written.", ["table"]), self.rows)
+
+
+class IngestionRunTest(TestCase):
+    """
+    A run records its outcome and the metrics recorded while it ran, exposed by the metrics endpoint.
+    """
+    def test_partial_run(self):
+        FAILURES.inc(ticker="BEFORE", provider="av", stage="prices")
+        with record_ingestion_run("run_daily_tasks") as run:
+            run.succeeded.append("AAA")
+            run.failed.append("BBB")
+            FAILURES.inc(ticker="BBB", provider="av", stage="prices")
+        run.refresh_from_db()
+        self.assertEqual(run.status, IngestionRun.Status.PARTIAL)
+        self.assertEqual(run.metrics, [
+            {"name": "ingestion_failures_total", "labels": {"ticker": "BBB", "provider": "av", "stage": "prices"}, "value": 1},
+        ])
+        lines = render_last_runs().splitlines()
+        self.assertIn('ingestion_last_run_succeeded{command="run_daily_tasks",status="partial"} 1', lines)
+        self.assertIn(
+            'ingestion_last_run_failures_total{command="run_daily_tasks",ticker="BBB",provider="av",stage="prices"} 1', lines
+        )
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ingestion_last_run_failed{command="run_daily_tasks",status="partial"} 1', response.content.decode())
+
+    def test_run_failing_before_any_success(self):
+        with self.assertRaises(RuntimeError):
+            with record_ingestion_run("fetch_exchange_rates"):
+                raise RuntimeError("provider down")
+        run = IngestionRun.objects.get(command="fetch_exchange_rates")
+        self.assertEqual(run.status, IngestionRun.Status.FAILED)
+        self.assertIsNotNone(run.finished_at)
@@ -1,9 +1,12 @@
 import logging
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.forms.models import model_to_dict
 from django.views.decorators.http import require_GET
 from django.views.decorators.cache import cache_page
 from data_ingestion.src.readers import PriceReader, CompanyInfoReader, ExchangeRateReader
+from data_ingestion.src.base_prices import rebase
+from data_ingestion.src.ingestion_runs import render_last_runs
+from data_ingestion.src.metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
@@ -43,20 +46,28 @@ def get_prices(request, ticker):
         request (HttpRequest): The HTTP request object containing query parameters.
             - start_date (str): The start date for the price data in "YYYY-MM-DD" format (optional).
             - end_date (str): The end date for the price data in "YYYY-MM-DD" format (optional).
+            - rebase_to (str): The date on which the "nav" of each row is rebased to 1.0, in "YYYY-MM-DD" format
+              (optional, the date of the first transaction by default).
         ticker (str): The stock ticker symbol for which to retrieve price data.
     Returns:
         JsonResponse: A JSON response containing:
             - status (str): The status of the request ("success").
             - ticker (str): The stock ticker symbol.
-            - data (list): A list of dictionaries representing the price data.
+            - data (list): A list of dictionaries representing the price data, with the close rebased as "nav".
+            - HTTP status code 400 when rebase_to is not a valid date.
     """
     start_date = request.GET.get("start_date")
     end_date = request.GET.get("end_date")
+    rebase_to = request.GET.get("rebase_to")
 
     reader = PriceReader()
+    try:
+        base_price = reader.get_base_price(ticker, rebase_to)
+    except ValueError as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
     prices = reader.get_prices(ticker, start_date, end_date)
 
-    data = [model_to_dict(price) for price in prices]
+    data = [{**model_to_dict(price), "nav": rebase(price.close, base_price)} for price in prices]
     
     return JsonResponse({
         "status": "success",
@@ -68,7 +79,7 @@ def get_prices(request, ticker):
 def get_exchange_rates(request, from_currency):
     """
     Handles a request to retrieve exchange rates for a given currency pair 
-    and date range.
+    and date range. Pairs not ingested as is are derived from the rates of both currencies to EUR.
     Args:
         request (HttpRequest): The HTTP request object containing query parameters.
             - to_currency (str, optional): The target currency code. Defaults to 'EUR' if not provided.
@@ -81,6 +92,7 @@ def get_exchange_rates(request, from_currency):
             - from_currency (str): The source currency code.
             - to_currency (str): The target currency code.
             - data (list): A list of dictionaries representing the exchange rate data.
+            - HTTP status code 404 when the rates of one of the currencies are not stored.
     """
     to_currency = request.GET.get("to_currency")
     start_date = request.GET.get("start_date")
@@ -90,7 +102,10 @@ def get_exchange_rates(request, from_currency):
         to_currency = 'EUR'
 
     reader = ExchangeRateReader()
-    exchange_rates = reader.get_exchange_rates(from_currency, to_currency, start_date, end_date)
+    try:
+        exchange_rates = reader.get_exchange_rates(from_currency, to_currency, start_date, end_date)
+    except ValueError as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=404)
 
     data = [model_to_dict(rate) for rate in exchange_rates]
 
@@ -99,4 +114,17 @@ def get_exchange_rates(request, from_currency):
         "from_currency": from_currency,
         "to_currency": to_currency,
         "data": data
-    })
\ No newline at end of file
+    })
+
+@require_GET
+def metrics(request):
+    """
+    Expose the ingestion metrics in the Prometheus text format.
+    Returns:
+        HttpResponse: The metrics recorded by this process, followed by the last run of each ingestion command
+        (the commands run in their own processes, their metrics are read back from the IngestionRun table).
+    """
+    return HttpResponse(
+        REGISTRY.render() + render_last_runs(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from portfolio_valuation.models import DailyPortfolioSnapshot, UserShareSnapshot, PortfolioCompositionSnapshot
+from portfolio_valuation.models import DailyPortfolioSnapshot, DirtyRange, UserShareSnapshot, PortfolioCompositionSnapshot
 
 @admin.register(DailyPortfolioSnapshot)
 class DailyPortfolioSnapshotAdmin(admin.ModelAdmin):
@@ -21,3 +21,7 @@ class PortfolioCompositionSnapshotAdmin(admin.ModelAdmin):
     ordering = ("-date",)
     search_fields = ("date", "ticker")
     list_filter = ("date", "ticker")
+
+@admin.register(DirtyRange)
+class DirtyRangeAdmin(admin.ModelAdmin):
+    list_display = ("start_date", "invalidations", "reason", "updated_at")
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PortfolioValuationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'portfolio_valuation'
+
+    def ready(self):
+        # Connect the signal receivers
+        from portfolio_valuation import signals  # noqa: F401
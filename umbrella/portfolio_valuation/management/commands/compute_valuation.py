@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.utils.dateparse import parse_date
 from portfolio_valuation.src.valuation import ValuationService
+from data_ingestion.src.calendars import is_fund_session
 import sys
 
 
@@ -18,8 +19,8 @@ class Command(BaseCommand):
             self.stderr.write(self.style.ERROR("Invalid date format. Use YYYY-MM-DD."))
             sys.exit(1)
 
-        if valuation_date.weekday() >= 5:
-            self.stderr.write(self.style.WARNING("Market is closed on weekends. Skipping valuation."))
+        if not is_fund_session(valuation_date):
+            self.stderr.write(self.style.WARNING("Markets are closed on this date. Skipping valuation."))
             return
 
         try:
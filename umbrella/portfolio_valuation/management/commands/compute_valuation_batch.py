@@ -1,7 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.utils.dateparse import parse_date
-from portfolio_valuation.src.valuation import ValuationService
-from datetime import timedelta
+from portfolio_valuation.src.range_valuation import RangeValuationEngine
+from data_ingestion.src.calendars import get_fund_sessions
 import sys
 
 
@@ -20,21 +20,13 @@ class Command(BaseCommand):
             self.stderr.write(self.style.ERROR("Invalid date range."))
             sys.exit(1)
 
-        current = start_date
-        successes = []
-        failures = []
-
-        while current <= end_date:
-            if current.weekday() < 5:
-                try:
-                    ValuationService(current).compute()
-                    successes.append(str(current))
-                except Exception as e:
-                    failures.append((str(current), str(e)))
-            current += timedelta(days=1)
+        # Only the days on which at least one of the fund's exchanges is open are valued,
+        # all at once: the whole range is saved, or nothing when it fails
+        sessions = [session.date() for session in get_fund_sessions(start_date, end_date)]
+        try:
+            dates = RangeValuationEngine(sessions).compute()
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f"Error during valuation from {start_date} to {end_date}: {str(e)}"))
+            sys.exit(1)
 
-        self.stdout.write(self.style.SUCCESS(f"Completed valuations for: {successes}"))
-        if failures:
-            self.stderr.write(self.style.WARNING("Failures:"))
-            for date, err in failures:
-                self.stderr.write(f"  {date}: {err}")
+        self.stdout.write(self.style.SUCCESS(f"Completed valuations for: {[str(date) for date in dates]}"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from portfolio_valuation.src.dirty_ranges import get_dirty_start_date, recompute_dirty_ranges
+import sys
+
+
+class Command(BaseCommand):
+    help = "Recompute the snapshots made stale by back-dated transactions or re-ingested prices"
+
+    def handle(self, *args, **options):
+        start_date = get_dirty_start_date()
+        if start_date is None:
+            self.stdout.write("The snapshots are up to date.")
+            return
+
+        try:
+            dates = recompute_dirty_ranges()
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f"Error during the recomputation from {start_date}: {str(e)}"))
+            sys.exit(1)
+
+        self.stdout.write(self.style.SUCCESS(f"Recomputed {len(dates)} valuations from {start_date}"))
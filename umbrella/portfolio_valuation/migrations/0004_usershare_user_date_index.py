@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_valuation', '0003_portfoliocompositionsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usersharesnapshot',
+            index=models.Index(fields=['user_id', 'date'], name='usershare_user_date_idx'),
+        ),
+    ]
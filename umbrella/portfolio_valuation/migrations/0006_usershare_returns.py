@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:23
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def mark_snapshots_dirty(apps, schema_editor):
+    """
+    The returns of the existing user snapshots are computed by the next run of recompute_dirty_ranges.
+    """
+    DailyPortfolioSnapshot = apps.get_model("portfolio_valuation", "DailyPortfolioSnapshot")
+    DirtyRange = apps.get_model("portfolio_valuation", "DirtyRange")
+    first = DailyPortfolioSnapshot.objects.order_by("date").values_list("date", flat=True).first()
+    if first is not None:
+        DirtyRange.objects.create(start_date=first, reason="user returns added")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_valuation', '0005_dirtyrange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersharesnapshot',
+            name='twr',
+            field=models.DecimalField(decimal_places=8, default=Decimal('0.0'), max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='usersharesnapshot',
+            name='xirr',
+            field=models.DecimalField(blank=True, decimal_places=8, max_digits=20, null=True),
+        ),
+        migrations.RunPython(mark_snapshots_dirty, migrations.RunPython.noop),
+    ]
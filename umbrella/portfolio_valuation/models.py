@@ -31,9 +31,16 @@ class UserShareSnapshot(models.Model):
     user_id = models.IntegerField()
     units_held = models.DecimalField(max_digits=20, decimal_places=8)
     value_held = models.DecimalField(max_digits=20, decimal_places=2, default=Decimal("0.0"))
+    # Cumulative time-weighted return since the first deposit, chained from the previous snapshot
+    twr = models.DecimalField(max_digits=20, decimal_places=8, default=Decimal("0.0"))
+    # Annualized money-weighted return (XIRR) of the deposits, the withdrawals and value_held, None when undefined
+    xirr = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True)
 
     class Meta:
         unique_together = ("date", "user_id")
+        indexes = [
+            models.Index(fields=["user_id", "date"], name="usershare_user_date_idx"),
+        ]
 
 class PortfolioCompositionSnapshot(models.Model):
     date = models.DateField()
@@ -42,4 +49,19 @@ class PortfolioCompositionSnapshot(models.Model):
     value_eur = models.DecimalField(max_digits=20, decimal_places=2)
 
     class Meta:
-        unique_together = ("date", "ticker")
\ No newline at end of file
+        unique_together = ("date", "ticker")
+
+class DirtyRange(models.Model):
+    """
+    Model for storing the earliest date from which the stored snapshots are stale, e.g. after a back-dated
+    transaction or a price correction. A recomputation always runs up to the last snapshot, so all the pending
+    invalidations overlap and are coalesced into a single row moved back to the earliest affected date.
+    """
+    start_date = models.DateField()
+    reason = models.CharField(max_length=255, blank=True, default="")  # the last one
+    invalidations = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"From {self.start_date} ({self.invalidations} invalidations)"
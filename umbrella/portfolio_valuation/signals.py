@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from data_ingestion.signals import prices_saved
+from portfolio_valuation.src.dirty_ranges import mark_dirty
+from transactions.models import PositionLedger, Transaction
+
+
+@receiver(post_save, sender=Transaction)
+def invalidate_on_transaction_save(sender, instance, raw=False, **kwargs):
+    """
+    Mark the snapshots stale from the date of an added or edited transaction, or from its former date if earlier.
+    """
+    if raw:
+        return
+    # The stored version of an edited transaction is kept by the receivers of the transactions app
+    stored = getattr(instance, "_stored", None)
+    date = min(instance.date, stored.date) if stored is not None else instance.date
+    mark_dirty(date, f"transaction {instance.pk} saved")
+
+
+@receiver(post_delete, sender=Transaction)
+def invalidate_on_transaction_delete(sender, instance, **kwargs):
+    mark_dirty(instance.date, f"transaction {instance.pk} deleted")
+
+
+@receiver(prices_saved)
+def invalidate_on_prices_saved(sender, ticker, first_date=None, last_date=None, **kwargs):
+    """
+    Mark the snapshots stale from the first date whose prices changed, when the fund traded the ticker by then.
+    """
+    first_traded = PositionLedger.objects.filter(ticker=ticker).order_by("date").values_list("date", flat=True).first()
+    if first_traded is None:
+        return
+    mark_dirty(max(first_date, first_traded) if first_date else first_traded, f"prices of {ticker} saved")
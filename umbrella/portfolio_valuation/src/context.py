@@ -0,0 +1,113 @@
+import datetime
+from decimal import Decimal
+from functools import cached_property
+from data_ingestion.src.price_store import get_price_store
+from portfolio_valuation.models import DailyPortfolioSnapshot, UserShareSnapshot
+from transactions.models import Transaction
+from transactions.src.ledger import get_cash, get_positions
+from .returns import get_cash_flow
+
+
+class ValuationContext:
+    """
+    Everything the valuation of a date reads, each loaded once and shared by pricing, nav, metrics and the
+    database handler: the cash and the positions (one lookup in each ledger),
+    the prices of the held tickers (one read from the PriceStore), the previous snapshot, the user shares of that
+    snapshot and the deposits and withdrawals up to the date, from which the cash flows of the users are taken.
+    The number of queries does not depend on the number of holdings.
+    """
+    def __init__(self, date: datetime.date):
+        self.date = date
+
+    @cached_property
+    def ledger_cash(self) -> dict:
+        """
+        Cash balance and total deposits and withdrawals as of the date, from the cash ledger.
+        """
+        return get_cash(self.date)
+
+    @cached_property
+    def cash(self) -> Decimal:
+        return self.ledger_cash["balance"]
+
+    @cached_property
+    def positions(self) -> list:
+        """
+        Net quantity of each traded ticker as of the date, from the position ledger, as {"ticker", "total_qty"} dicts.
+        """
+        return [{"ticker": ticker, "total_qty": quantity} for ticker, quantity in get_positions(self.date).items()]
+
+    @cached_property
+    def held(self) -> dict:
+        """
+        Quantity of each ticker held on the date.
+        """
+        return {item["ticker"]: Decimal(item["total_qty"]) for item in self.positions if item["total_qty"]}
+
+    @cached_property
+    def prices(self) -> dict:
+        """
+        Latest price on or before the date of every held ticker, as the exchange of a ticker may be closed on that day.
+        """
+        return get_price_store().get_close_prices(self.held.keys(), self.date)
+
+    @cached_property
+    def previous_snapshot(self):
+        """
+        The most recent DailyPortfolioSnapshot before the date, or None.
+        Note that there is no data for weekends days.
+        """
+        return DailyPortfolioSnapshot.objects.filter(date__lt=self.date).order_by("-date").first()
+
+    @cached_property
+    def previous_user_shares(self) -> dict:
+        """
+        UserShareSnapshot of each user on the previous snapshot.
+        """
+        if self.previous_snapshot is None:
+            return {}
+        return {snap.user_id: snap for snap in UserShareSnapshot.objects.filter(date=self.previous_snapshot.date)}
+
+    @property
+    def previous_user_units(self) -> dict:
+        return {user_id: snap.units_held for user_id, snap in self.previous_user_shares.items()}
+
+    @property
+    def previous_user_twr(self) -> dict:
+        return {user_id: snap.twr for user_id, snap in self.previous_user_shares.items()}
+
+    @cached_property
+    def flows(self) -> list:
+        """
+        Deposits and withdrawals up to the date.
+        """
+        return list(Transaction.objects.filter(date__lte=self.date, type__in=["deposit", "withdrawal"]))
+
+    @cached_property
+    def user_cash_flows(self) -> dict:
+        """
+        (date, cash flow) pairs of each user up to the date, as used by the XIRR.
+        """
+        flows = {}
+        for tx in self.flows:
+            if tx.user_id is not None:
+                flows.setdefault(tx.user_id, []).append((tx.date, get_cash_flow(tx.type, tx.amount)))
+        return flows
+
+    @property
+    def movements(self) -> list:
+        """
+        Deposits and withdrawals executed on the date: those dated after the previous snapshot and up to the date,
+        so that the ones dated on a day that is not valued (e.g. a market holiday) are executed on the next valued date.
+        """
+        if self.previous_snapshot is None:
+            return self.flows
+        return [tx for tx in self.flows if tx.date > self.previous_snapshot.date]
+
+    @property
+    def deposits(self) -> list:
+        return [tx for tx in self.movements if tx.type == "deposit"]
+
+    @property
+    def withdrawals(self) -> list:
+        return [tx for tx in self.movements if tx.type == "withdrawal"]
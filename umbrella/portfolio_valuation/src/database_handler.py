@@ -1,6 +1,6 @@
-
 from decimal import Decimal, ROUND_HALF_UP
-from data_ingestion.models import HistoricalPrice
+from django.db import transaction as db_transaction
+from data_ingestion.src.storage import BATCH_SIZE, get_storage_backend
 from portfolio_valuation.models import DailyPortfolioSnapshot
 from portfolio_valuation.models import UserShareSnapshot
 from portfolio_valuation.models import PortfolioCompositionSnapshot
@@ -9,53 +9,79 @@ import logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+
+def replace_snapshots(model, dates: list, instances: list):
+    """
+    Replace the rows of a snapshot model stored on the given dates by the instances,
+    with one DELETE per BATCH_SIZE dates and one INSERT per BATCH_SIZE rows.
+    """
+    for start in range(0, len(dates), BATCH_SIZE):
+        model.objects.filter(date__in=dates[start:start + BATCH_SIZE]).delete()
+    model.objects.bulk_create(instances, batch_size=BATCH_SIZE)
+
+
+@db_transaction.atomic
+def save_snapshots(dates: list, daily: list, users: list, composition: list):
+    """
+    Write the snapshots of one or many dates in one transaction, with a few statements whatever the number of
+    dates, users and holdings. The daily snapshots are upserted on their date, and the user shares and the
+    composition of each date replace the stored ones, so that a date can be re-run and ends up with exactly
+    the rows of its last valuation.
+    """
+    get_storage_backend().upsert(DailyPortfolioSnapshot, daily, ["date"])
+    replace_snapshots(UserShareSnapshot, dates, users)
+    replace_snapshots(PortfolioCompositionSnapshot, dates, composition)
+
+
 class DatabaseHandler:
     def __init__(self, date):
         self.date = date
 
-    def save_to_PortfolioCompositionSnapshot(self, portfolio_composition):
+    def get_PortfolioCompositionSnapshots(self, portfolio_composition, prices) -> list:
+        """
+        Return the value of each held ticker, from the prices already read by the valuation.
+        """
+        held = {item["ticker"]: Decimal(item["total_qty"]) for item in portfolio_composition if item["total_qty"]}
 
-        for item in portfolio_composition:
-            ticker = item["ticker"]
-            net_qty = Decimal(item["total_qty"])
-            if net_qty == 0:
-                continue
-
-            try:
-                price = HistoricalPrice.objects.get(ticker=ticker, date=self.date)
-                close_eur = price.close_euro
-                value = (net_qty * close_eur).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-            except HistoricalPrice.DoesNotExist:
+        snapshots = []
+        for ticker, net_qty in held.items():
+            if ticker not in prices:
                 logger.warning(f"Missing historical price for {ticker} on {self.date}")
-        
+                continue
+            value = (net_qty * prices[ticker]).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
 
-            PortfolioCompositionSnapshot.objects.create(
+            snapshots.append(PortfolioCompositionSnapshot(
                 ticker=ticker,
                 date=self.date,
                 quantity=net_qty,
                 value_eur=value
-            )
+            ))
+        return snapshots
 
-    def save_to_DailyPortfolioSnapshot(self, fund_value, total_units, nav, nav_returns, gain_or_loss, cash, port_val, inflows):
-
-        DailyPortfolioSnapshot.objects.update_or_create(
+    def get_DailyPortfolioSnapshot(self, fund_value, total_units, nav, nav_returns, gain_or_loss, cash, port_val, inflows):
+        return DailyPortfolioSnapshot(
             date=self.date,
-            defaults={
-                "total_value": fund_value,
-                "total_units": total_units,
-                "nav_per_unit": nav,
-                "nav_returns": nav_returns,
-                "gain_or_loss": gain_or_loss,
-                "cash": cash,
-                "net_inflows": inflows,
-                "portfolio_total_value": port_val
-            }
+            total_value=fund_value,
+            total_units=total_units,
+            nav_per_unit=nav,
+            nav_returns=nav_returns,
+            gain_or_loss=gain_or_loss,
+            cash=cash,
+            net_inflows=inflows,
+            portfolio_total_value=port_val,
         )
 
-    def save_to_UserShareSnapshot(self, new_user_units):
-        for user_id, units in new_user_units.items():
-            UserShareSnapshot.objects.update_or_create(
-                date=self.date,
-                user_id=user_id,
-                defaults={"units_held": units}
-            )
\ No newline at end of file
+    def get_UserShareSnapshots(self, new_user_units, user_returns) -> list:
+        """
+        Return the share of each user, with the value and the returns computed by get_user_returns.
+        """
+        return [
+            UserShareSnapshot(date=self.date, user_id=user_id, units_held=units, **user_returns[user_id])
+            for user_id, units in new_user_units.items()
+        ]
+
+    def save(self, daily, users, composition):
+        """
+        Write the snapshots of the date, replacing the stored ones.
+        """
+        save_snapshots([self.date], [daily], users, composition)
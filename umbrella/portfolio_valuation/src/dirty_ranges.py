@@ -0,0 +1,63 @@
+import logging
+from django.db import transaction as db_transaction
+from django.db.models import F, Max, Min
+from django.db.models.functions import Least
+from django.utils import timezone
+from data_ingestion.src.calendars import get_fund_sessions
+from portfolio_valuation.models import DailyPortfolioSnapshot, DirtyRange
+from portfolio_valuation.src.range_valuation import RangeValuationEngine
+
+logger = logging.getLogger(__name__)
+
+
+def mark_dirty(date, reason: str = ""):
+    """
+    Record that the snapshots from a date onward are stale. Nothing is recorded when no snapshot exists on or
+    after the date, and a date before the first snapshot marks the snapshots from the first one.
+    The invalidation is coalesced with the pending one, if any, so that many writes trigger a single recomputation.
+    """
+    snapshots = DailyPortfolioSnapshot.objects.aggregate(first=Min("date"), last=Max("date"))
+    if snapshots["last"] is None or date > snapshots["last"]:
+        return
+    start_date = max(date, snapshots["first"])
+    with db_transaction.atomic():
+        pending = DirtyRange.objects.select_for_update().order_by("start_date").first()
+        if pending is None:
+            DirtyRange.objects.create(start_date=start_date, reason=reason[:255])
+        else:
+            DirtyRange.objects.filter(pk=pending.pk).update(
+                start_date=Least(F("start_date"), start_date),
+                reason=reason[:255],
+                invalidations=F("invalidations") + 1,
+                # QuerySet.update() does not set the auto_now fields
+                updated_at=timezone.now(),
+            )
+    logger.info(f"Snapshots marked stale from {start_date}: {reason}")
+
+
+def get_dirty_start_date():
+    """
+    Return the earliest date from which the snapshots are stale, or None when they are all up to date.
+    """
+    return DirtyRange.objects.aggregate(start=Min("start_date"))["start"]
+
+
+def recompute_dirty_ranges() -> list:
+    """
+    Recompute the snapshots from the earliest stale date up to the last snapshot, in one run of the
+    RangeValuationEngine, and clear the invalidations it covered. Returns the recomputed dates.
+    Invalidations recorded while the recomputation runs are kept for the next one.
+    """
+    pending = list(DirtyRange.objects.all())
+    if not pending:
+        return []
+    start_date = min(dirty.start_date for dirty in pending)
+    last_date = DailyPortfolioSnapshot.objects.aggregate(last=Max("date"))["last"]
+    dates = []
+    if last_date is not None and start_date <= last_date:
+        logger.info(f"Recomputing the snapshots from {start_date} to {last_date} ({sum(d.invalidations for d in pending)} invalidations)")
+        sessions = [session.date() for session in get_fund_sessions(start_date, last_date)]
+        dates = RangeValuationEngine(sessions).compute()
+    for dirty in pending:
+        DirtyRange.objects.filter(pk=dirty.pk, updated_at=dirty.updated_at, invalidations=dirty.invalidations).delete()
+    return dates
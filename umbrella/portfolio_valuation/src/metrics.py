@@ -1,20 +1,11 @@
 from decimal import Decimal
-from django.db.models import Sum
-from django.db.models.functions import Abs
-from transactions.models import Transaction
+from .context import ValuationContext
 
-def compute_total_metrics(date, fund_value: Decimal):
-    def sum_tx(tx_type):
-        return Transaction.objects.filter(type=tx_type, date__lte=date).annotate(abs_amount=Abs("amount")).aggregate(total=Sum("abs_amount"))["total"] or Decimal("0")
+def compute_total_metrics(context: ValuationContext, fund_value: Decimal):
+    deposits = context.ledger_cash["deposits"]
+    withdrawals = context.ledger_cash["withdrawals"]
 
-    deposits = sum_tx("deposit")
-    withdrawals = sum_tx("withdrawal")
-    dividends = sum_tx("dividend")
-    fees = sum_tx("fee")
-    buy = sum_tx("buy")
-    sell = sum_tx("sell")
-
-    cash = deposits + dividends + sell - (abs(withdrawals) + abs(fees) + abs(buy))
+    cash = context.cash
     asset_value = fund_value - cash
     net_inflows = deposits - abs(withdrawals)
     gain_or_loss = fund_value - net_inflows
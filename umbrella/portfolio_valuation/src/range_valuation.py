@@ -0,0 +1,240 @@
+import logging
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+import pandas as pd
+from data_ingestion.src.price_store import get_price_store
+from portfolio_valuation.models import DailyPortfolioSnapshot, PortfolioCompositionSnapshot, UserShareSnapshot
+from portfolio_valuation.src.database_handler import save_snapshots
+from portfolio_valuation.src.returns import get_cash_flow, get_user_returns
+from transactions.models import Transaction
+from transactions.src.ledger import CASH_SIGNS, SHARE_SIGNS
+
+logger = logging.getLogger(__name__)
+
+# The amounts and prices are held as integer cents and the share quantities as integer millionths of a share,
+# the decimal places of their fields, so that the cumulative sums and the valuations are exact
+CENT_PLACES = 2
+SHARE_PLACES = 6
+
+INT64_MAX = np.iinfo(np.int64).max
+
+
+def _to_int(value, places: int) -> int:
+    return int(Decimal(value).scaleb(places).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def _to_decimal(value, places: int) -> Decimal:
+    return Decimal(int(value)).scaleb(-places)
+
+
+def _divide_half_up(numerators: np.ndarray, divisor: int) -> np.ndarray:
+    """
+    Divide integers by a positive integer, rounding half away from zero like Decimal.quantize(ROUND_HALF_UP).
+    """
+    return np.sign(numerators) * ((np.abs(numerators) + divisor // 2) // divisor)
+
+
+def _as_of(dates: np.ndarray, cumulative: np.ndarray, days: np.ndarray) -> np.ndarray:
+    """
+    Return the cumulative values as of each day, from cumulative values indexed by sorted dates (0 before the first).
+    """
+    rows = np.searchsorted(dates, days, side="right")
+    padded = np.concatenate([np.zeros((1,) + cumulative.shape[1:], dtype=cumulative.dtype), cumulative])
+    return padded[rows]
+
+
+class RangeValuationEngine:
+    """
+    Values the fund on many dates at once, with the same results as ValuationService on each of them.
+    The transactions up to the last date are loaded in one query and the prices come from the PriceStore:
+    the cash and the positions of every date are cumulative sums over the transactions, and the assets of every
+    date are valued with a single positions x prices multiplication, on integers so that the results are exact.
+    Only the units and NAV chain, where each date depends on the previous one, is computed date by date.
+    The snapshots of all the dates are then written in bulk, in one transaction (see save_snapshots).
+    """
+    def __init__(self, dates):
+        """
+        Args:
+            dates (iterable): The valuation dates, usually the fund's sessions of a range
+        """
+        self.dates = sorted({pd.Timestamp(date).date() for date in dates})
+
+    def _load_transactions(self) -> pd.DataFrame:
+        rows = Transaction.objects.filter(date__lte=self.dates[-1]).order_by("date", "id").values_list(
+            "id", "date", "type", "amount", "user_id", "ticker", "shares"
+        )
+        # Object columns keep the dates, the Decimal amounts and the missing values as they are
+        return pd.DataFrame(
+            list(rows), columns=["id", "date", "type", "amount", "user_id", "ticker", "shares"], dtype=object
+        )
+
+    def _cash(self, transactions: pd.DataFrame, days: np.ndarray):
+        """
+        Return the cash balance and the net inflows (deposits less withdrawals) as of each date, in cents.
+        """
+        cents = np.array([abs(_to_int(amount, CENT_PLACES)) for amount in transactions["amount"]], dtype=object)
+        signs = transactions["type"].map(CASH_SIGNS).fillna(0).to_numpy(dtype=int)
+        inflow_signs = transactions["type"].map({"deposit": 1, "withdrawal": -1}).fillna(0).to_numpy(dtype=int)
+        dates = transactions["date"].to_numpy(dtype="datetime64[D]")
+        cash = _as_of(dates, np.cumsum(cents * signs), days) if len(cents) else np.zeros(len(days), dtype=object)
+        inflows = _as_of(dates, np.cumsum(cents * inflow_signs), days) if len(cents) else np.zeros(len(days), dtype=object)
+        return cash, inflows
+
+    def _positions(self, transactions: pd.DataFrame, days: np.ndarray):
+        """
+        Return the traded tickers and their quantity held as of each date, in millionths of a share,
+        as a dates x tickers integer matrix.
+        """
+        trades = transactions[transactions["type"].isin(SHARE_SIGNS)].copy()
+        if trades.empty:
+            return [], np.zeros((len(days), 0), dtype=np.int64)
+        trades["quantity"] = [
+            SHARE_SIGNS[kind] * _to_int(shares, SHARE_PLACES) if shares is not None else 0
+            for kind, shares in zip(trades["type"], trades["shares"])
+        ]
+        deltas = trades.pivot_table(index="date", columns="ticker", values="quantity", aggfunc="sum", fill_value=0)
+        cumulative = deltas.to_numpy(dtype=np.int64).cumsum(axis=0)
+        return list(deltas.columns), _as_of(deltas.index.to_numpy(dtype="datetime64[D]"), cumulative, days)
+
+    def _prices(self, tickers: list):
+        """
+        Return the close prices in EUR of the tickers as of each date in cents, and whether each price is known.
+        The prices are stored with 2 decimal places, so their float values round to exact cents.
+        """
+        prices = get_price_store().close_as_of(tickers, self.dates).to_numpy(dtype=float)
+        known = ~np.isnan(prices)
+        return np.rint(np.where(known, prices, 0) * 10 ** CENT_PLACES).astype(np.int64), known
+
+    @staticmethod
+    def _value(quantities: np.ndarray, prices: np.ndarray) -> np.ndarray:
+        """
+        Return the value of each position in cents, rounded half up like the per-date valuation.
+        The products are computed on Python integers when they could overflow 64 bits.
+        """
+        bound = int(np.abs(quantities).max(initial=0)) * int(np.abs(prices).max(initial=0))
+        if bound > INT64_MAX:
+            quantities, prices = quantities.astype(object), prices.astype(object)
+        return _divide_half_up(quantities * prices, 10 ** SHARE_PLACES)
+
+    def _previous_snapshot(self):
+        """
+        Return the last snapshot before the first date and the share of each user on that day.
+        """
+        previous = DailyPortfolioSnapshot.objects.filter(date__lt=self.dates[0]).order_by("-date").first()
+        if previous is None:
+            return None, {}
+        return previous, {snapshot.user_id: snapshot for snapshot in UserShareSnapshot.objects.filter(date=previous.date)}
+
+    @staticmethod
+    def _cash_flows(transactions: pd.DataFrame) -> list:
+        """
+        Return the (date, user_id, cash flow) of every deposit and withdrawal, in date order, as used by the XIRR.
+        """
+        movements = transactions[transactions["type"].isin(["deposit", "withdrawal"]) & transactions["user_id"].notna()]
+        return [
+            (date, user_id, get_cash_flow(kind, amount))
+            for date, user_id, kind, amount in movements[["date", "user_id", "type", "amount"]].itertuples(index=False)
+        ]
+
+    def compute(self) -> list:
+        """
+        Value the fund on every date and save the snapshots. Returns the valued dates.
+        """
+        if not self.dates:
+            return []
+        logger.info(f"Starting valuation of {len(self.dates)} dates from {self.dates[0]} to {self.dates[-1]}")
+        days = np.array(self.dates, dtype="datetime64[D]")
+        transactions = self._load_transactions()
+
+        cash, inflows = self._cash(transactions, days)
+        tickers, quantities = self._positions(transactions, days)
+        prices, known = self._prices(tickers)
+        held = (quantities != 0) & known
+        values = np.where(held, self._value(quantities, prices), 0)
+        fund_values = cash + values.sum(axis=1)
+
+        for j in np.flatnonzero(((quantities != 0) & ~known).any(axis=0)):
+            missing = int(((quantities[:, j] != 0) & ~known[:, j]).sum())
+            logger.warning(f"Missing historical price for {tickers[j]} on {missing} of the {len(days)} dates")
+
+        previous, shares = self._previous_snapshot()
+        # The deposits and withdrawals dated after the previous valued date, e.g. on a market holiday,
+        # are executed on the next valued date
+        movements = transactions[transactions["type"].isin(["deposit", "withdrawal"])]
+        if previous is not None:
+            movements = movements[movements["date"] > previous.date]
+        movements = movements.sort_values(["date", "id"])
+        valued_dates = np.searchsorted(days, movements["date"].to_numpy(dtype="datetime64[D]"), side="left")
+        movements_by_date = {self.dates[i]: group for i, group in movements.groupby(valued_dates)}
+
+        user_units = {user_id: share.units_held for user_id, share in shares.items()}
+        user_twr = {user_id: share.twr for user_id, share in shares.items()}
+        # The cash flows of each user up to the valued date, including those of the days that are not valued
+        cash_flows, user_flows, next_flow = self._cash_flows(transactions), {}, 0
+        daily, users, composition = [], [], []
+        for i, date in enumerate(self.dates):
+            fund_value = _to_decimal(fund_values[i], CENT_PLACES)
+            if previous is not None and previous.total_units > 0:
+                nav = (previous.total_value / previous.total_units).quantize(Decimal("0.00000001"), rounding=ROUND_HALF_UP)
+            else:
+                nav = Decimal("1.0")
+            if previous is None or previous.nav_per_unit == 0:
+                nav_returns = Decimal("0.0")
+            else:
+                nav_returns = ((nav - previous.nav_per_unit) / previous.nav_per_unit).quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
+            total_units = previous.total_units if previous is not None else Decimal("0.0")
+
+            new_user_units = {}
+            day_movements = movements_by_date.get(date)
+            if day_movements is not None:
+                for user_id, amount in day_movements.loc[day_movements["type"] == "deposit", ["user_id", "amount"]].itertuples(index=False):
+                    units = (amount / nav).quantize(Decimal("0.00000001"))
+                    new_user_units[user_id] = new_user_units.get(user_id, user_units.get(user_id, Decimal("0"))) + units
+                    total_units += units
+                for user_id, amount in day_movements.loc[day_movements["type"] == "withdrawal", ["user_id", "amount"]].itertuples(index=False):
+                    units = (amount / nav).quantize(Decimal("0.00000001"))
+                    prev = new_user_units.get(user_id, user_units.get(user_id, Decimal("0")))
+                    new_user_units[user_id] = max(prev - units, Decimal("0"))
+                    total_units -= units
+            for user_id, units in user_units.items():
+                new_user_units.setdefault(user_id, units)
+
+            day_cash = _to_decimal(cash[i], CENT_PLACES)
+            net_inflows = _to_decimal(inflows[i], CENT_PLACES)
+            previous = DailyPortfolioSnapshot(
+                date=date,
+                total_value=fund_value,
+                total_units=total_units,
+                nav_per_unit=nav,
+                nav_returns=nav_returns,
+                gain_or_loss=fund_value - net_inflows,
+                cash=day_cash,
+                net_inflows=net_inflows,
+                portfolio_total_value=fund_value - day_cash,
+            )
+            daily.append(previous)
+            while next_flow < len(cash_flows) and cash_flows[next_flow][0] <= date:
+                flow_date, user_id, flow = cash_flows[next_flow]
+                user_flows.setdefault(user_id, []).append((flow_date, flow))
+                next_flow += 1
+            user_returns = get_user_returns(new_user_units, user_twr, user_flows, fund_value, total_units, nav, date)
+            user_units = new_user_units
+            user_twr = {user_id: returns["twr"] for user_id, returns in user_returns.items()}
+            users.extend(
+                UserShareSnapshot(date=date, user_id=user_id, units_held=units, **user_returns[user_id])
+                for user_id, units in new_user_units.items()
+            )
+            composition.extend(
+                PortfolioCompositionSnapshot(
+                    date=date,
+                    ticker=tickers[j],
+                    quantity=_to_decimal(quantities[i, j], SHARE_PLACES),
+                    value_eur=_to_decimal(values[i, j], CENT_PLACES),
+                )
+                for j in np.flatnonzero(held[i])
+            )
+
+        save_snapshots(self.dates, daily, users, composition)
+        logger.info(f"Valuation of {len(self.dates)} dates completed")
+        return self.dates
+
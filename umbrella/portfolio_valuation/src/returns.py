@@ -0,0 +1,108 @@
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+
+RETURN_PLACES = Decimal("0.00000001")
+
+# Newton's method on the XIRR of every user at once
+XIRR_GUESS = 0.1
+XIRR_MAX_ITERATIONS = 100
+XIRR_TOLERANCE = 1e-10
+# Annualized rates beyond this bound (e.g. over a few days) are not meaningful and are not stored
+XIRR_BOUND = 1e6
+
+
+def get_cash_flow(tx_type: str, amount) -> Decimal:
+    """
+    Return the cash flow of a user for a deposit (paid in, negative) or a withdrawal (paid out, positive).
+    """
+    return abs(amount) if tx_type == "withdrawal" else -abs(amount)
+
+
+def get_value_held(units: Decimal, fund_value: Decimal, total_units: Decimal) -> Decimal:
+    """
+    Return the value of a user's units at the end of the day, i.e. their share of the fund value.
+    """
+    if not total_units:
+        return Decimal("0.00")
+    return (units * fund_value / total_units).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
+def get_twr(previous_twr: Decimal, units: Decimal, fund_value: Decimal, total_units: Decimal, nav: Decimal) -> Decimal:
+    """
+    Chain the cumulative time-weighted return of a user with the return of the day.
+    The deposits and withdrawals of the day are executed at the NAV, so the units held over the day earn the unit
+    value at the end of the day (fund value / total units) over the NAV, whatever the cash flows.
+    The return does not change on the days without units.
+    """
+    if not units or not total_units or not nav:
+        return previous_twr
+    return ((1 + previous_twr) * fund_value / total_units / nav - 1).quantize(RETURN_PLACES, rounding=ROUND_HALF_UP)
+
+
+def compute_xirr(flows: dict, values: dict, date) -> dict:
+    """
+    Return the annualized money-weighted return of every user, the rate r for which their cash flows and the value
+    they hold on the date sum to zero once compounded to the date: sum(flow * (1 + r) ** years_before_date) + value.
+    All the users are solved at once with a vectorized Newton's method, on a users x cash flows matrix.
+
+    Args:
+        flows (dict): The (date, cash flow) pairs of each user up to the date, see get_cash_flow
+        values (dict): The value held by each user on the date
+        date (datetime.date): The valuation date
+
+    Returns:
+        dict: The XIRR of each user of values, None when undefined (e.g. all the cash flows are on the date) or not converged
+    """
+    users = [user_id for user_id in values if flows.get(user_id)]
+    xirr = dict.fromkeys(values)
+    if not users:
+        return xirr
+
+    # The value held is the last cash flow of each row, the unused cells of the shorter rows stay at 0
+    width = max(len(flows[user_id]) for user_id in users) + 1
+    amounts = np.zeros((len(users), width))
+    years = np.zeros((len(users), width))
+    for i, user_id in enumerate(users):
+        for j, (day, amount) in enumerate(flows[user_id]):
+            amounts[i, j] = float(amount)
+            years[i, j] = (date - day).days / 365
+        amounts[i, -1] = float(values[user_id])
+
+    rates = np.full(len(users), XIRR_GUESS)
+    converged = np.zeros(len(users), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for _ in range(XIRR_MAX_ITERATIONS):
+            growth = (1 + rates[:, None]) ** years
+            npv = (amounts * growth).sum(axis=1)
+            derivative = (amounts * years * growth).sum(axis=1) / (1 + rates)
+            steps = npv / derivative
+            updated = rates - steps
+            # A step below -100% would make the growth undefined, it is halved towards -100% instead
+            updated = np.where(updated <= -1, (rates - 1) / 2, updated)
+            rates = np.where(converged, rates, updated)
+            converged |= np.abs(steps) < XIRR_TOLERANCE
+            if converged.all():
+                break
+
+    for user_id, rate, done in zip(users, rates, converged):
+        if done and np.isfinite(rate) and abs(rate) < XIRR_BOUND:
+            xirr[user_id] = Decimal(repr(float(rate))).quantize(RETURN_PLACES, rounding=ROUND_HALF_UP)
+    return xirr
+
+
+def get_user_returns(user_units: dict, previous_twr: dict, flows: dict, fund_value: Decimal,
+                     total_units: Decimal, nav: Decimal, date) -> dict:
+    """
+    Return the value held, the cumulative time-weighted return and the XIRR of every user on a date,
+    as {user_id: {"value_held", "twr", "xirr"}} dicts.
+    """
+    values = {user_id: get_value_held(units, fund_value, total_units) for user_id, units in user_units.items()}
+    xirr = compute_xirr(flows, values, date)
+    return {
+        user_id: {
+            "value_held": values[user_id],
+            "twr": get_twr(previous_twr.get(user_id, Decimal("0")), units, fund_value, total_units, nav),
+            "xirr": xirr[user_id],
+        }
+        for user_id, units in user_units.items()
+    }
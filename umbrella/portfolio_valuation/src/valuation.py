@@ -3,11 +3,12 @@ from decimal import Decimal
 import logging
 
 from django.db import transaction as db_transaction
-from transactions.models import Transaction
 from portfolio_valuation.src.database_handler import DatabaseHandler
+from .context import ValuationContext
 from .pricing import get_investment_value
 from .nav import get_previous_units, get_previous_user_units, get_nav_per_unit, get_daily_returns
 from .metrics import compute_total_metrics
+from .returns import get_user_returns
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -20,26 +21,28 @@ class ValuationService:
     @db_transaction.atomic
     def compute(self):
         logger.info(f"Starting valuation for {self.date}")
-        fund_value, portfolio_composition = get_investment_value(self.date)
+        # Everything the valuation reads is loaded once, in a fixed number of queries
+        context = ValuationContext(self.date)
+        fund_value, portfolio_composition = get_investment_value(context)
         logger.debug(f"Portfolio value: {fund_value}")
 
-        nav = get_nav_per_unit(self.date)
-        nav_returns = get_daily_returns(self.date, nav)
-        prev_units = get_previous_units(self.date)
-        prev_user_units = get_previous_user_units(self.date)
+        nav = get_nav_per_unit(context)
+        nav_returns = get_daily_returns(context, nav)
+        prev_units = get_previous_units(context)
+        prev_user_units = get_previous_user_units(context)
         logger.debug(f"NAV: {nav}, Total units: {prev_units}, Returns: {nav_returns}")
 
         new_user_units = {}
         total_units = prev_units
 
         # Handle deposits
-        for tx in Transaction.objects.filter(date=self.date, type="deposit"):
+        for tx in context.deposits:
             units = (tx.amount / nav).quantize(Decimal("0.00000001"))
             new_user_units[tx.user_id] = new_user_units.get(tx.user_id, prev_user_units.get(tx.user_id, Decimal("0"))) + units
             total_units += units
 
         # Handle withdrawals
-        for tx in Transaction.objects.filter(date=self.date, type="withdrawal"):
+        for tx in context.withdrawals:
             units = (tx.amount / nav).quantize(Decimal("0.00000001"))
             prev = new_user_units.get(tx.user_id, prev_user_units.get(tx.user_id, Decimal("0")))
             new_user_units[tx.user_id] = max(prev - units, Decimal("0"))
@@ -49,13 +52,21 @@ class ValuationService:
         for uid, prev in prev_user_units.items():
             new_user_units.setdefault(uid, prev)
 
-        gain_or_loss, cash, port_val, inflows, asset_val = compute_total_metrics(self.date, fund_value)
+        gain_or_loss, cash, port_val, inflows, asset_val = compute_total_metrics(context, fund_value)
+
+        # Value held, time-weighted and money-weighted returns of every user
+        user_returns = get_user_returns(
+            new_user_units, context.previous_user_twr, context.user_cash_flows, fund_value, total_units, nav, self.date
+        )
 
 
-        self.database_handler.save_to_PortfolioCompositionSnapshot(portfolio_composition)
-        self.database_handler.save_to_DailyPortfolioSnapshot(
-            fund_value, total_units, nav, nav_returns, gain_or_loss, cash, port_val, inflows
+        # The snapshots of the date replace the stored ones, so that a date can be re-run
+        self.database_handler.save(
+            self.database_handler.get_DailyPortfolioSnapshot(
+                fund_value, total_units, nav, nav_returns, gain_or_loss, cash, port_val, inflows
+            ),
+            self.database_handler.get_UserShareSnapshots(new_user_units, user_returns),
+            self.database_handler.get_PortfolioCompositionSnapshots(portfolio_composition, context.prices),
         )
-        self.database_handler.save_to_UserShareSnapshot(new_user_units)
 
         logger.info("Valuation completed.")
@@ -0,0 +1,327 @@
+from datetime import date, timedelta
+from unittest import mock
+from decimal import Decimal
+import pandas as pd
+from django.contrib.auth import get_user_model
+from django.db.models import Sum, Case, When, F, DecimalField
+from django.test import SimpleTestCase, TestCase
+from config.test_utils import QueryPlanAssertionsMixin
+from data_ingestion.models import HistoricalPrice
+from data_ingestion.src import price_store
+from data_ingestion.src.price_store import get_price_store
+from data_ingestion.src.calendars import get_fund_sessions
+from data_ingestion.src.database_handler import DatabaseHandler
+from data_ingestion.signals import prices_saved
+from portfolio_valuation.models import DailyPortfolioSnapshot, DirtyRange, UserShareSnapshot, PortfolioCompositionSnapshot
+from portfolio_valuation.src.dirty_ranges import mark_dirty, recompute_dirty_ranges
+from portfolio_valuation.src.range_valuation import RangeValuationEngine
+from portfolio_valuation.src.returns import compute_xirr, get_twr, get_value_held
+from portfolio_valuation.src.valuation import ValuationService
+from transactions.models import Transaction
+
+
+class ValuationQueryPlanTest(QueryPlanAssertionsMixin, TestCase):
+    day = date(2024, 6, 3)
+
+    def test_transaction_queries_use_index(self):
+        self.assertNoFullTableScan(Transaction.objects.filter(type="deposit", date__lte=self.day))
+        self.assertNoFullTableScan(Transaction.objects.filter(date=self.day, type="withdrawal"))
+        self.assertNoFullTableScan(Transaction.objects.order_by("date")[:1])
+        self.assertNoFullTableScan(
+            Transaction.objects
+            .filter(date__lte=self.day, type__in=["buy", "sell"])
+            .values("ticker")
+            .annotate(total_qty=Sum(Case(
+                When(type="buy", then=F("shares")),
+                When(type="sell", then=-F("shares")),
+                default=Decimal("0"),
+                output_field=DecimalField(),
+            )))
+        )
+
+    def test_price_queries_use_index(self):
+        self.assertNoFullTableScan(HistoricalPrice.objects.filter(ticker="AAPL", date=self.day))
+        self.assertNoFullTableScan(
+            HistoricalPrice.objects.filter(ticker="AAPL", date__lt=self.day, date__gte=self.day - timedelta(days=365))
+        )
+
+    def test_snapshot_queries_use_index(self):
+        self.assertNoFullTableScan(DailyPortfolioSnapshot.objects.filter(date__lt=self.day).order_by("-date")[:1])
+        self.assertNoFullTableScan(UserShareSnapshot.objects.filter(date=self.day))
+        self.assertNoFullTableScan(UserShareSnapshot.objects.filter(user_id=1, date__range=[self.day, self.day]))
+        self.assertNoFullTableScan(PortfolioCompositionSnapshot.objects.filter(date=self.day))
+
+
+class RangeValuationTestCase(TestCase):
+    """
+    Transactions and prices over a few weeks of sessions, with helpers comparing the stored snapshots.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        alice = User.objects.create_user(username="alice")
+        bob = User.objects.create_user(username="bob")
+        cls.dates = [session.date() for session in get_fund_sessions(date(2024, 3, 1), date(2024, 4, 15), ["AAA", "BBB.MI"])]
+        d = cls.dates
+
+        transactions = [
+            ("deposit", alice, d[0], "1000.00", None, None),
+            ("buy", None, d[1], "-354.80", "AAA", "3.5"),
+            ("deposit", bob, d[3], "500.50", None, None),
+            ("buy", None, d[3], "-400.00", "BBB.MI", "1.333333"),
+            ("buy", None, d[4], "-50.00", "ZZZ", "2"),
+            ("deposit", alice, d[6], "250.25", None, None),
+            ("withdrawal", bob, d[6], "100.00", None, None),
+            ("sell", None, d[8], "126.70", "AAA", "1.25"),
+            ("dividend", None, d[10], "12.34", "BBB.MI", None),
+            ("fee", None, d[11], "-1.99", None, None),
+            ("withdrawal", alice, d[14], "300.00", None, None),
+            ("deposit", bob, d[14], "75.00", None, None),
+            ("sell", None, d[20], "500.00", "BBB.MI", "1.333333"),
+        ]
+        for kind, user, day, amount, ticker, shares in transactions:
+            Transaction.objects.create(
+                type=kind, user=user, date=day, amount=Decimal(amount), ticker=ticker,
+                shares=Decimal(shares) if shares else None,
+            )
+
+        # AAA trades on every session, BBB.MI only from the 6th one and with gaps, ZZZ is never priced
+        for i, day in enumerate(d):
+            HistoricalPrice.objects.create(ticker="AAA", currency="EUR", date=day, close_euro=Decimal("101.37") + Decimal(i * 7 % 13) / 100)
+            if i >= 5 and i % 4:
+                HistoricalPrice.objects.create(ticker="BBB.MI", currency="EUR", date=day, close_euro=Decimal("300.05") - Decimal(i) / 100)
+
+    def setUp(self):
+        price_store.invalidate()
+
+    @staticmethod
+    def snapshots():
+        return (
+            list(DailyPortfolioSnapshot.objects.order_by("date").values_list(
+                "date", "total_value", "total_units", "nav_per_unit", "nav_returns", "gain_or_loss", "cash",
+                "portfolio_total_value", "net_inflows",
+            )),
+            list(UserShareSnapshot.objects.order_by("date", "user_id").values_list(
+                "date", "user_id", "units_held", "value_held", "twr", "xirr",
+            )),
+            list(PortfolioCompositionSnapshot.objects.order_by("date", "ticker").values_list("date", "ticker", "quantity", "value_eur")),
+        )
+
+    @staticmethod
+    def clear():
+        DailyPortfolioSnapshot.objects.all().delete()
+        UserShareSnapshot.objects.all().delete()
+        PortfolioCompositionSnapshot.objects.all().delete()
+
+    def per_date_snapshots(self):
+        for day in self.dates:
+            ValuationService(day).compute()
+        expected = self.snapshots()
+        self.clear()
+        return expected
+
+
+class RangeValuationParityTest(RangeValuationTestCase):
+    """
+    The range engine of compute_valuation_batch must save exactly the snapshots of ValuationService run on each date.
+    """
+    def test_range_matches_per_date_valuation(self):
+        expected = self.per_date_snapshots()
+        self.assertEqual(RangeValuationEngine(self.dates).compute(), self.dates)
+        self.assertEqual(self.snapshots(), expected)
+        self.assertTrue(any(value % Decimal("1") for _, _, _, value in expected[2]))
+
+    def test_range_continues_from_previous_snapshots(self):
+        expected = self.per_date_snapshots()
+        for day in self.dates[:7]:
+            ValuationService(day).compute()
+        RangeValuationEngine(self.dates[7:]).compute()
+        self.assertEqual(self.snapshots(), expected)
+
+    def test_range_can_be_rerun(self):
+        expected = self.per_date_snapshots()
+        RangeValuationEngine(self.dates).compute()
+        RangeValuationEngine(self.dates[3:]).compute()
+        self.assertEqual(self.snapshots(), expected)
+
+
+class HolidayMovementTest(TestCase):
+    """
+    A deposit dated on a market holiday must be executed on the next valued date, by both valuation paths.
+    """
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create_user(username="alice")
+        self.bob = User.objects.create_user(username="bob")
+        Transaction.objects.create(type="deposit", user=self.alice, date=date(2024, 12, 23), amount=Decimal("1000.00"))
+        Transaction.objects.create(type="deposit", user=self.bob, date=date(2024, 12, 25), amount=Decimal("1000.00"))
+        self.dates = [session.date() for session in get_fund_sessions(date(2024, 12, 23), date(2024, 12, 27))]
+        price_store.invalidate()
+
+    def units(self):
+        return list(UserShareSnapshot.objects.filter(date=date(2024, 12, 27)).order_by("user_id").values_list("user_id", "units_held"))
+
+    def test_holiday_deposit_gets_units(self):
+        self.assertNotIn(date(2024, 12, 25), self.dates)
+        expected = [(self.alice.id, Decimal("1000")), (self.bob.id, Decimal("1000"))]
+        for day in self.dates:
+            ValuationService(day).compute()
+        self.assertEqual(self.units(), expected)
+        self.assertEqual(DailyPortfolioSnapshot.objects.get(date=date(2024, 12, 27)).nav_per_unit, Decimal("1"))
+
+        RangeValuationEngine(self.dates).compute()
+        self.assertEqual(self.units(), expected)
+        RangeValuationEngine(self.dates[2:]).compute()
+        self.assertEqual(self.units(), expected)
+
+
+class DirtyRangeTest(RangeValuationTestCase):
+    """
+    Back-dated transaction writes and price re-ingests must mark the snapshots stale from the earliest affected date,
+    and the recomputation must leave the snapshots of a full valuation.
+    """
+    def setUp(self):
+        super().setUp()
+        RangeValuationEngine(self.dates).compute()
+
+    def test_backdated_transactions_are_coalesced_and_recomputed(self):
+        d = self.dates
+        alice = get_user_model().objects.get(username="alice")
+        Transaction.objects.create(type="fee", date=d[9], amount=Decimal("-5.00"))
+        Transaction.objects.create(type="deposit", user=alice, date=d[5], amount=Decimal("40.00"))
+        Transaction.objects.get(type="dividend").delete()
+        self.assertEqual(list(DirtyRange.objects.values_list("start_date", "invalidations")), [(d[5], 3)])
+
+        self.assertEqual(recompute_dirty_ranges(), d[5:])
+        self.assertFalse(DirtyRange.objects.exists())
+        recomputed = self.snapshots()
+        self.clear()
+        self.assertEqual(recomputed, self.per_date_snapshots())
+
+    def test_invalidation_during_recomputation_is_kept(self):
+        d = self.dates
+        mark_dirty(d[10], "first")
+        compute = RangeValuationEngine.compute
+
+        def compute_and_mark(engine):
+            dates = compute(engine)
+            mark_dirty(d[2], "during the recomputation")
+            return dates
+
+        with mock.patch.object(RangeValuationEngine, "compute", compute_and_mark):
+            self.assertEqual(recompute_dirty_ranges(), d[10:])
+        self.assertEqual(list(DirtyRange.objects.values_list("start_date", "invalidations")), [(d[2], 2)])
+        self.assertEqual(recompute_dirty_ranges(), d[2:])
+        self.assertFalse(DirtyRange.objects.exists())
+
+    def test_only_stored_snapshots_are_marked(self):
+        d = self.dates
+        Transaction.objects.create(type="fee", date=d[-1] + timedelta(days=1), amount=Decimal("-5.00"))
+        prices_saved.send(sender=None, ticker="QQQ", first_date=d[2], last_date=d[2])
+        self.assertFalse(DirtyRange.objects.exists())
+
+        prices_saved.send(sender=None, ticker="BBB.MI", first_date=d[12], last_date=d[14])
+        prices_saved.send(sender=None, ticker="BBB.MI", first_date=None, last_date=None)
+        self.assertEqual(list(DirtyRange.objects.values_list("start_date", "invalidations")), [(d[3], 2)])
+
+    def test_full_price_refresh_marks_the_changed_prices_only(self):
+        d = self.dates
+        stored = list(HistoricalPrice.objects.filter(ticker="AAA").order_by("date").values_list("date", "close_euro"))
+        prices = pd.DataFrame(
+            {"close_euro": [float(close) for _, close in stored]},
+            index=pd.to_datetime([day for day, _ in stored]),
+        )
+        handler = DatabaseHandler(model=HistoricalPrice)
+        with self.captureOnCommitCallbacks(execute=True):
+            handler.save_prices("AAA", "EUR", prices, replace=True)
+        self.assertFalse(DirtyRange.objects.exists())
+
+        prices.iloc[12, 0] += 1
+        with self.captureOnCommitCallbacks(execute=True):
+            handler.save_prices("AAA", "EUR", prices.iloc[:-1], replace=True)
+        self.assertEqual(list(DirtyRange.objects.values_list("start_date", "invalidations")), [(d[12], 1)])
+
+
+class UserReturnsTest(SimpleTestCase):
+    day = date(2024, 6, 3)
+
+    def test_xirr_of_all_users_at_once(self):
+        flows = {
+            1: [(date(2023, 6, 4), Decimal("-1000.00"))],
+            2: [(date(2023, 6, 4), Decimal("-1000.00")), (date(2023, 12, 3), Decimal("-500.00")), (date(2024, 3, 4), Decimal("200.00"))],
+            3: [(self.day, Decimal("-100.00"))],
+        }
+        values = {1: Decimal("1100.00"), 2: Decimal("1400.00"), 3: Decimal("100.00"), 4: Decimal("0.00")}
+        xirr = compute_xirr(flows, values, self.day)
+        self.assertEqual(xirr[1], Decimal("0.10000000"))
+        # The rate of user 2 zeroes its compounded cash flows
+        rate = float(xirr[2])
+        years = [(self.day - day).days / 365 for day, _ in flows[2]]
+        npv = sum(float(amount) * (1 + rate) ** y for (_, amount), y in zip(flows[2], years)) + 1400
+        self.assertAlmostEqual(npv, 0, places=4)
+        # Undefined when all the cash flows are on the valuation date, or without cash flows
+        self.assertIsNone(xirr[3])
+        self.assertIsNone(xirr[4])
+
+    def test_twr_ignores_cash_flows(self):
+        # Units bought at a NAV of 1.10 and worth 1.21 at the end of the day earn 10%, whatever their number
+        twr = get_twr(Decimal("0.1"), Decimal("10"), Decimal("1210.00"), Decimal("1000"), Decimal("1.10"))
+        self.assertEqual(twr, Decimal("0.21000000"))
+        self.assertEqual(get_twr(Decimal("0.1"), Decimal("0"), Decimal("1210.00"), Decimal("1000"), Decimal("1.10")), Decimal("0.1"))
+        self.assertEqual(get_value_held(Decimal("10"), Decimal("1210.00"), Decimal("1000")), Decimal("12.10"))
+
+
+class ValuationQueryCountTest(TestCase):
+    """
+    ValuationService reads everything through a ValuationContext and writes its snapshots in bulk,
+    so its number of queries does not grow with the number of holdings or users.
+    """
+    day = date(2024, 6, 4)
+    # Cash ledger, position ledger, previous snapshot, previous user units, movements of the day (5 reads),
+    # daily snapshot upsert (2 queries), user shares and composition delete and insert (2 queries each),
+    # and 4 savepoint statements
+    QUERIES = 15
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="alice")
+        Transaction.objects.create(type="deposit", user=self.user, date=date(2024, 6, 3), amount=Decimal("10000.00"))
+        Transaction.objects.create(type="deposit", user=self.user, date=self.day, amount=Decimal("500.00"))
+        DailyPortfolioSnapshot.objects.create(date=date(2024, 6, 3), total_value=Decimal("10000.00"), total_units=Decimal("10000"))
+        UserShareSnapshot.objects.create(date=date(2024, 6, 3), user_id=self.user.id, units_held=Decimal("10000"))
+
+    def assertQueriesWithHoldings(self, count):
+        for i in range(count):
+            ticker = f"T{i}"
+            Transaction.objects.create(type="buy", date=date(2024, 6, 3), amount=Decimal("-100.00"), ticker=ticker, shares=Decimal("2"))
+            HistoricalPrice.objects.create(ticker=ticker, currency="EUR", date=date(2024, 6, 3), close_euro=Decimal("51.25"))
+        # The PriceStore is loaded once per process, not per valuation
+        price_store.invalidate()
+        get_price_store().get_close_prices([], self.day)
+
+        with self.assertNumQueries(self.QUERIES):
+            ValuationService(self.day).compute()
+        self.assertEqual(PortfolioCompositionSnapshot.objects.filter(date=self.day).count(), count)
+
+    def test_one_holding(self):
+        self.assertQueriesWithHoldings(1)
+
+    def test_many_holdings(self):
+        self.assertQueriesWithHoldings(25)
+
+    def test_many_users(self):
+        for i in range(25):
+            user = get_user_model().objects.create_user(username=f"user{i}")
+            UserShareSnapshot.objects.create(date=date(2024, 6, 3), user_id=user.id, units_held=Decimal("10"))
+        self.assertQueriesWithHoldings(1)
+        self.assertEqual(UserShareSnapshot.objects.filter(date=self.day).count(), 26)
+
+    def test_rerun_replaces_snapshots(self):
+        self.assertQueriesWithHoldings(3)
+        expected = list(PortfolioCompositionSnapshot.objects.filter(date=self.day).values_list("ticker", "quantity", "value_eur"))
+        Transaction.objects.filter(ticker="T2").delete()
+        ValuationService(self.day).compute()
+        self.assertEqual(
+            list(PortfolioCompositionSnapshot.objects.filter(date=self.day).values_list("ticker", "quantity", "value_eur")),
+            expected[:2],
+        )
+        self.assertEqual(DailyPortfolioSnapshot.objects.filter(date=self.day).count(), 1)
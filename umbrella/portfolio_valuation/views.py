@@ -5,9 +5,7 @@ from portfolio_valuation.models import DailyPortfolioSnapshot
 from django.forms.models import model_to_dict
 from django.views import View
 from portfolio_valuation.models import UserShareSnapshot
-from django.db.models import Sum, Case, When, F, DecimalField
-from transactions.models import Transaction
-from decimal import Decimal
+from transactions.src.ledger import get_positions
 
 @require_GET
 def get_portfolio_valuations(request):
@@ -43,28 +41,8 @@ def get_portfolio_stock(request):
     Get current stock holdings based on buy/sell transactions.
     """
 
-    # Aggregate buy/sell transactions to find net quantity per ticker
-    asset_tx = (
-        Transaction.objects
-        .filter(type__in=["buy", "sell"])
-        .values("ticker")
-        .annotate(
-            total_qty=Sum(
-                Case(
-                    When(type="buy", then=F("shares")),
-                    When(type="sell", then=-F("shares")),
-                    default=Decimal("0"),
-                    output_field=DecimalField(),
-                )
-            )
-        )
-    )
-
-    stocks = {}
-
-    for item in asset_tx:
-        if item["total_qty"] > 0:
-            stocks[item["ticker"]] = Decimal(item["total_qty"])
+    # Net quantity per ticker after all the transactions, from the position ledger
+    stocks = {ticker: quantity for ticker, quantity in get_positions().items() if quantity > 0}
 
     return JsonResponse({
         "status": "success",
@@ -73,6 +51,9 @@ def get_portfolio_stock(request):
 
 class UserShareSnapshotView(View):
     def get(self, request, user_id):
+        """
+        Get the daily units, value and returns of a user, precomputed by the valuation, over an optional date range.
+        """
         start_date_str = request.GET.get("start_date")
         end_date_str = request.GET.get("end_date")
 
@@ -93,7 +74,9 @@ class UserShareSnapshotView(View):
             {
                 "date": snapshot.date.strftime("%Y-%m-%d"),
                 "units_held": float(snapshot.units_held),
-                "value_held": float(snapshot.value_held)
+                "value_held": float(snapshot.value_held),
+                "twr": float(snapshot.twr),
+                "xirr": float(snapshot.xirr) if snapshot.xirr is not None else None,
             }
             for snapshot in snapshots
         ]
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.utils.dateparse import parse_date
 from risk_management.src.var_computation import compute_historical_var
+from data_ingestion.src.calendars import is_fund_session
 import sys
 
 class Command(BaseCommand):
@@ -17,8 +18,8 @@ class Command(BaseCommand):
             self.stderr.write(self.style.ERROR("Invalid date format. Use YYYY-MM-DD."))
             sys.exit(1)
 
-        if computation_date.weekday() >= 5:
-            self.stderr.write(self.style.WARNING("Market is closed on weekends. Skipping VAR computation."))
+        if not is_fund_session(computation_date):
+            self.stderr.write(self.style.WARNING("Markets are closed on this date. Skipping VAR computation."))
             return
 
         try:
@@ -1,15 +1,14 @@
 import pandas as pd
 from portfolio_valuation.models import DailyPortfolioSnapshot
-from data_ingestion.models import HistoricalPrice
-from transactions.models import Transaction
-from django.db.models import Sum, Case, When, F, DecimalField
-from decimal import Decimal
+from data_ingestion.src.calendars import get_fund_sessions
+from data_ingestion.src.price_store import get_price_store
+from transactions.src.ledger import get_positions
 from datetime import timedelta
 
 def get_last_snapshot_date(date):
     """
     Get the most recent date for which a DailyPortfolioSnapshot exists before the given date.
-    Note that there is no data for weekends days.
+    Note that there is no data for the days on which the fund's exchanges are all closed.
     """
     snapshot = DailyPortfolioSnapshot.objects.filter(date__lt=date).order_by("-date").first()
     return snapshot.date if snapshot else None
@@ -17,32 +16,10 @@ def get_last_snapshot_date(date):
 def get_portfolio_composition(date):
     """
     Get the portfolio composition (ticker and quantity) as of the given date.
-    This is done by aggregating all buy/sell transactions up to that date.
+    This is read from the position ledger, which is maintained on every transaction write.
     """
 
-    # Aggregate buy/sell transactions to find net quantity per ticker
-    asset_tx = (
-        Transaction.objects
-        .filter(type__in=["buy", "sell"])
-        .values("ticker")
-        .annotate(
-            total_qty=Sum(
-                Case(
-                    When(type="buy", then=F("shares")),
-                    When(type="sell", then=-F("shares")),
-                    default=Decimal("0"),
-                    output_field=DecimalField(),
-                )
-            )
-        )
-    )
-
-    portfolio_composition = {}
-    for item in asset_tx:
-        if item["total_qty"] > 0:
-            portfolio_composition[item["ticker"]] = Decimal(item["total_qty"])
-    
-    return portfolio_composition
+    return {ticker: quantity for ticker, quantity in get_positions(date).items() if quantity > 0}
 
 def compute_historical_var(date):
     """
@@ -53,26 +30,21 @@ def compute_historical_var(date):
     from risk_management.models import VARComputation
 
     last_date = get_last_snapshot_date(date)
+    if last_date is None:
+        raise ValueError(f"No portfolio snapshot found before {date}")
 
     portfolio_composition = get_portfolio_composition(last_date)
 
-    # Build a DataFrame of daily portfolio value over the past year
-    portfolio_values = {}
-    for stock, qty in portfolio_composition.items():
-        prices = HistoricalPrice.objects.filter(
-            ticker=stock,
-            date__lt=last_date,
-            date__gte=last_date - timedelta(days=365)
-        ).values("date", "close_euro")
-        for p in prices:
-            d = p["date"]
-            v = p["close_euro"] or Decimal("0")
-            portfolio_values.setdefault(d, Decimal("0"))
-            portfolio_values[d] += qty * v # Sum value of each stock * quantity
-
-    # Convert to DataFrame and sort by date
-    df = pd.DataFrame(list(portfolio_values.items()), columns=["date", "value"])
-    df = df.sort_values("date").set_index("date")
+    # Build a DataFrame of daily portfolio value over the past year, on the sessions of the fund's exchanges.
+    # Each asset is valued at its last price, as its own exchange may be closed on some of these sessions.
+    start_date = last_date - timedelta(days=365)
+    sessions = get_fund_sessions(start_date, last_date - timedelta(days=1), tickers=portfolio_composition.keys())
+    # Price of each asset as of each session, looked up in the in-process price matrix
+    prices = get_price_store().close_as_of(portfolio_composition.keys(), sessions).fillna(0)
+    quantities = pd.Series({stock: float(qty) for stock, qty in portfolio_composition.items()})
+    df = (prices * quantities.reindex(prices.columns)).sum(axis=1).to_frame("value")
+    # Sessions before the first available price
+    df = df[df["value"] != 0]
 
     # Compute daily returns
     df["returns"] = df["value"].pct_change().dropna()
@@ -1,8 +1,17 @@
 from django.contrib import admin
-from .models import Transaction
+from .models import CashLedger, PositionLedger, Transaction
 
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
     list_display = ("date", "type", "user", "amount", "ticker", "shares")
     list_filter = ("type", "user", "ticker")
-    search_fields = ("ticker", "user__username")
\ No newline at end of file
+    search_fields = ("ticker", "user__username")
+
+@admin.register(PositionLedger)
+class PositionLedgerAdmin(admin.ModelAdmin):
+    list_display = ("date", "ticker", "quantity")
+    list_filter = ("ticker",)
+
+@admin.register(CashLedger)
+class CashLedgerAdmin(admin.ModelAdmin):
+    list_display = ("date", "balance", "deposits", "withdrawals")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from transactions.src.ledger import rebuild_ledgers
+
+
+class Command(BaseCommand):
+    help = "Rebuild the position and cash ledgers from all the transactions"
+
+    def handle(self, *args, **options):
+        positions, cash = rebuild_ledgers()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {positions} position and {cash} cash change-points"))
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:17
+
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import migrations, models
+
+# Frozen copy of the signs of transactions.src.ledger as of this migration
+CASH_SIGNS = {"deposit": 1, "dividend": 1, "sell": 1, "withdrawal": -1, "fee": -1, "buy": -1}
+SHARE_SIGNS = {"buy": 1, "sell": -1}
+
+
+def get_change_points(transactions) -> tuple:
+    """
+    Return the ledger rows of (type, date, amount, ticker, shares) transaction tuples sorted by date:
+    the quantities keyed by (ticker, date) and the cash fields keyed by date.
+    """
+    positions, cash = {}, {}
+    quantities = {}
+    totals = {"balance": Decimal("0"), "deposits": Decimal("0"), "withdrawals": Decimal("0")}
+    for tx_type, date, amount, ticker, shares in transactions:
+        amount = abs(Decimal(str(amount))).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        changes = {
+            "balance": CASH_SIGNS.get(tx_type, 0) * amount,
+            "deposits": amount if tx_type == "deposit" else Decimal("0"),
+            "withdrawals": amount if tx_type == "withdrawal" else Decimal("0"),
+        }
+        if any(changes.values()):
+            totals = {field: totals[field] + change for field, change in changes.items()}
+            cash[date] = totals
+        if tx_type in SHARE_SIGNS and ticker and shares is not None:
+            quantity = SHARE_SIGNS[tx_type] * Decimal(str(shares)).quantize(Decimal("0.000001"), rounding=ROUND_HALF_UP)
+            if quantity:
+                quantities[ticker] = quantities.get(ticker, Decimal("0")) + quantity
+                positions[(ticker, date)] = quantities[ticker]
+    return positions, cash
+
+
+def build_ledgers(apps, schema_editor):
+    """
+    Fill the ledgers from the existing transactions.
+    """
+    Transaction = apps.get_model("transactions", "Transaction")
+    PositionLedger = apps.get_model("transactions", "PositionLedger")
+    CashLedger = apps.get_model("transactions", "CashLedger")
+    positions, cash = get_change_points(
+        Transaction.objects.order_by("date", "id").values_list("type", "date", "amount", "ticker", "shares")
+    )
+    PositionLedger.objects.bulk_create(
+        [PositionLedger(ticker=ticker, date=date, quantity=quantity) for (ticker, date), quantity in positions.items()],
+        batch_size=500,
+    )
+    CashLedger.objects.bulk_create([CashLedger(date=date, **values) for date, values in cash.items()], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0003_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CashLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('deposits', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('withdrawals', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PositionLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(max_length=10)),
+                ('date', models.DateField()),
+                ('quantity', models.DecimalField(decimal_places=6, default=0, max_digits=20)),
+            ],
+            options={
+                'unique_together': {('ticker', 'date')},
+            },
+        ),
+        migrations.RunPython(build_ledgers, migrations.RunPython.noop),
+    ]
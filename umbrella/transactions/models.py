@@ -23,7 +23,42 @@ class Transaction(models.Model):
 
     class Meta:
         ordering = ['date', 'id']
+        indexes = [
+            models.Index(fields=["type", "date"], name="transaction_type_date_idx"),
+            models.Index(fields=["date"], name="transaction_date_idx"),
+        ]
 
     def __str__(self):
         return f"{self.date} - {self.type} - {self.amount} EUR"
 
+
+class PositionLedger(models.Model):
+    """
+    Model for storing the net quantity held of each ticker after the transactions of a date,
+    one row per date on which it changed. The position on any date is the last row on or before it.
+    Maintained on every write of a Transaction (see transactions.signals).
+    """
+    ticker = models.CharField(max_length=10)
+    date = models.DateField()
+    quantity = models.DecimalField(max_digits=20, decimal_places=6, default=0)
+
+    class Meta:
+        # The unique index on (ticker, date) serves the as-of lookups
+        unique_together = ("ticker", "date")
+
+    def __str__(self):
+        return f"{self.date} - {self.ticker} - {self.quantity}"
+
+class CashLedger(models.Model):
+    """
+    Model for storing the cash balance of the fund and the total deposits and withdrawals after the transactions
+    of a date, one row per date with transactions. The cash on any date is the last row on or before it.
+    Maintained on every write of a Transaction (see transactions.signals).
+    """
+    date = models.DateField(unique=True)
+    balance = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    deposits = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    withdrawals = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.date} - {self.balance} EUR"
@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from transactions.models import Transaction
+from transactions.src.ledger import apply_transaction
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_stored_transaction(sender, instance, raw=False, **kwargs):
+    """
+    Keep the stored version of an edited transaction, which must be reverted from the ledgers once it is saved.
+    """
+    instance._stored = None if raw or instance.pk is None else Transaction.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=Transaction)
+def update_ledgers_on_save(sender, instance, created, raw=False, **kwargs):
+    """
+    Keep the position and cash ledgers in sync with an added or edited transaction.
+    """
+    if raw:
+        # Fixtures are loaded without the ledgers, rebuild them with the rebuild_ledgers command
+        return
+    stored = getattr(instance, "_stored", None)
+    if stored is not None:
+        apply_transaction(stored, sign=-1)
+    apply_transaction(instance)
+
+
+@receiver(post_delete, sender=Transaction)
+def update_ledgers_on_delete(sender, instance, **kwargs):
+    """
+    Revert a deleted transaction from the position and cash ledgers.
+    """
+    apply_transaction(instance, sign=-1)
@@ -0,0 +1,142 @@
+import logging
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import transaction as db_transaction
+from django.db.models import F, OuterRef, Subquery
+from data_ingestion.src.storage import BATCH_SIZE
+from transactions.models import CashLedger, PositionLedger, Transaction
+
+logger = logging.getLogger(__name__)
+
+# Sign of each transaction type in the cash balance, whatever the sign of the stored amount
+CASH_SIGNS = {"deposit": 1, "dividend": 1, "sell": 1, "withdrawal": -1, "fee": -1, "buy": -1}
+# Sign of the buy and sell transactions in the positions
+SHARE_SIGNS = {"buy": 1, "sell": -1}
+
+CASH_FIELDS = ("balance", "deposits", "withdrawals")
+
+
+def _amount(value) -> Decimal:
+    """
+    Return the absolute amount of a transaction as stored, the views creating them with float amounts.
+    """
+    return abs(Decimal(str(value))).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
+def _shares(value) -> Decimal:
+    if value is None:
+        return Decimal("0")
+    return Decimal(str(value)).quantize(Decimal("0.000001"), rounding=ROUND_HALF_UP)
+
+
+def get_cash_changes(tx_type: str, amount) -> dict:
+    """
+    Return the change of the cash balance, the deposits and the withdrawals made by a transaction.
+    """
+    amount = _amount(amount)
+    return {
+        "balance": CASH_SIGNS.get(tx_type, 0) * amount,
+        "deposits": amount if tx_type == "deposit" else Decimal("0"),
+        "withdrawals": amount if tx_type == "withdrawal" else Decimal("0"),
+    }
+
+
+def get_position_change(tx_type: str, ticker: str, shares):
+    """
+    Return the ticker and the change of quantity of a buy or a sell, or (None, 0) for the other transactions.
+    """
+    if tx_type not in SHARE_SIGNS or not ticker:
+        return None, Decimal("0")
+    return ticker, SHARE_SIGNS[tx_type] * _shares(shares)
+
+
+def _shift(queryset, date, key: dict, changes: dict):
+    """
+    Add the changes to the ledger rows of a key from the date onward, creating the row of the date
+    from the row before it when the date was not a change-point yet.
+    """
+    if not queryset.filter(date=date, **key).exists():
+        row = queryset.filter(date__lt=date, **key).order_by("-date").first()
+        queryset.create(date=date, **key, **{field: getattr(row, field) if row else Decimal("0") for field in changes})
+    queryset.filter(date__gte=date, **key).update(**{field: F(field) + change for field, change in changes.items()})
+
+
+@db_transaction.atomic
+def apply_transaction(tx, sign: int = 1):
+    """
+    Apply a transaction to the ledgers, or revert it with sign=-1.
+    Only the rows from the date of the transaction onward are updated, with one UPDATE per ledger.
+    """
+    cash = {field: sign * change for field, change in get_cash_changes(tx.type, tx.amount).items()}
+    if any(cash.values()):
+        _shift(CashLedger.objects, tx.date, {}, cash)
+    ticker, quantity = get_position_change(tx.type, tx.ticker, tx.shares)
+    if quantity:
+        _shift(PositionLedger.objects, tx.date, {"ticker": ticker}, {"quantity": sign * quantity})
+
+
+def get_positions(date=None) -> dict:
+    """
+    Return the net quantity of every ticker ever traded as of a date (by default after all the transactions),
+    zero for the tickers no longer held. One query: the traded tickers are read from the (ticker, date) index,
+    and the last change-point of each on or before the date is found by a seek on that index.
+    """
+    rows = PositionLedger.objects.all()
+    if date is not None:
+        rows = rows.filter(date__lte=date)
+    last_quantity = rows.filter(ticker=OuterRef("ticker")).order_by("-date").values("quantity")[:1]
+    return dict(
+        rows.values("ticker").distinct().annotate(quantity=Subquery(last_quantity)).values_list("ticker", "quantity")
+    )
+
+
+def get_cash(date=None) -> dict:
+    """
+    Return the cash balance and the total deposits and withdrawals as of a date (by default after all the transactions).
+    """
+    rows = CashLedger.objects.all()
+    if date is not None:
+        rows = rows.filter(date__lte=date)
+    row = rows.order_by("-date").values(*CASH_FIELDS).first()
+    return row or {field: Decimal("0") for field in CASH_FIELDS}
+
+
+def get_change_points(transactions) -> tuple:
+    """
+    Return the ledger rows of (type, date, amount, ticker, shares) transaction tuples sorted by date:
+    the quantities keyed by (ticker, date) and the cash fields keyed by date.
+    """
+    positions, cash = {}, {}
+    quantities, totals = {}, dict.fromkeys(CASH_FIELDS, Decimal("0"))
+    for tx_type, date, amount, ticker, shares in transactions:
+        changes = get_cash_changes(tx_type, amount)
+        if any(changes.values()):
+            totals = {field: totals[field] + change for field, change in changes.items()}
+            cash[date] = totals
+        ticker, quantity = get_position_change(tx_type, ticker, shares)
+        if quantity:
+            quantities[ticker] = quantities.get(ticker, Decimal("0")) + quantity
+            positions[(ticker, date)] = quantities[ticker]
+    return positions, cash
+
+
+@db_transaction.atomic
+def rebuild_ledgers() -> tuple:
+    """
+    Rebuild both ledgers from all the transactions, e.g. after transactions were written in bulk,
+    which bypasses the signals. Returns the number of position and cash rows.
+    """
+    positions, cash = get_change_points(
+        Transaction.objects.order_by("date", "id").values_list("type", "date", "amount", "ticker", "shares")
+    )
+    PositionLedger.objects.all().delete()
+    CashLedger.objects.all().delete()
+    PositionLedger.objects.bulk_create(
+        [PositionLedger(ticker=ticker, date=date, quantity=quantity) for (ticker, date), quantity in positions.items()],
+        batch_size=BATCH_SIZE,
+    )
+    CashLedger.objects.bulk_create(
+        [CashLedger(date=date, **values) for date, values in cash.items()],
+        batch_size=BATCH_SIZE,
+    )
+    logger.info(f"Rebuilt the ledgers: {len(positions)} position and {len(cash)} cash change-points")
+    return len(positions), len(cash)
@@ -1,3 +1,63 @@
+from datetime import date
+from decimal import Decimal
 from django.test import TestCase
+from config.test_utils import QueryPlanAssertionsMixin
+from transactions.models import CashLedger, PositionLedger, Transaction
+from transactions.src.ledger import get_cash, get_positions, rebuild_ledgers
 
-# Create your tests here.
+
+class LedgerTest(TestCase):
+    """
+    The ledgers maintained on every transaction write must match the ones rebuilt from all the transactions.
+    """
+    def setUp(self):
+        Transaction.objects.create(type="deposit", date=date(2024, 1, 2), amount=Decimal("1000.00"))
+        Transaction.objects.create(type="buy", date=date(2024, 1, 3), amount=Decimal("300.00"), ticker="AAA", shares=Decimal("3"))
+        Transaction.objects.create(type="buy", date=date(2024, 1, 5), amount=Decimal("150.50"), ticker="BBB", shares=Decimal("1.5"))
+        Transaction.objects.create(type="fee", date=date(2024, 1, 5), amount=Decimal("-2.25"))
+        Transaction.objects.create(type="sell", date=date(2024, 1, 8), amount=Decimal("320.00"), ticker="AAA", shares=Decimal("3"))
+        Transaction.objects.create(type="withdrawal", date=date(2024, 1, 9), amount=Decimal("100.00"))
+
+    def snapshot(self):
+        return (
+            sorted(PositionLedger.objects.values_list("ticker", "date", "quantity")),
+            sorted(CashLedger.objects.values_list("date", "balance", "deposits", "withdrawals")),
+        )
+
+    def assertMatchesRebuild(self):
+        # Reverted transactions may leave change-points equal to the previous row, so the as-of values are compared
+        days = [date(2024, 1, day) for day in range(1, 12)]
+        maintained = [(get_positions(day), get_cash(day)) for day in days]
+        rebuild_ledgers()
+        self.assertEqual(maintained, [(get_positions(day), get_cash(day)) for day in days])
+
+    def test_as_of_values(self):
+        self.assertEqual(get_positions(date(2024, 1, 1)), {})
+        self.assertEqual(get_positions(date(2024, 1, 6)), {"AAA": Decimal("3"), "BBB": Decimal("1.5")})
+        self.assertEqual(get_positions(), {"AAA": Decimal("0"), "BBB": Decimal("1.5")})
+        self.assertEqual(get_cash(date(2024, 1, 4)), {"balance": Decimal("700.00"), "deposits": Decimal("1000.00"), "withdrawals": Decimal("0.00")})
+        self.assertEqual(get_cash(), {"balance": Decimal("767.25"), "deposits": Decimal("1000.00"), "withdrawals": Decimal("100.00")})
+        before = self.snapshot()
+        rebuild_ledgers()
+        self.assertEqual(self.snapshot(), before)
+
+    def test_backdated_edited_and_deleted_transactions(self):
+        Transaction.objects.create(type="buy", date=date(2024, 1, 4), amount=Decimal("200.00"), ticker="AAA", shares=Decimal("2"))
+        # A float amount, as sent by the add_transaction view
+        Transaction.objects.create(type="deposit", date=date(2024, 1, 1), amount=50.1)
+        sell = Transaction.objects.get(type="sell")
+        sell.date, sell.shares = date(2024, 1, 10), Decimal("4")
+        sell.save()
+        Transaction.objects.get(type="fee").delete()
+        self.assertEqual(get_positions(date(2024, 1, 9))["AAA"], Decimal("5"))
+        self.assertEqual(get_positions()["AAA"], Decimal("1"))
+        self.assertMatchesRebuild()
+
+
+class LedgerQueryPlanTest(QueryPlanAssertionsMixin, TestCase):
+    day = date(2024, 6, 3)
+
+    def test_as_of_queries_use_index(self):
+        self.assertNoFullTableScan(CashLedger.objects.filter(date__lte=self.day).order_by("-date")[:1])
+        self.assertNoFullTableScan(PositionLedger.objects.filter(ticker="AAA", date__lt=self.day).order_by("-date")[:1])
+        self.assertNoFullTableScan(PositionLedger.objects.filter(ticker="AAA", date__gte=self.day))
@@ -3,6 +3,7 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.forms.models import model_to_dict
 from django.utils.dateparse import parse_date
+from django.db import transaction as db_transaction
 from django.db.models import Q
 from rest_framework import status
 from .models import Transaction
@@ -45,16 +46,17 @@ def add_transaction(request):
         if not date:
             return JsonResponse({"status": "error", "message": "Invalid date format. Use YYYY-MM-DD."}, status=400)
 
-        # Create transaction
-        transaction = Transaction.objects.create(
-            type=data.get("type"),
-            amount=float(data["amount"]),
-            date=date,
-            user_id=data.get("user_id"),
-            ticker=data.get("ticker"),
-            shares=data.get("shares"),
-            metadata=data.get("metadata", {})
-        )
+        # Create transaction, the ledgers being updated in the same database transaction
+        with db_transaction.atomic():
+            transaction = Transaction.objects.create(
+                type=data.get("type"),
+                amount=float(data["amount"]),
+                date=date,
+                user_id=data.get("user_id"),
+                ticker=data.get("ticker"),
+                shares=data.get("shares"),
+                metadata=data.get("metadata", {})
+            )
 
         return JsonResponse({
             "status": "success",
@@ -109,8 +111,9 @@ def delete_transaction(request, transaction_id):
     Expects the transaction ID in the URL.
     """
     try:
-        transaction = Transaction.objects.get(id=transaction_id)
-        transaction.delete()
+        with db_transaction.atomic():
+            transaction = Transaction.objects.get(id=transaction_id)
+            transaction.delete()
         return JsonResponse({"message": f"Transaction {transaction_id} deleted successfully."}, status=status.HTTP_200_OK)
     except Transaction.DoesNotExist:
         return JsonResponse({"error": "Transaction not found."}, status=status.HTTP_404_NOT_FOUND)